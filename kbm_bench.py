@@ -0,0 +1,222 @@
+"""
+Benchmark skala pipeline KBM dengan workbook sintetis (lihat kbm_synth.py).
+
+Untuk setiap kombinasi jumlah baris (default 10k/100k/1M) dan jumlah cabang
+yang diproses (default 1 dan semua cabang `all_cabang_dict`), benchmark
+mengukur waktu tiap tahap lewat `kbm_profile` (load, status, tarif, blok per
+port, jurnal, tulis Excel) dan total run. Parse Excel hanya diukur sampai `--excel-max-rows` baris, karena
+membuat & membaca workbook 1 juta baris memakan waktu puluhan menit; di atas
+batas itu sheet sintetis langsung dibersihkan lewat `prepare_kbm`.
+
+Hasil disimpan sebagai `<run_id>.json` dan ditambahkan ke `bench.csv` di
+KBM_BENCH_DIR (default .kbm_cache/bench), diberi label versi (git commit)
+agar dapat dibandingkan antar versi dengan `--compare`.
+
+Contoh:
+    python kbm_bench.py --sizes 10000,100000 --cabang 1,47
+    python kbm_bench.py --sizes 10000 --compare .kbm_cache/bench/<run_id>.json
+    python kbm_bench.py --sizes 100000 --backend polars --label polars
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from kbm_engine import BACKEND, BACKENDS, all_cabang_dict, prepare_kbm, process_period
+from kbm_loader import load_kbm
+from kbm_profile import Profiler, stage
+from kbm_reference import BASE_DIR, CACHE_DIR, load_reference
+from kbm_synth import generate_sheets, write_workbook
+from kbm_writer import build_output
+
+BENCH_DIR = os.environ.get("KBM_BENCH_DIR", os.path.join(CACHE_DIR, "bench"))
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_BRANCH_COUNTS = (1, len(all_cabang_dict))
+EXCEL_MAX_ROWS = 100_000
+
+BULAN, TAHUN = "SEPTEMBER", "2025"
+
+# Tahap yang dirangkum per kasus (nama stage kbm_profile; parse Excel dijumlah)
+SUMMARY_STAGES = [
+    "write_input", "parse_excel", "clean_df", "doc_index", "load",
+    "status_masks", "tarif", "document_status", "detail_blocks", "journal",
+    "process_period", "write_excel", "total",
+]
+
+
+def code_version():
+    """Commit git saat ini (ditandai '+dirty' bila ada perubahan), atau 'unknown'."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}+dirty" if dirty else commit
+
+
+def select_branches(n):
+    """`n` cabang pertama `all_cabang_dict` (urutan tetap agar hasil sebanding; maks. semua cabang)."""
+    return list(all_cabang_dict)[:n]
+
+
+def _summarize(frame, total):
+    """Jumlah detik per tahap ringkasan dari tabel `Profiler.to_frame`."""
+    names = frame["stage"].str.replace(r"^parse_excel .*", "parse_excel", regex=True)
+    seconds = frame.groupby(names)["seconds"].sum()
+    summary = {name: round(float(seconds[name]), 6) for name in SUMMARY_STAGES if name in seconds}
+    summary["total"] = round(total, 6)
+    peak = frame["peak_mb"].max()
+    if pd.notna(peak):
+        summary["peak_mb"] = float(peak)
+    return summary
+
+
+def run_case(n_rows, n_branches, excel, reference, seed=0, memory=False, backend=None):
+    """Satu kasus benchmark; mengembalikan dict ringkasan per tahap."""
+    sheets = generate_sheets(n_rows, bulan=BULAN, tahun=TAHUN, seed=seed, reference=reference)
+    selected = select_branches(n_branches)
+
+    with Profiler(memory=memory) as profiler:
+        if excel:
+            with stage("write_input", n_rows):
+                data = write_workbook(sheets)
+            with stage("load", n_rows):
+                kbm = load_kbm(data, "synthetic.xlsx")
+        else:
+            with stage("load", n_rows):
+                kbm = prepare_kbm(sheets)
+        del sheets
+        # Tanpa cache hasil: setiap kasus menjalankan seluruh algoritma
+        result, _ = process_period(kbm, BULAN, TAHUN, selected, reference, backend=backend)
+        build_output(result)
+
+    # Waktu pembuatan input Excel bukan bagian dari run
+    frame = profiler.to_frame()
+    total = profiler.total_seconds - frame.loc[frame["stage"] == "write_input", "seconds"].sum()
+    # Jumlah cabang yang benar-benar diproses (n_branches bisa melebihi all_cabang_dict)
+    return {"rows": n_rows, "cabang": len(selected), "excel": excel, **_summarize(frame, total)}
+
+
+def save_results(results, meta, directory=BENCH_DIR):
+    """Menulis `<run_id>.json` dan menambah baris ke `bench.csv`; mengembalikan path JSON."""
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, f"{meta['run_id']}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+
+    csv_path = os.path.join(directory, "bench.csv")
+    fields = ["run_id", "version", "rows", "cabang", "excel", "stage", "seconds"]
+    new_file = not os.path.exists(csv_path)
+    with open(csv_path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        if new_file:
+            writer.writeheader()
+        for result in results:
+            for name in SUMMARY_STAGES:
+                if name in result:
+                    writer.writerow({
+                        "run_id": meta["run_id"], "version": meta["version"], "rows": result["rows"],
+                        "cabang": result["cabang"], "excel": result["excel"],
+                        "stage": name, "seconds": result[name],
+                    })
+    return json_path
+
+
+def results_frame(results):
+    """Tabel kasus x tahap (detik)."""
+    frame = pd.DataFrame(results)
+    columns = ["rows", "cabang", "excel"] + [c for c in SUMMARY_STAGES + ["peak_mb"] if c in frame]
+    return frame[columns]
+
+
+def compare_results(results, baseline_path):
+    """Rasio waktu (baru / baseline) per kasus dan tahap terhadap file JSON benchmark lain."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    keys = ["rows", "cabang", "excel"]
+    new = results_frame(results).set_index(keys)
+    old = results_frame(baseline["results"]).set_index(keys)
+    stages = [c for c in SUMMARY_STAGES if c in new.columns and c in old.columns]
+    common = new.index.intersection(old.index)
+    return (new.loc[common, stages] / old.loc[common, stages]).round(3), baseline["meta"].get("version")
+
+
+def _int_list(spec):
+    return [int(v) for v in spec.split(",") if v.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark skala pemrosesan KBM dengan data sintetis.")
+    parser.add_argument(
+        "--sizes", type=_int_list, default=list(DEFAULT_SIZES),
+        help="Jumlah baris dipisah koma (default 10000,100000,1000000)"
+    )
+    parser.add_argument(
+        "--cabang", type=_int_list, default=list(DEFAULT_BRANCH_COUNTS),
+        help=f"Jumlah cabang yang diproses, dipisah koma (default 1,{len(all_cabang_dict)})"
+    )
+    parser.add_argument(
+        "--excel-max-rows", type=int, default=EXCEL_MAX_ROWS,
+        help="Ukur parse Excel hanya sampai jumlah baris ini (0 = tidak pernah)"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Ulangi tiap kasus dan ambil waktu tercepat")
+    parser.add_argument("--memory", action="store_true", help="Catat puncak memori (tracemalloc, lebih lambat)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=BACKENDS, help="Backend mask status/List JMH/Status_dokumen (default KBM_BACKEND atau pandas)")
+    parser.add_argument("--label", help="Label versi (default: commit git)")
+    parser.add_argument("--compare", metavar="JSON", help="Bandingkan dengan hasil benchmark sebelumnya")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reference = load_reference()
+    meta = {
+        "run_id": time.strftime("%Y%m%d-%H%M%S"),
+        "version": args.label or code_version(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "backend": args.backend or BACKEND,
+    }
+
+    results = []
+    for n_rows in args.sizes:
+        for n_branches in args.cabang:
+            excel = n_rows <= args.excel_max_rows
+            runs = [
+                run_case(n_rows, n_branches, excel, reference, seed=args.seed, memory=args.memory, backend=args.backend)
+                for _ in range(max(args.repeat, 1))
+            ]
+            best = min(runs, key=lambda r: r["total"])
+            results.append(best)
+            print(
+                f"{n_rows:>9} baris, {best['cabang']:>2} cabang{' (excel)' if excel else ''}: "
+                f"{best['total']:.2f} s"
+            )
+
+    print(results_frame(results).to_string(index=False))
+    print(f"Hasil: {save_results(results, meta)}")
+
+    if args.compare:
+        ratios, version = compare_results(results, args.compare)
+        print(f"Rasio waktu terhadap {version} (< 1 = lebih cepat):")
+        print(ratios.to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
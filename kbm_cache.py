@@ -0,0 +1,465 @@
+"""
+Cache DATA_KBM yang diunggah, dikunci dengan hash isi file.
+
+Hasil `prepare_kbm` (empat sheet yang sudah melewati `clean_df` beserta index
+nomor dokumennya) disimpan per field di disk lokal. Unggahan ulang dengan isi yang sama (misalnya untuk
+bulan atau cabang lain) langsung memuat frame tersebut tanpa mem-parse Excel
+lagi. Ukuran total cache dibatasi dan entri yang paling lama tidak dipakai
+dihapus lebih dulu (LRU).
+
+Hasil pemrosesan untuk SEMUA cabang juga disimpan per (hash file, bulan,
+tahun). Mengganti pilihan cabang cukup memotong hasil tersebut
+(`slice_result`) tanpa menjalankan algoritma lagi.
+
+Sheet bersih dan hasil periode berbagi satu cache memori per proses
+(`shared_cache`) yang dipakai semua sesi: batas total ukuran
+(KBM_MEMORY_CACHE_MB, diperkirakan dengan `deep_sizeof`), LRU, dan hasil
+periode yang dikeluarkan ditulis (spill) ke disk lalu dibaca lagi bila
+diminta. Counter hit/miss/eviction setiap lapisan tersedia di `cache_stats`.
+
+Kunci hasil periode memuat `RESULT_VERSION` (hash kode engine), sehingga
+hasil yang dihitung versi engine lain tidak pernah dipakai ulang.
+
+Frame disimpan sebagai pickle pandas (blok kolom numpy) karena kolom sheet
+KBM bertipe campuran (angka & teks dalam satu kolom) dan harus kembali
+persis sama; format seperti Parquet akan mengubah tipe kolom tersebut.
+"""
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from kbm_engine import KBMData, all_cabang_dict, check_cabang, hitung_periode, process_period, slice_result
+from kbm_loader import load_kbm
+from kbm_profile import stage
+from kbm_reference import CACHE_DIR, load_reference, reference_cache_info, reference_digests
+
+UPLOAD_CACHE_DIR = os.path.join(CACHE_DIR, "uploads")
+UPLOAD_CACHE_MAX_BYTES = int(os.environ.get("KBM_UPLOAD_CACHE_MB", "1024")) * 1024 * 1024
+
+# Anggaran memori bersama (sheet bersih + hasil periode) untuk seluruh proses server
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get("KBM_MEMORY_CACHE_MB", "512")) * 1024 * 1024
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("KBM_MEMORY_CACHE_ENTRIES", "32"))
+
+# Hasil periode yang keluar dari memori disimpan di disk (0 = dibuang saja)
+RESULT_SPILL = os.environ.get("KBM_RESULT_SPILL", "1") == "1"
+RESULT_SPILL_DIR = os.path.join(CACHE_DIR, "results")
+RESULT_SPILL_MAX_BYTES = int(os.environ.get("KBM_RESULT_SPILL_MB", "1024")) * 1024 * 1024
+
+# Naikkan jika hasil clean_df/prepare_kbm berubah agar cache lama tidak terpakai
+CACHE_VERSION = "7"
+
+# Modul yang menentukan isi hasil periode (klasifikasi, blok detail, jurnal, tarif)
+RESULT_MODULES = ("kbm_engine.py", "kbm_polars.py", "kbm_reference.py")
+
+
+def _source_digest(names):
+    h = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in names:
+        try:
+            with open(os.path.join(base, name), "rb") as f:
+                h.update(f.read())
+        except OSError:
+            h.update(name.encode())
+    return h.hexdigest()[:16]
+
+
+# Bagian kunci hasil periode: berubah otomatis setiap kode engine berubah, sehingga
+# hasil lama (termasuk yang di-spill ke disk dan bertahan lintas restart) tidak
+# terpakai lagi setelah perbaikan engine/jurnal; entri lama habis lewat eviction LRU
+RESULT_VERSION = _source_digest(RESULT_MODULES)
+
+
+def read_source_bytes(source):
+    """Isi file dari path, UploadedFile Streamlit, atau objek file biner."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    pos = source.tell()
+    data = source.read()
+    source.seek(pos)
+    return data
+
+
+def content_digest(data):
+    """Sidik jari unggahan: sha256 dari isi file + versi format cache."""
+    h = hashlib.sha256(data)
+    h.update(CACHE_VERSION.encode())
+    return h.hexdigest()
+
+
+def deep_sizeof(obj):
+    """Perkiraan byte objek cache (DataFrame/array, rekursif untuk tuple/list/dict)."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(deep_sizeof(v) for v in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(deep_sizeof(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class DiskLRU:
+    """Cache direktori-per-kunci di disk dengan batas ukuran total (LRU via mtime)."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Path entri jika ada (sekaligus menandainya baru dipakai), selain itu None."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, write_fn):
+        """
+        Membuat entri lewat `write_fn(tmp_dir)` lalu memasangnya secara atomik,
+        menggantikan entri lama dengan kunci yang sama.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(f".tmp-{key}-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            write_fn(tmp)
+            self._install(tmp, key)
+        except OSError:
+            # Gagal menulis (mis. disk penuh): entri dilewati, cache bersifat tambahan
+            shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return self._path(key)
+
+    def _install(self, tmp, key):
+        path = self._path(key)
+        try:
+            os.replace(tmp, path)
+            return
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        # Entri lama disingkirkan dulu (os.replace tidak menimpa folder berisi)
+        old = self._path(f".tmp-old-{key}-{uuid.uuid4().hex}")
+        try:
+            os.replace(path, old)
+        except OSError:
+            pass
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Entri baru dipasang sesi lain pada saat yang sama
+            shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-"):
+                continue
+            path = self._path(name)
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+                )
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        """Menghapus entri tertua sampai total ukuran <= max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if keep and os.path.basename(path) == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        """Jumlah entri, ukuran, dan counter hit/miss/eviction."""
+        with self._lock:
+            entries = self._entries()
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+        }
+
+
+upload_cache = DiskLRU(UPLOAD_CACHE_DIR, UPLOAD_CACHE_MAX_BYTES)
+
+
+def _write_kbm(kbm):
+    def write(directory):
+        # Termasuk doc_index, supaya nomor dokumen tidak di-parse ulang
+        for field, value in kbm._asdict().items():
+            pd.to_pickle(value, os.path.join(directory, f"{field}.pkl"))
+    return write
+
+
+def _read_kbm(directory):
+    return KBMData(**{
+        field: pd.read_pickle(os.path.join(directory, f"{field}.pkl"))
+        for field in KBMData._fields
+    })
+
+
+class _MemoryEntry(NamedTuple):
+    value: object
+    size: int
+    spill: bool
+
+
+class MemoryLRU:
+    """
+    Cache kunci -> objek di memori dengan batas jumlah entri dan/atau total
+    byte (`deep_sizeof`), LRU. Bila `spill` (DiskLRU) diberikan, entri yang
+    ditandai `spill=True` saat `put` ditulis ke disk ketika dikeluarkan dan
+    dibaca kembali pada `get` berikutnya. Entri yang lebih besar dari
+    `max_bytes` tidak disimpan di memori (langsung di-spill bila boleh).
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, spill=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.spills = self.spill_hits = 0
+
+    @staticmethod
+    def _spill_key(key):
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+        return self._load_spilled(key)
+
+    def _load_spilled(self, key):
+        if self.spill is None:
+            return None
+        path = self.spill.get(self._spill_key(key))
+        if path is None:
+            return None
+        try:
+            value = pd.read_pickle(os.path.join(path, "value.pkl"))
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        with self._lock:
+            self.spill_hits += 1
+        # Masih ada salinan di disk: boleh dikeluarkan lagi tanpa ditulis ulang
+        self._insert(key, value, spill=False)
+        return value
+
+    def put(self, key, value, spill=True):
+        self._insert(key, value, spill)
+        return value
+
+    def _insert(self, key, value, spill):
+        size = deep_sizeof(value) if self.max_bytes is not None else 0
+        entry = _MemoryEntry(value, size, spill and self.spill is not None)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            if self.max_bytes is not None and size > self.max_bytes:
+                evicted = [(key, entry)]
+            else:
+                self._data[key] = entry
+                self._bytes += size
+                evicted = self._evict()
+        # Menulis ke disk di luar lock agar sesi lain tidak ikut menunggu
+        for evicted_key, evicted_entry in evicted:
+            if evicted_entry.spill:
+                self._write_spill(evicted_key, evicted_entry.value)
+
+    def _evict(self):
+        evicted = []
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def _write_spill(self, key, value):
+        def write(directory):
+            pd.to_pickle(value, os.path.join(directory, "value.pkl"))
+        try:
+            self.spill.put(self._spill_key(key), write)
+        except OSError:
+            # Spill bersifat tambahan: gagal menulis sama dengan membuang entri
+            return
+        with self._lock:
+            self.spills += 1
+
+    def stats(self):
+        """Jumlah entri, ukuran, dan counter hit/miss/eviction/spill."""
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "spill_hits": self.spill_hits,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class PeriodResult(NamedTuple):
+    """Hasil satu periode untuk semua cabang, siap dipotong per cabang."""
+    result: object        # AccrualResult untuk semua cabang
+    journal_port: object  # Port Id asal tiap baris FULL_NO_JMH
+    reference: tuple      # reference_digests saat dihitung (cek basi)
+
+
+shared_cache = MemoryLRU(
+    MEMORY_CACHE_MAX_ENTRIES, MEMORY_CACHE_MAX_BYTES,
+    spill=DiskLRU(RESULT_SPILL_DIR, RESULT_SPILL_MAX_BYTES) if RESULT_SPILL else None,
+)
+
+
+def cache_stats(memory=shared_cache, uploads=upload_cache):
+    """Tabel statistik tiap lapisan cache (untuk UI)."""
+    rows = {"memori bersama": memory.stats(), "disk unggahan": uploads.stats()}
+    if memory.spill is not None:
+        rows["disk hasil (spill)"] = memory.spill.stats()
+    n_tables, ref_bytes = reference_cache_info()
+    rows["referensi"] = {"entries": n_tables, "bytes": ref_bytes}
+    frame = pd.DataFrame.from_dict(rows, orient="index")
+    counters = [c for c in frame.columns if c not in ("bytes", "max_bytes")]
+    frame[counters] = frame[counters].astype("Int64")
+    for col in ("bytes", "max_bytes"):
+        frame[col.replace("bytes", "MB")] = (frame.pop(col) / 2**20).round(1)
+    return frame.rename_axis("cache").reset_index()
+
+
+def load_kbm_cached(source, cache=upload_cache, parallel=None, memo=None, streaming=None,
+                    memory=shared_cache):
+    """
+    Mengembalikan (KBMData, digest) untuk file DATA_KBM.
+
+    Jika isi file yang sama pernah diproses, sheet bersih diambil dari cache
+    memori bersama (`memory`) atau dibaca dari cache disk; selain itu workbook
+    di-parse (paralel bila `parallel`, per chunk bila `streaming`),
+    dibersihkan, lalu disimpan. `memo` diteruskan ke `load_kbm` (lihat
+    kbm_incremental.py). KBMData yang dikembalikan dipakai bersama dan tidak
+    boleh diubah.
+    """
+    name = getattr(source, "name", str(source))
+    data = read_source_bytes(source)
+    digest = content_digest(data)
+
+    kbm = memory.get(("kbm", digest))
+    if kbm is not None:
+        return kbm, digest
+
+    path = cache.get(digest)
+    if path is not None:
+        try:
+            with stage("cache_read"):
+                kbm = _read_kbm(path)
+            # Salinan disk sudah ada: tidak perlu di-spill saat dikeluarkan
+            return memory.put(("kbm", digest), kbm, spill=False), digest
+        except Exception:
+            # Entri rusak (mis. terpotong saat eviction): bangun ulang
+            shutil.rmtree(path, ignore_errors=True)
+
+    kbm = load_kbm(data, name, parallel=parallel, memo=memo, streaming=streaming)
+    cache.put(digest, _write_kbm(kbm))
+    return memory.put(("kbm", digest), kbm, spill=False), digest
+
+
+def process_cached(kbm, digest, input_bulan, input_tahun, selected_cabang, reference=None,
+                   cache=shared_cache, progress=None):
+    """
+    `run_processing` dengan memo per (digest, bulan, tahun).
+
+    Hitungan pertama memproses semua cabang; panggilan berikutnya untuk periode
+    yang sama (cabang apa pun) hanya memotong hasil tersebut. Entri dianggap
+    basi bila file referensi (list_COA/list_tarif) sudah berubah.
+    """
+    check_cabang(selected_cabang)
+    entry = period_result(kbm, digest, input_bulan, input_tahun, reference, cache, progress)
+    return slice_result(entry.result, entry.journal_port, selected_cabang)
+
+
+def period_result(kbm, digest, input_bulan, input_tahun, reference=None, cache=shared_cache, progress=None,
+                  classify=None):
+    """
+    `PeriodResult` semua cabang untuk satu periode (dari memo bila ada).
+    `classify` diteruskan ke `process_period` (mode inkremental).
+    """
+    hitung_periode(input_bulan, input_tahun)
+    if reference is None:
+        reference = load_reference()
+
+    # Bulan tidak dinormalisasi: teksnya ikut tertulis di jurnal (ACCRUE ...)
+    key = ("result", RESULT_VERSION, digest, input_bulan, str(input_tahun))
+    entry = cache.get(key)
+    # Referensi di luar cache kbm_reference (digest None) tidak pernah dianggap sama
+    version = reference_digests(reference)
+    stale = entry is not None and (None in version or entry.reference != version)
+    if entry is None or stale:
+        result, journal_port = process_period(
+            kbm, input_bulan, input_tahun, list(all_cabang_dict), reference, progress=progress, classify=classify
+        )
+        entry = cache.put(key, PeriodResult(result, journal_port, version))
+    return entry
@@ -0,0 +1,285 @@
+"""
+CLI batch untuk pemrosesan KBM Accrual tanpa browser.
+
+Contoh:
+    python kbm_cli.py DATA_KBM.xls --job SEPTEMBER:2025:AMB,BPN --job OKTOBER:2025:ALL -o hasil/
+    python kbm_cli.py DATA_KBM.xls --batch JULI:2025..SEPTEMBER:2025:ALL --combined
+    python kbm_cli.py DATA_KBM.xlsx --job SEPTEMBER:2025:AMB --stream --chunk-rows 20000
+    python kbm_cli.py DATA_KBM.xls --job SEPTEMBER:2025:ALL --zip
+    python kbm_cli.py DATA_KBM.xls --job SEPTEMBER:2025:ALL --journal-only --journal csv,parquet
+    python kbm_cli.py DATA_KBM.xls --batch JULI:2025..DESEMBER:2025:ALL --backend polars
+
+Workbook DATA_KBM dan file referensi hanya dibaca sekali, lalu dipakai ulang
+oleh semua job. Modul ini tidak mengimpor Streamlit.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+from kbm_engine import (
+    BACKENDS,
+    KBMInputError,
+    all_cabang_dict,
+    check_cabang,
+    get_backend,
+    kode_periode,
+    period_range,
+    process_period,
+    split_by_branch,
+)
+from kbm_cache import load_kbm_cached, read_source_bytes
+from kbm_export import JOURNAL_FORMATS, export_journal, parquet_available
+from kbm_incremental import load_kbm_incremental
+from kbm_loader import CHUNK_ROWS, load_kbm, load_kbm_streaming
+from kbm_profile import PROFILE_ENABLED, Profiler
+from kbm_reference import load_reference
+from kbm_writer import (
+    batch_file_name,
+    build_batch_output,
+    build_branch_zip,
+    build_output,
+    output_file_name,
+    zip_file_name,
+)
+
+
+def parse_job(spec):
+    """Mengurai 'BULAN:TAHUN:CAB1,CAB2' (atau 'BULAN:TAHUN:ALL') menjadi tuple job."""
+    try:
+        bulan, tahun, cabang = spec.split(":")
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Format job tidak valid: {spec!r} (contoh: SEPTEMBER:2025:AMB,BPN)"
+        )
+    if cabang.strip().upper() == "ALL":
+        cabang_list = list(all_cabang_dict.keys())
+    else:
+        cabang_list = [c.strip().upper() for c in cabang.split(",") if c.strip()]
+    # Ditolak saat mengurai argumen, sebelum DATA_KBM dimuat
+    try:
+        check_cabang(cabang_list)
+    except KBMInputError as e:
+        raise argparse.ArgumentTypeError(f"{spec!r}: {e}")
+    return bulan.strip().upper(), tahun.strip(), cabang_list
+
+
+def parse_batch(spec):
+    """Mengurai 'BULAN:TAHUN..BULAN:TAHUN:CABANG' menjadi (daftar periode, cabang)."""
+    try:
+        rentang, cabang = spec.rsplit(":", 1)
+        awal, akhir = rentang.split("..")
+        bulan_awal, tahun_awal = awal.split(":")
+        bulan_akhir, tahun_akhir = akhir.split(":")
+        periods = period_range(bulan_awal.strip(), tahun_awal.strip(), bulan_akhir.strip(), tahun_akhir.strip())
+    except (ValueError, KBMInputError) as e:
+        raise argparse.ArgumentTypeError(
+            f"Format batch tidak valid: {spec!r} (contoh: JULI:2025..SEPTEMBER:2025:ALL). {e}"
+        )
+    _, _, cabang_list = parse_job(f"{periods[0][0]}:{periods[0][1]}:{cabang}")
+    return periods, cabang_list
+
+
+def parse_formats(spec):
+    """Mengurai 'csv,parquet' menjadi daftar format jurnal."""
+    formats = [f.strip().lower() for f in spec.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in JOURNAL_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"Format jurnal tidak dikenal: {spec!r} (pilihan: {', '.join(JOURNAL_FORMATS)})"
+        )
+    return formats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pemrosesan KBM Accrual (batch, tanpa Streamlit).")
+    parser.add_argument("input", help="Path file DATA_KBM (.xls/.xlsx)")
+    parser.add_argument(
+        "--job", action="append", type=parse_job, default=[], metavar="BULAN:TAHUN:CABANG",
+        help="Job yang dijalankan; boleh diulang. CABANG dipisah koma atau ALL."
+    )
+    parser.add_argument(
+        "--batch", action="append", type=parse_batch, default=[], metavar="AWAL..AKHIR:CABANG",
+        help="Rentang bulan dari satu kali load, mis. JULI:2025..SEPTEMBER:2025:ALL; boleh diulang."
+    )
+    parser.add_argument(
+        "--combined", action="store_true",
+        help="Tulis setiap --batch sebagai satu workbook (sheet diawali kode yymm periode)"
+    )
+    parser.add_argument("-o", "--output-dir", default=".", help="Folder hasil (default: folder saat ini)")
+    load_mode = parser.add_mutually_exclusive_group()
+    load_mode.add_argument(
+        "--no-cache", action="store_true",
+        help="Selalu parse ulang DATA_KBM (abaikan cache unggahan di disk)"
+    )
+    load_mode.add_argument(
+        "--incremental", action="store_true",
+        help="Bandingkan dengan unggahan sebelumnya (laporan delta) dan pakai ulang hasil parse dokumen "
+             "serta status/biaya per baris yang tidak berubah"
+    )
+    load_mode.add_argument(
+        "--stream", action="store_true",
+        help="Baca DATA_KBM per chunk, hanya lengkap untuk cabang yang diminta (tanpa cache unggahan)"
+    )
+    parser.add_argument(
+        "--chunk-rows", type=int, default=CHUNK_ROWS,
+        help=f"Jumlah baris per chunk untuk --stream (default {CHUNK_ROWS})"
+    )
+    parser.add_argument(
+        "--parallel-load", action="store_true",
+        help="Parse keempat sheet DATA_KBM di process pool terpisah"
+    )
+    parser.add_argument(
+        "--zip", action="store_true",
+        help="Tulis ZIP berisi satu workbook per cabang (dirender paralel, lihat KBM_EXPORT_WORKERS)"
+    )
+    parser.add_argument(
+        "--journal", type=parse_formats, metavar="FORMAT",
+        help="Tulis juga JURNAL NO JMH dan List JMH sebagai csv/parquet (dipisah koma)"
+    )
+    parser.add_argument(
+        "--journal-only", action="store_true",
+        help="Hanya tulis file jurnal (default csv); blok detail dan workbook Excel dilewati"
+    )
+    parser.add_argument(
+        "--backend", choices=BACKENDS,
+        help="Backend klasifikasi, tarif, List JMH, Status_dokumen, dan jurnal NO JMH (default KBM_BACKEND "
+             "atau pandas). polars menjalankannya sebagai rencana lazy multi-thread; load dan blok tetap pandas"
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Catat waktu, jumlah baris, dan puncak memori per tahap; tulis log run JSON/CSV"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.job and not args.batch:
+        parser.error("minimal satu --job atau --batch harus diberikan")
+    if args.journal_only and args.zip:
+        parser.error("--journal-only tidak dapat digabung dengan --zip")
+    if args.journal_only and not args.journal:
+        args.journal = ["csv"]
+    if args.journal and "parquet" in args.journal and not parquet_available():
+        parser.error("format parquet memerlukan paket pyarrow")
+    try:
+        get_backend(args.backend)
+    except KBMInputError as e:
+        parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    profiler = None
+    if args.profile or PROFILE_ENABLED:
+        profiler = Profiler(meta={"input": args.input, "argv": list(argv if argv is not None else sys.argv[1:])})
+    with profiler or contextlib.nullcontext():
+        status = run(args)
+    if profiler is not None:
+        print("Profil tahap:\n" + profiler.to_frame().to_string(index=False))
+        print(f"Log run: {profiler.write_run_log()}")
+    return status
+
+
+def run(args):
+    """Menjalankan semua --job/--batch dari argumen yang sudah diurai."""
+    # Batch tanpa --combined = satu job per periode
+    jobs = list(args.job)
+    if not args.combined:
+        for periods, cabang in args.batch:
+            jobs.extend((bulan, tahun, cabang) for bulan, tahun in periods)
+
+    t0 = time.perf_counter()
+    parallel = args.parallel_load or None
+    classify = None
+    if args.stream:
+        # Cakupan = gabungan cabang semua job/batch; cabang lain hanya kolom kunci
+        cabang = sorted({c for _, _, job_cabang in args.job for c in job_cabang}
+                        | {c for _, batch_cabang in args.batch for c in batch_cabang})
+        kbm = load_kbm_streaming(read_source_bytes(args.input), args.input, args.chunk_rows, cabang)
+    elif args.no_cache:
+        kbm = load_kbm(read_source_bytes(args.input), args.input, parallel=parallel)
+    elif args.incremental:
+        kbm, _, delta, classify = load_kbm_incremental(args.input, parallel=parallel)
+        print("Delta terhadap unggahan sebelumnya:\n" + delta.to_string(index=False))
+    else:
+        kbm, _ = load_kbm_cached(args.input, parallel=parallel)
+    reference = load_reference()
+    print(f"Load DATA_KBM + referensi: {time.perf_counter() - t0:.2f} s")
+
+    for n, (bulan, tahun, cabang) in enumerate(jobs, start=1):
+        t_job = time.perf_counter()
+        try:
+            result, journal_port = process_period(
+                kbm, bulan, tahun, cabang, reference, blocks=not args.journal_only, backend=args.backend,
+                classify=classify,
+            )
+        except KBMInputError as e:
+            print(f"[job {n}] dilewati: {e}", file=sys.stderr)
+            continue
+        t_proc = time.perf_counter() - t_job
+
+        if not result.missing_tarif.empty:
+            print(
+                f"[job {n}] peringatan: {int(result.missing_tarif['Jumlah Baris'].sum())} baris NO_DOC FB "
+                "tanpa tarif:\n" + result.missing_tarif.to_string(index=False),
+                file=sys.stderr,
+            )
+
+        file_name = output_file_name(bulan, tahun)
+        if len(jobs) > 1:
+            file_name = file_name.replace(".xlsx", f"_{n:02d}.xlsx")
+        period_results = [(kode_periode(bulan, tahun), result, journal_port)]
+        paths = write_outputs(args, period_results, cabang, file_name)
+
+        print(
+            f"[job {n}] {bulan} {tahun} ({len(cabang)} cabang): "
+            f"proses {t_proc:.2f} s, total {time.perf_counter() - t_job:.2f} s -> {', '.join(paths)}"
+        )
+
+    if args.combined:
+        for periods, cabang in args.batch:
+            t_batch = time.perf_counter()
+            # Satu load untuk semua periode, journal_port ikut disimpan
+            period_results = [
+                (kode_periode(bulan, tahun),
+                 *process_period(kbm, bulan, tahun, cabang, reference,
+                                 blocks=not args.journal_only, backend=args.backend, classify=classify))
+                for bulan, tahun in periods
+            ]
+            paths = write_outputs(args, period_results, cabang, batch_file_name(periods), batch=True)
+            print(
+                f"[batch] {len(periods)} periode ({len(cabang)} cabang): "
+                f"{time.perf_counter() - t_batch:.2f} s -> {', '.join(paths)}"
+            )
+
+    print(f"Selesai dalam {time.perf_counter() - t0:.2f} s")
+    return 0
+
+
+def write_outputs(args, period_results, cabang, file_name, batch=False):
+    """
+    Menulis workbook (atau ZIP per cabang) dan/atau file jurnal untuk
+    (kode_periode, AccrualResult, journal_port) di `period_results`;
+    mengembalikan path yang ditulis.
+    """
+    results = [(kode, result) for kode, result, _ in period_results]
+    paths = []
+    if not args.journal_only:
+        if args.zip:
+            output = build_branch_zip(split_by_branch(period_results, cabang), file_name)
+            path = os.path.join(args.output_dir, zip_file_name(file_name))
+        else:
+            output = build_batch_output(results) if batch else build_output(results[0][1])
+            path = os.path.join(args.output_dir, file_name)
+        with open(path, "wb") as f:
+            f.write(output.getvalue())
+        paths.append(path)
+    if args.journal:
+        paths.extend(export_journal(results, args.output_dir, file_name.replace(".xlsx", ""), args.journal))
+    return paths
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""
+Harness diferensial: membandingkan output implementasi referensi dan kandidat.
+
+Setiap implementasi adalah satu revisi git (`--reference`, default HEAD) atau
+folder kerja ini (`--candidate`, default). Revisi diekspor ke folder sementara
+lalu dijalankan di subprocess terpisah dengan API yang sama sejak kbm_engine
+dipisahkan dari halaman Streamlit: `read_kbm_workbook` -> `prepare_kbm` ->
+`run_processing` -> `kbm_writer.build_output`. Kedua sisi memproses input yang
+sama (file DATA_KBM dan/atau workbook sintetis dari kbm_synth.py). Workbook
+sintetis memuat baris jarang (`--sparse-ratio`) yang terisi tepat 5 atau 4 sel
+termasuk kolom yang tidak dipakai, sebagai kasus regresi ambang baris jarang.
+
+Sisi referensi selalu memakai jalur baseline di atas. Sisi kandidat dapat
+dijalankan lewat jalur optimasi (`--loader`, `--backend`, `--sliced`, atau
+`--matrix` untuk semua kombinasi), masing-masing di subprocess dan cache
+terpisah, sehingga setiap jalur dibandingkan langsung dengan output baseline:
+
+- loader: baseline, loader (`kbm_loader.load_kbm`, deteksi header + usecols),
+  stream (`load_kbm_streaming`, cakupan = cabang semua job), cached
+  (`kbm_cache.load_kbm_cached`);
+- backend: pandas / polars (KBM_BACKEND, lihat `kbm_engine.get_backend`);
+- sliced: `process_cached` (semua cabang lalu `slice_result`) alih-alih
+  `run_processing` per job.
+
+Yang dibandingkan per job: dfs_FL, dfs_FB (per port), JMH_gabungan,
+FULL_NO_JMH, dan nilai setiap sel workbook output. Angka dibandingkan dengan
+toleransi (`--rtol`/`--atol`) karena urutan penjumlahan dapat berubah; tipe
+kolom (mis. category vs object) tidak dianggap beda selama nilainya sama.
+Rasio waktu load/proses/tulis (kandidat / referensi) ikut dilaporkan.
+
+Contoh:
+    python kbm_diff.py --input DATA_KBM.xls --job SEPTEMBER:2025:ALL
+    python kbm_diff.py --synthetic 100000 --reference a79cbd0 --job OKTOBER:2025:AMB,BPN
+    python kbm_diff.py --input DATA_KBM.xls --reference a79cbd0 --loader stream --backend polars --sliced
+    python kbm_diff.py --synthetic 20000 --reference a79cbd0 --matrix
+"""
+import argparse
+import importlib.util
+import io
+import json
+import math
+import os
+import pickle
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from itertools import product, zip_longest
+from numbers import Number
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from kbm_cli import parse_job
+from kbm_engine import BACKENDS
+from kbm_reference import BASE_DIR
+from kbm_synth import generate_workbook
+
+# Batas jumlah selisih yang dicatat per objek yang dibandingkan
+MAX_DIFFS = 20
+
+# Jalur load kandidat (lihat docstring modul)
+LOADERS = ("baseline", "loader", "stream", "cached")
+
+
+class CandidatePath(NamedTuple):
+    """Jalur kode yang dijalankan di sisi kandidat."""
+    loader: str = "baseline"
+    backend: str = None   # None = default implementasi (KBM_BACKEND)
+    sliced: bool = False  # process_cached + slice_result
+
+    @property
+    def label(self):
+        parts = [self.loader, self.backend or "default"]
+        if self.sliced:
+            parts.append("sliced")
+        return "/".join(parts)
+
+
+BASELINE = CandidatePath()
+
+# Dijalankan di subprocess dengan sys.path[0] = folder implementasi
+_RUNNER = r"""
+import os, pickle, sys, time, warnings
+warnings.filterwarnings("ignore")
+sys.path.insert(0, sys.argv[1])
+from kbm_engine import prepare_kbm, read_kbm_workbook, run_processing
+from kbm_writer import build_output
+
+with open(sys.argv[2], "rb") as f:
+    spec = pickle.load(f)
+loader = spec.get("loader", "baseline")
+sliced = spec.get("sliced", False)
+if spec.get("backend"):
+    # KBM_BACKEND sudah diset oleh pemanggil; pastikan backend tersedia di implementasi ini
+    from kbm_engine import get_backend
+    get_backend(spec["backend"])
+
+
+def load(path):
+    if loader == "baseline":
+        return prepare_kbm(read_kbm_workbook(path))
+    if loader == "cached":
+        from kbm_cache import load_kbm_cached
+        return load_kbm_cached(path)[0]
+    with open(path, "rb") as f:
+        data = f.read()
+    if loader == "loader":
+        from kbm_loader import load_kbm
+        return load_kbm(data, path)
+    from kbm_loader import load_kbm_streaming
+    return load_kbm_streaming(data, path, cabang=spec["scope"])
+
+
+out = []
+for path in spec["inputs"]:
+    t0 = time.perf_counter()
+    kbm = load(path)
+    load_seconds = time.perf_counter() - t0
+    if sliced:
+        from kbm_cache import content_digest, process_cached
+        with open(path, "rb") as f:
+            digest = content_digest(f.read())
+    for bulan, tahun, cabang in spec["jobs"]:
+        t0 = time.perf_counter()
+        if sliced:
+            result = process_cached(kbm, digest, bulan, tahun, cabang)
+        else:
+            result = run_processing(kbm, bulan, tahun, cabang)
+        t1 = time.perf_counter()
+        workbook = build_output(result).getvalue()
+        t2 = time.perf_counter()
+        out.append({
+            "input": path, "job": (bulan, tahun, list(cabang)),
+            "result": tuple(result)[:5], "workbook": workbook,
+            "seconds": {"load": load_seconds, "process": t1 - t0, "write": t2 - t1},
+        })
+with open(sys.argv[3], "wb") as f:
+    pickle.dump(out, f)
+"""
+
+
+def export_revision(rev, directory):
+    """Mengekspor isi revisi git `rev` ke `directory` (git archive)."""
+    archive = subprocess.run(
+        ["git", "archive", "--format=tar", rev], cwd=BASE_DIR, capture_output=True, check=True,
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return directory
+
+
+def run_implementation(source_dir, inputs, jobs, workdir, path=BASELINE):
+    """
+    Menjalankan satu implementasi lewat jalur `path` di subprocess; mengembalikan
+    daftar hasil per (input, job).
+    """
+    spec_path = os.path.join(workdir, "spec.pkl")
+    out_path = os.path.join(workdir, "out.pkl")
+    # Cakupan load streaming = gabungan cabang semua job (seperti kbm_cli --stream)
+    scope = sorted({c for _, _, cabang in jobs for c in cabang})
+    with open(spec_path, "wb") as f:
+        pickle.dump({"inputs": inputs, "jobs": jobs, "scope": scope, **path._asdict()}, f)
+    # Cache terpisah per sisi/jalur agar hasil/snapshot satu jalur tidak dipakai jalur lain
+    env = dict(os.environ, KBM_CACHE_DIR=os.path.join(workdir, "cache"))
+    if path.backend:
+        env["KBM_BACKEND"] = path.backend
+    subprocess.run(
+        [sys.executable, "-c", _RUNNER, source_dir, spec_path, out_path],
+        cwd=source_dir, env=env, check=True,
+    )
+    with open(out_path, "rb") as f:
+        return pickle.load(f)
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def _is_missing(value):
+    if value is None:
+        return True
+    try:
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def values_equal(a, b, rtol, atol):
+    """Sama untuk satu sel: kosong == kosong, angka dengan toleransi, lainnya ==."""
+    if _is_missing(a) or _is_missing(b):
+        return _is_missing(a) and _is_missing(b)
+    if _is_number(a) and _is_number(b):
+        return math.isclose(float(a), float(b), rel_tol=rtol, abs_tol=atol)
+    return a == b
+
+
+def _column_mismatches(a, b, rtol, atol):
+    """Posisi baris yang berbeda antara dua kolom (Series) sepanjang sama."""
+    if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b) \
+            and not pd.api.types.is_bool_dtype(a) and not pd.api.types.is_bool_dtype(b):
+        x = a.to_numpy(dtype=float, na_value=np.nan)
+        y = b.to_numpy(dtype=float, na_value=np.nan)
+        same = np.isclose(x, y, rtol=rtol, atol=atol, equal_nan=True)
+        return np.flatnonzero(~same)
+    x = a.astype(object).to_numpy()
+    y = b.astype(object).to_numpy()
+    return [i for i in range(len(x)) if not values_equal(x[i], y[i], rtol, atol)]
+
+
+def compare_frames(name, ref, cand, rtol, atol):
+    """Daftar selisih (dict) antara dua DataFrame, sel demi sel."""
+    if list(ref.columns) != list(cand.columns):
+        return [{"where": name, "kind": "columns", "reference": list(ref.columns), "candidate": list(cand.columns)}]
+    if len(ref) != len(cand):
+        return [{"where": name, "kind": "rows", "reference": len(ref), "candidate": len(cand)}]
+    diffs = []
+    for pos, col in enumerate(ref.columns):
+        for row in _column_mismatches(ref.iloc[:, pos], cand.iloc[:, pos], rtol, atol):
+            diffs.append({
+                "where": name, "kind": "cell", "row": int(row), "column": str(col),
+                "reference": ref.iloc[row, pos], "candidate": cand.iloc[row, pos],
+            })
+            if len(diffs) >= MAX_DIFFS:
+                return diffs
+    return diffs
+
+
+def compare_results(ref, cand, rtol, atol):
+    """Selisih antara dua tuple hasil (dfs_FL, dfs_FB, JMH_gabungan, FULL_NO_JMH, full_list)."""
+    diffs = []
+    (ref_fl, ref_fb, ref_jmh, ref_full, ref_list) = ref
+    (cand_fl, cand_fb, cand_jmh, cand_full, cand_list) = cand
+    if list(ref_list) != list(cand_list):
+        diffs.append({"where": "full_list", "kind": "value", "reference": list(ref_list), "candidate": list(cand_list)})
+    for label, ref_dfs, cand_dfs in (("dfs_FL", ref_fl, cand_fl), ("dfs_FB", ref_fb, cand_fb)):
+        if list(ref_dfs) != list(cand_dfs):
+            diffs.append({"where": label, "kind": "ports", "reference": list(ref_dfs), "candidate": list(cand_dfs)})
+            continue
+        for port in ref_dfs:
+            diffs += compare_frames(f"{label}[{port}]", ref_dfs[port], cand_dfs[port], rtol, atol)
+    diffs += compare_frames("JMH_gabungan", ref_jmh, cand_jmh, rtol, atol)
+    diffs += compare_frames("FULL_NO_JMH", ref_full, cand_full, rtol, atol)
+    return diffs
+
+
+def compare_workbooks(ref_bytes, cand_bytes, rtol, atol):
+    """Selisih nilai sel antara dua workbook .xlsx (nama & urutan sheet juga dicek)."""
+    ref_wb = load_workbook(io.BytesIO(ref_bytes), read_only=True)
+    cand_wb = load_workbook(io.BytesIO(cand_bytes), read_only=True)
+    try:
+        if ref_wb.sheetnames != cand_wb.sheetnames:
+            return [{"where": "workbook", "kind": "sheets", "reference": ref_wb.sheetnames, "candidate": cand_wb.sheetnames}]
+        diffs = []
+        for sheet in ref_wb.sheetnames:
+            ref_rows = ref_wb[sheet].iter_rows(values_only=True)
+            cand_rows = cand_wb[sheet].iter_rows(values_only=True)
+            for r, (ref_row, cand_row) in enumerate(zip_longest(ref_rows, cand_rows, fillvalue=()), start=1):
+                width = max(len(ref_row), len(cand_row))
+                ref_row = tuple(ref_row) + (None,) * (width - len(ref_row))
+                cand_row = tuple(cand_row) + (None,) * (width - len(cand_row))
+                for c, (a, b) in enumerate(zip(ref_row, cand_row), start=1):
+                    if not values_equal(a, b, rtol, atol):
+                        diffs.append({"where": f"xlsx[{sheet}]", "kind": "cell", "row": r, "column": c,
+                                      "reference": a, "candidate": b})
+                        if len(diffs) >= MAX_DIFFS:
+                            return diffs
+        return diffs
+    finally:
+        ref_wb.close()
+        cand_wb.close()
+
+
+def diff_runs(ref_runs, cand_runs, rtol, atol, check_workbook=True, path=BASELINE):
+    """Laporan per (input, job) untuk jalur kandidat `path`: selisih dan rasio waktu."""
+    report = []
+    for ref, cand in zip(ref_runs, cand_runs):
+        diffs = compare_results(ref["result"], cand["result"], rtol, atol)
+        if check_workbook:
+            diffs += compare_workbooks(ref["workbook"], cand["workbook"], rtol, atol)
+        bulan, tahun, cabang = ref["job"]
+        report.append({
+            "input": os.path.basename(ref["input"]),
+            "path": path.label,
+            "job": f"{bulan} {tahun} ({len(cabang)} cabang)",
+            "equal": not diffs,
+            "diffs": diffs[:MAX_DIFFS],
+            "seconds_reference": ref["seconds"],
+            "seconds_candidate": cand["seconds"],
+            "ratio": {
+                stage: round(cand["seconds"][stage] / ref["seconds"][stage], 3) if ref["seconds"][stage] else None
+                for stage in ref["seconds"]
+            },
+        })
+    return report
+
+
+def format_report(report):
+    lines = []
+    for case in report:
+        ratio = ", ".join(f"{stage} x{value}" for stage, value in case["ratio"].items())
+        lines.append(
+            f"{'SAMA ' if case['equal'] else 'BEDA '} {case['input']} {case['job']} <{case['path']}>  [{ratio}]"
+        )
+        for diff in case["diffs"]:
+            location = f" baris {diff['row']} kolom {diff['column']}" if diff["kind"] == "cell" else ""
+            lines.append(
+                f"    {diff['where']} ({diff['kind']}){location}: "
+                f"referensi={diff['reference']!r} kandidat={diff['candidate']!r}"
+            )
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Bandingkan output KBM dua implementasi (referensi vs kandidat).")
+    parser.add_argument("--input", action="append", default=[], help="File DATA_KBM; boleh diulang")
+    parser.add_argument(
+        "--synthetic", action="append", type=int, default=[], metavar="ROWS",
+        help="Tambah workbook sintetis (kbm_synth) dengan jumlah baris ini; boleh diulang"
+    )
+    parser.add_argument(
+        "--sparse-ratio", type=float, default=0.01,
+        help="Bagian baris jarang di workbook sintetis (ambang dropna(thresh=5) atas seluruh kolom; 0 = tanpa)"
+    )
+    parser.add_argument(
+        "--job", action="append", type=parse_job, default=[], metavar="BULAN:TAHUN:CABANG",
+        help="Job yang dibandingkan (default SEPTEMBER:2025:ALL)"
+    )
+    parser.add_argument("--reference", default="HEAD", help="Revisi git referensi (default HEAD)")
+    parser.add_argument("--candidate", help="Revisi git kandidat (default: folder kerja saat ini)")
+    parser.add_argument(
+        "--loader", action="append", choices=LOADERS, default=[],
+        help="Jalur load kandidat (default baseline); boleh diulang untuk beberapa jalur"
+    )
+    parser.add_argument(
+        "--backend", action="append", choices=BACKENDS, default=[],
+        help="Backend klasifikasi kandidat (default KBM_BACKEND); boleh diulang"
+    )
+    parser.add_argument(
+        "--sliced", action="store_true",
+        help="Kandidat memakai process_cached/slice_result (semua cabang lalu dipotong)"
+    )
+    parser.add_argument(
+        "--matrix", action="store_true",
+        help="Semua kombinasi loader x backend x sliced (polars hanya bila terpasang)"
+    )
+    parser.add_argument("--rtol", type=float, default=1e-9, help="Toleransi relatif angka")
+    parser.add_argument("--atol", type=float, default=1e-6, help="Toleransi absolut angka")
+    parser.add_argument("--no-workbook", action="store_true", help="Lewati perbandingan sel workbook")
+    parser.add_argument("--report", help="Simpan laporan lengkap sebagai JSON")
+    return parser
+
+
+def candidate_paths(args):
+    """Daftar `CandidatePath` dari argumen (kombinasi loader x backend x sliced)."""
+    if args.matrix:
+        backends = [b for b in BACKENDS if b != "polars" or importlib.util.find_spec("polars")]
+        return [CandidatePath(*combo) for combo in product(LOADERS, backends, (False, True))]
+    return [
+        CandidatePath(loader, backend, args.sliced)
+        for loader, backend in product(args.loader or ["baseline"], args.backend or [None])
+    ]
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.input and not args.synthetic:
+        parser.error("minimal satu --input atau --synthetic harus diberikan")
+    jobs = args.job or [parse_job("SEPTEMBER:2025:ALL")]
+
+    with tempfile.TemporaryDirectory(prefix="kbm_diff_") as tmp:
+        inputs = [os.path.abspath(path) for path in args.input]
+        if args.synthetic:
+            for n_rows in args.synthetic:
+                path = os.path.join(tmp, f"synthetic_{n_rows}.xlsx")
+                generate_workbook(n_rows, path, bulan=jobs[0][0], tahun=jobs[0][1], sparse_ratio=args.sparse_ratio)
+                inputs.append(path)
+
+        # Referensi selalu lewat jalur baseline; kandidat sekali per jalur
+        runs = []
+        for side, rev, paths in (("reference", args.reference, [BASELINE]),
+                                 ("candidate", args.candidate, candidate_paths(args))):
+            source = export_revision(rev, os.path.join(tmp, f"{side}_src")) if rev else BASE_DIR
+            for n, path in enumerate(paths):
+                workdir = os.path.join(tmp, f"{side}_{n}")
+                os.makedirs(workdir)
+                t0 = time.perf_counter()
+                runs.append((side, path, run_implementation(source, inputs, jobs, workdir, path)))
+                print(f"{side} ({rev or 'folder kerja'}, {path.label}): {time.perf_counter() - t0:.2f} s")
+
+    ref_runs = runs[0][2]
+    report = []
+    for _, path, cand_runs in runs[1:]:
+        report += diff_runs(ref_runs, cand_runs, args.rtol, args.atol, not args.no_workbook, path)
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+    return 0 if all(case["equal"] for case in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1057 @@
+"""
+Mesin pemrosesan KBM Accrual (tanpa Streamlit).
+
+Modul ini berisi seluruh algoritma yang sebelumnya hanya bisa dijalankan dari
+halaman Streamlit. Semua fungsi mengembalikan DataFrame biasa dan melaporkan
+kesalahan lewat exception, sehingga dapat dipakai oleh `app_kbm.py`,
+`kbm_cli.py`, maupun skrip lain.
+"""
+import calendar
+import datetime
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from kbm_profile import profiled, stage
+from kbm_reference import TARIF_COLS, load_reference
+
+# Definisikan mapping di awal (konstanta)
+list_bulan = {
+    "januari": 1, "februari": 2, "maret": 3, "april": 4, "mei": 5, "juni": 6,
+    "juli": 7, "agustus": 8, "september": 9, "oktober": 10, "november": 11, "desember": 12
+}
+all_cabang_dict = {
+    # CY
+    "BAU": "BAU - BAU",
+    "BIA": "BIAK",
+    "BOE": "BOEPINANG",
+    "BTM": "BATAM",
+    "DBO": "DOBO",
+    "FAK": "FAK - FAK",
+    "KAI": "KAIMANA",
+    "KDR": "KENDARI",
+    "KTG": "KETAPANG",
+    "LUW": "LUWUK",
+    "MRI": "MANOKWARI",
+    "NBR": "NABIRE",
+    "NNK": "NUNUKAN",
+    "PDG": "PADANG",
+    "PNK": "PONTIANAK",
+    "SMG": "SEMARANG",
+    "SRI": "SERUI",
+    "TGK": "TANGKIANG",
+    "TIM": "TIMIKA",
+    "TUA": "TUAL",
+    "TTE": "TERNATE",
+
+    # PORT
+    "AMB": "AMBON",
+    "ARA": "SERANG",
+    "BIT": "BITUNG",
+    "BLC": "BATULICIN",
+    "BLW": "BELAWAN",
+    "BMS": "BANJARMASIN",
+    "BPN": "BALIKPAPAN",
+    "BRU": "BERAU",
+    "BTJ": "MEDAN",
+    "BTN": "BUATAN",
+    "GTO": "GORONTALO",
+    "JYP": "JAYAPURA",
+    "KTJ": "KUALATANJUNG",
+    "MAL": "MALUKU",
+    "MKE": "MERAUKE",
+    "MKS": "MAKASSAR",
+    "PAL": "PALU",
+    "PKB": "PEKANBARU",
+    "PLM": "PEKANBARU",     # sesuai tabel Anda
+    "PRW": "PERAWANG",
+    "SBY": "SURABAYA",      # tabel #N/A → saya isi jelas
+    "SDA": "SAMARINDA",
+    "SMD": "SAMARINDA",
+    "SPT": "SAMPIT",
+    "SRG": "SORONG",
+    "TRK": "TARAKAN"
+}
+
+list_cy_full = ["BAU","BIA","BOE","BTM","DBO","FAK","KAI","KDR","KTG","LUW","MRI","NBR","NNK","PDG","PNK","SMG","SRI","TGK","TIM","TUA"]
+list_port_full = ["AMB","ARA","BIT","BLC","BLW","BMS","BPN","BRU","BTJ","BTN","GTO","JYP","KTJ","MAL","MKE","MKS","PAL","PKB","PLM","PRW","SDA","SMD","SPT","SRG","TRK"]
+
+# Definisi Kolom Tampilan (Eksplisit)
+kolom_tampilan_fl = [
+    'Id KBM', 'Tgl KBM', 'Port Id', 'TD Month', 'Vessel Id To', 'Voyage No To',
+    'Nama Kegiatan', 'Jenis', 'Ukuran', 'Status', 'Jumlah Container', 'Biaya',
+    'Sub Total', 'Jenis Dokumen', 'No Dokumen', 'Tgl Create Documen',
+    'Tgl Kasir Documen', 'Created By', 'Port Id From', 'Port Id To', 'Kode ACC',
+    'Supplier', 'Id BS Penyelesaian', 'Tgl Kasir Id BS Penyelesaian', 'Id BKM',
+    'vesvoy', 'Status_KBM'
+]
+
+kolom_tampilan_fb = [
+    'No.', 'Vessel Id', 'Voyage No', 'TD', 'Port Id', 'Load Port', 'Disc Port',
+    'Id Session', 'Vessel Id From', 'Voyage No From', 'Vessel Id To', 'Voyage No To',
+    'Port Id From', 'Port Id To', 'Type Size Name', 'Qty Angkatan', 'Nama Vendor',
+    'ETS Status', 'Activity System Name', 'Id KBM', 'Tanggal', 'Id Document',
+    'vesvoy', 'Status_KBM', 'STVDR', 'HAULAGE', 'LOLO BM', 'Status_dokumen'
+]
+
+# Skema tipe kolom setelah clean_df. Kolom kode berkardinalitas rendah disimpan
+# sebagai category; tanggal hanya di-parse bila seluruh isinya memang tanggal
+# (teks tanggal dibiarkan agar isi file output tidak berubah).
+SCHEMA_FL = {
+    "category": ["Port Id", "TD Month", "Vessel Id To", "Voyage No To", "Jenis", "Ukuran", "Status",
+                 "Jenis Dokumen", "Created By", "Port Id From", "Port Id To", "Supplier", "vesvoy"],
+    "numeric": ["Sub Total"],
+    "date": ["Tgl KBM", "Tgl Create Documen", "Tgl Kasir Documen", "Tgl Kasir Id BS Penyelesaian"],
+}
+SCHEMA_FB = {
+    "category": ["Vessel Id", "Voyage No", "Port Id", "Load Port", "Disc Port", "Vessel Id From",
+                 "Voyage No From", "Vessel Id To", "Voyage No To", "Port Id From", "Port Id To",
+                 "Type Size Name", "Nama Vendor", "ETS Status", "Activity System Name", "vesvoy"],
+    "numeric": ["Qty Angkatan"],
+    "date": ["TD", "Tanggal"],
+}
+
+# Nilai Status_KBM (kategori tetap, sehingga .loc[..] = status tidak menambah kategori)
+STATUS_KBM = ["NO_DOC_PORT", "NO_DOC_CY", "NEXT_MONTH_DOC"]
+STATUS_DOKUMEN = ["hide", "show"]
+
+# Backend per periode: "pandas" (default) atau "polars" (rencana lazy, lihat
+# kbm_polars.py) untuk mask status, tarif, List JMH, Status_dokumen, dan jurnal
+# NO JMH. Load dan blok detail selalu pandas
+BACKENDS = ("pandas", "polars")
+BACKEND = os.environ.get("KBM_BACKEND", "pandas")
+
+# Kolom dengan nilai unik di atas rasio ini tetap object (category tidak menghemat)
+MAX_CATEGORY_RATIO = 0.5
+
+# Urutan Kolom Jurnal
+ordered_cols = ["tanggal", "Port Id", "nama_jurnal", "A", "kolom_1", "Keperluan", "KODE", "vesvoy", "Debit", "Kredit", "COA", "COA-K"]
+
+
+def _label_row(columns, first_col, label):
+    """Satu baris judul blok (kolom lain kosong) mengikuti urutan `columns`."""
+    return pd.DataFrame({first_col: [label]}).reindex(columns=columns, fill_value=None)
+
+
+# Header & Spacer blok detail (dipakai bersama oleh semua port, tidak pernah diubah)
+HEADER1_FL = _label_row(kolom_tampilan_fl, "Id KBM", "FORMAT LAMA - NO DOCUMENT")
+HEADER2_FL = _label_row(kolom_tampilan_fl, "Id KBM", "FORMAT LAMA - JMH NEXT MONTH")
+SPACER_FL = pd.DataFrame([[None] * len(kolom_tampilan_fl)], columns=kolom_tampilan_fl)
+
+HEADER1_FB = _label_row(kolom_tampilan_fb, "Vessel Id", "FORMAT BARU - NO DOCUMENT")
+HEADER2_FB = _label_row(kolom_tampilan_fb, "Vessel Id", "FORMAT BARU - JMH NEXT MONTH")
+SPACER_FB = pd.DataFrame([[None] * len(kolom_tampilan_fb)], columns=kolom_tampilan_fb)
+
+
+class KBMInputError(ValueError):
+    """Kesalahan input pengguna (file, periode, atau pilihan cabang)."""
+
+
+# Segmen kode bulan dokumen: "JMH/AMB/2510/00123" -> 2510 (sama dengan regex "/yymm/")
+_PERIODE_RE = r"(?<=/)([0-9]{4})(?=/)"
+
+
+class ParseMemo(NamedTuple):
+    """
+    Hasil parse '/yymm/' per teks unik: `parsed` berisi semua teks yang sudah
+    di-parse (termasuk yang tanpa segmen), `periode` pasangan (text, periode).
+    Dipakai ulang lintas unggahan oleh mode inkremental (kbm_incremental.py).
+    """
+    parsed: pd.Index
+    periode: pd.DataFrame
+
+
+def _parse_texts(texts):
+    found = pd.Series(texts, dtype=object).str.extractall(_PERIODE_RE)[0]
+    return pd.DataFrame({
+        "text": texts[found.index.get_level_values(0)],
+        "periode": found.to_numpy(dtype=np.int16),
+    })
+
+
+def periode_pairs(values, memo=None):
+    """
+    Pasangan (row, periode) untuk setiap segmen '/yymm/' pada teks dokumen.
+    `row` adalah posisi baris; satu dokumen bisa punya lebih dari satu segmen.
+
+    Regex hanya dijalankan sekali per teks unik, dan teks yang sudah ada di
+    `memo` tidak di-parse lagi.
+    """
+    codes, uniques = pd.factorize(values.astype(str).to_numpy(dtype=object))
+    uniques = np.asarray(uniques, dtype=object)
+    if memo is not None and len(memo.parsed):
+        known = pd.Index(uniques).isin(memo.parsed)
+        reused = memo.periode[memo.periode["text"].isin(uniques[known])]
+        parsed = pd.concat([reused, _parse_texts(uniques[~known])], ignore_index=True)
+    else:
+        parsed = _parse_texts(uniques)
+
+    per_text = pd.DataFrame({
+        "code": pd.Index(uniques).get_indexer(parsed["text"]),
+        "periode": parsed["periode"].to_numpy(dtype=np.int16),
+    })
+    rows = pd.DataFrame({"row": np.arange(len(codes), dtype=np.int32), "code": codes})
+    return rows.merge(per_text, on="code")[["row", "periode"]]
+
+
+def _mask_from_pairs(pairs, n_rows, kode_yymm):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[pairs["row"].to_numpy()[pairs["periode"].to_numpy() == int(kode_yymm)]] = True
+    return mask
+
+
+class DocIndex(NamedTuple):
+    """
+    Index nomor dokumen yang di-parse sekali per load.
+
+    `periode[field]` memetakan baris sheet ke kode yymm (int16) dari No Dokumen
+    (FL) atau Id Document (FB). `fb_tokens` berisi Id Document FB yang sudah
+    dipecah per koma (row, token, is_jmh) dan `token_periode` kode yymm per
+    token. Cek NEXT_MONTH_DOC/JMH untuk bulan apa pun cukup membandingkan
+    integer, tanpa regex ulang.
+    """
+    periode: dict
+    n_rows: dict
+    fb_tokens: pd.DataFrame
+    token_periode: pd.DataFrame
+
+    def period_mask(self, field, kode_yymm):
+        """Mask baris (Series bool) yang memuat kode bulan `kode_yymm`."""
+        return pd.Series(_mask_from_pairs(self.periode[field], self.n_rows[field], kode_yymm))
+
+    def token_mask(self, kode_yymm):
+        """Mask token FB yang memuat kode bulan `kode_yymm`."""
+        return _mask_from_pairs(self.token_periode, len(self.fb_tokens), kode_yymm)
+
+
+@profiled("doc_index")
+def build_doc_index(FL_clean, FL1_clean, FL2_clean, FB_clean, memo=None):
+    """Membangun `DocIndex`; teks yang sudah ada di `memo` (ParseMemo) tidak di-parse ulang."""
+    frames = {
+        "FL_clean": FL_clean["No Dokumen"],
+        "FL1_clean": FL1_clean["No Dokumen"],
+        "FL2_clean": FL2_clean["No Dokumen"],
+        "FB_clean": FB_clean["Id Document"],
+    }
+
+    fb_tokens = document_tokens(FB_clean["Id Document"])
+    return DocIndex(
+        periode={field: periode_pairs(values, memo) for field, values in frames.items()},
+        n_rows={field: len(values) for field, values in frames.items()},
+        fb_tokens=fb_tokens,
+        token_periode=periode_pairs(fb_tokens["token"], memo),
+    )
+
+
+def document_tokens(id_document):
+    """Id Document FB dipecah per koma: (row, token, is_jmh), berurutan per baris."""
+    as_str = id_document.astype(str)
+    tokens = as_str.str.split(",").explode().str.strip()
+    fb_tokens = pd.DataFrame({
+        "row": np.arange(len(id_document), dtype=np.int32).repeat(as_str.str.count(",").to_numpy() + 1),
+        "token": tokens.to_numpy(dtype=object),
+    })
+    fb_tokens["is_jmh"] = fb_tokens["token"].str.contains("JMH", na=False)
+    return fb_tokens
+
+
+SHEET_FIELDS = ("FL_clean", "FL1_clean", "FL2_clean", "FB_clean")
+
+
+class KBMData(NamedTuple):
+    """Sheet KBM yang sudah dibersihkan dan siap dipakai ulang oleh banyak job."""
+    FL_clean: pd.DataFrame   # Sheet 3: KBM periode saat ini (Format Lama)
+    FL1_clean: pd.DataFrame  # Sheet 1: KBM bulan - 2 (Format Lama)
+    FL2_clean: pd.DataFrame  # Sheet 2: KBM bulan - 1 (Format Lama)
+    FB_clean: pd.DataFrame   # Sheet 4: KBM Format Baru
+    doc_index: DocIndex = None
+    cabang: tuple = None     # None = semua cabang lengkap (lihat load_kbm_streaming)
+    keys: dict = None        # field -> kolom kunci semua baris bila sheet hanya berisi `cabang`
+
+    def key_frame(self, field):
+        """
+        Kolom kunci (Port Id, nomor dokumen, vesvoy) semua baris sheet `field`,
+        termasuk cabang di luar `cabang`; posisi barisnya sama dengan `doc_index`.
+        """
+        return getattr(self, field) if self.keys is None else self.keys[field]
+
+    def sheet_mask(self, field, mask):
+        """Mask atas baris `key_frame(field)` -> mask atas baris sheet `field`."""
+        return mask if self.keys is None else mask[self.keys[field]["in_scope"].to_numpy()]
+
+
+def assemble_kbm(FL_clean, FL1_clean, FL2_clean, FB_clean, memo=None):
+    """KBMData lengkap dengan index dokumen yang di-parse sekali."""
+    return KBMData(
+        FL_clean, FL1_clean, FL2_clean, FB_clean,
+        doc_index=build_doc_index(FL_clean, FL1_clean, FL2_clean, FB_clean, memo=memo),
+    )
+
+
+def parse_memo(kbm):
+    """`ParseMemo` dari index dokumen `kbm` (tanpa regex ulang)."""
+    texts, pairs = [], []
+    sources = [(field, kbm.key_frame(field)["Id Document" if field == "FB_clean" else "No Dokumen"])
+               for field in SHEET_FIELDS]
+    for field, values in sources:
+        text = values.astype(str).to_numpy(dtype=object)
+        found = kbm.doc_index.periode[field]
+        texts.append(text)
+        pairs.append(pd.DataFrame({"text": text[found["row"].to_numpy()], "periode": found["periode"].to_numpy()}))
+    tokens = kbm.doc_index.fb_tokens["token"].astype(str).to_numpy(dtype=object)
+    found = kbm.doc_index.token_periode
+    texts.append(tokens)
+    pairs.append(pd.DataFrame({"text": tokens[found["row"].to_numpy()], "periode": found["periode"].to_numpy()}))
+    return ParseMemo(
+        parsed=pd.Index(np.concatenate(texts)).unique(),
+        periode=pd.concat(pairs, ignore_index=True).drop_duplicates(ignore_index=True),
+    )
+
+
+class AccrualResult(NamedTuple):
+    """Hasil `run_processing`; lima field pertama sama dengan tuple lama."""
+    dfs_FL: dict
+    dfs_FB: dict
+    JMH_gabungan: pd.DataFrame
+    FULL_NO_JMH: pd.DataFrame
+    full_list: list
+    missing_tarif: pd.DataFrame = None  # baris NO_DOC FB tanpa tarif (lihat missing_tarif_report)
+
+
+def read_kbm_workbook(source, sheet_name=None, header=None):
+    """Membaca file DATA_KBM (.xls/.xlsx) dari path atau objek file."""
+    name = getattr(source, "name", str(source))
+    if not (name.endswith('.xls') or name.endswith('.xlsx')):
+        raise KBMInputError("Tolong unggah file berformat .xls atau .xlsx.")
+    return pd.read_excel(source, sheet_name=sheet_name, header=header)
+
+
+# --- Fungsi Pembersihan DataFrame (diekstrak untuk DRY) ---
+@profiled("clean_df")
+def clean_df(df, is_fb=False, drop_sparse=True):
+    # drop_sparse=False: baris jarang sudah dibuang pemanggil atas seluruh kolom sheet
+    df_clean = df.dropna(thresh=5) if drop_sparse else df
+    df_clean.columns = df_clean.iloc[0]
+    df_clean = df_clean[1:]
+    df_clean = df_clean.reset_index(drop=True)
+    return apply_schema(derive_columns(df_clean, is_fb), SCHEMA_FB if is_fb else SCHEMA_FL)
+
+
+def derive_columns(df_clean, is_fb=False):
+    """Kolom turunan `clean_df` (per baris, sehingga bisa dijalankan per chunk)."""
+    if is_fb: # Format Baru (FB)
+        df_clean["Qty Angkatan"] = pd.to_numeric(df_clean["Qty Angkatan"], errors='coerce')
+        df_clean["vesvoy"] = df_clean["Vessel Id"] + " " + df_clean["Voyage No"]
+    else: # Format Lama (FL)
+        df_clean["Sub Total"] = pd.to_numeric(df_clean["Sub Total"], errors='coerce')
+        df_clean["vesvoy"] = df_clean["Vessel Id To"] + " " + df_clean["Voyage No To"]
+
+    df_clean["Status_KBM"] = pd.Categorical([None] * len(df_clean), categories=STATUS_KBM)
+    return df_clean
+
+
+def _is_all_dates(values):
+    filled = values.dropna()
+    return len(filled) > 0 and filled.map(lambda v: isinstance(v, datetime.datetime)).all()
+
+
+def apply_schema(df, schema):
+    """
+    Menerapkan tipe kolom dari `schema` (category / numeric / date) pada `df`.
+    Kolom yang tidak ada dilewati; nilai yang tampil di output tidak berubah.
+    """
+    n_rows = max(len(df), 1)
+    for kind in ("category", "numeric", "date"):
+        for col in schema.get(kind, []):
+            if col in df:
+                values = df[col]
+                converted = schema_column(values, kind, n_rows)
+                if converted is not values:
+                    df[col] = converted
+    return df
+
+
+def schema_column(values, kind, n_rows):
+    """Satu kolom menurut jenis skema (`kind`); `n_rows` menentukan rasio category."""
+    if kind == "category":
+        if values.dtype == object and values.nunique() <= n_rows * MAX_CATEGORY_RATIO:
+            return values.astype("category")
+    elif kind == "numeric":
+        return pd.to_numeric(values, errors="coerce")
+    elif kind == "date":
+        if values.dtype == object and _is_all_dates(values):
+            try:
+                return pd.to_datetime(values)
+            except pd.errors.OutOfBoundsDatetime:
+                # Tanggal di luar rentang datetime64 (mis. salah ketik 2925): tetap object
+                return values
+    return values
+
+
+def prepare_kbm(all_sheets):
+    """Membersihkan 4 sheet pertama DATA_KBM (FL bulan-2, FL bulan-1, FL saat ini, FB)."""
+    sheets_list = list(all_sheets.values())
+    if len(sheets_list) < 4:
+        raise KBMInputError(
+            f"File DATA_KBM harus memiliki minimal 4 sheet, ditemukan {len(sheets_list)}."
+        )
+
+    # --- Pembersihan Data FL (Format Lama: Sheet 2, 0, 1) dan FB (Sheet 3) ---
+    return assemble_kbm(
+        FL_clean=clean_df(sheets_list[2]),
+        FL1_clean=clean_df(sheets_list[0]),
+        FL2_clean=clean_df(sheets_list[1]),
+        FB_clean=clean_df(sheets_list[3], is_fb=True),
+    )
+
+
+def hitung_periode(input_bulan, input_tahun):
+    """Mengembalikan (tanggal_akhir, kode_yymm) untuk bulan & tahun yang dipilih."""
+    input_tahun = str(input_tahun)
+    if not input_tahun.isdigit() or len(input_tahun) != 4:
+        raise KBMInputError("Format Tahun tidak valid.")
+    if input_bulan.lower() not in list_bulan:
+        raise KBMInputError(f"Nama bulan tidak dikenal: {input_bulan}.")
+
+    # Pengecekan dan konversi input
+    bulan_num = list_bulan[input_bulan.lower()]
+    tahun_num = int(input_tahun)
+
+    # A. PERHITUNGAN TANGGAL & REGEX (sama seperti notebook)
+    last_day = calendar.monthrange(tahun_num, bulan_num)[1]
+    tanggal_akhir = f"{last_day:02d}/{bulan_num:02d}/{tahun_num}"
+
+    if bulan_num == 12:
+        bulan_next = 1
+        tahun_next = tahun_num + 1
+    else:
+        bulan_next = bulan_num + 1
+        tahun_next = tahun_num
+
+    kode_yymm = f"{str(tahun_next)[2:]}{bulan_next:02d}"
+    return tanggal_akhir, kode_yymm
+
+
+def kode_periode(input_bulan, input_tahun):
+    """Kode yymm periode itu sendiri (bukan bulan berikutnya), mis. SEPTEMBER 2025 -> "2509"."""
+    hitung_periode(input_bulan, input_tahun)
+    return f"{str(input_tahun)[2:]}{list_bulan[input_bulan.lower()]:02d}"
+
+
+def period_range(bulan_awal, tahun_awal, bulan_akhir, tahun_akhir):
+    """
+    Daftar (BULAN, TAHUN) dari periode awal sampai akhir (inklusif), nama bulan
+    huruf besar seperti pilihan di halaman Streamlit.
+    """
+    hitung_periode(bulan_awal, tahun_awal)
+    hitung_periode(bulan_akhir, tahun_akhir)
+    nama_bulan = [b.upper() for b in list_bulan]
+    start = int(tahun_awal) * 12 + list_bulan[bulan_awal.lower()] - 1
+    end = int(tahun_akhir) * 12 + list_bulan[bulan_akhir.lower()] - 1
+    if end < start:
+        raise KBMInputError("Periode akhir tidak boleh sebelum periode awal.")
+    return [(nama_bulan[i % 12], str(i // 12)) for i in range(start, end + 1)]
+
+
+@profiled("list_jmh")
+def build_list_jmh(kbm, doc_index, next_fl, next_fl1, next_fl2, kode_yymm, full_list):
+    """
+    List JMH gabungan FL + FB untuk cabang terpilih.
+
+    Deduplikasi (No Dokumen, vesvoy) tetap dilakukan atas semua cabang sebelum
+    difilter, sama seperti sebelumnya, tetapi hanya pada baris/token yang memuat
+    kode bulan berikutnya, bukan seluruh sheet.
+    """
+    cols_fl = ["Port Id", "No Dokumen", "vesvoy"]
+    list_JMH_FL = pd.concat([
+        kbm.key_frame("FL_clean").loc[next_fl, cols_fl],
+        kbm.key_frame("FL1_clean").loc[next_fl1, cols_fl],
+        kbm.key_frame("FL2_clean").loc[next_fl2, cols_fl],
+    ]).drop_duplicates()
+    list_JMH_FL["sumber"] = "FL"
+
+    # Token Id Document FB yang bertipe JMH dan ber-kode bulan berikutnya
+    tokens = doc_index.fb_tokens
+    selected = tokens["is_jmh"].to_numpy() & doc_index.token_mask(kode_yymm)
+    rows = tokens["row"].to_numpy()[selected]
+    FB_keys = kbm.key_frame("FB_clean")
+    list_JMH_FB = pd.DataFrame({
+        "Port Id": FB_keys["Port Id"].to_numpy()[rows],
+        "No Dokumen": tokens["token"].to_numpy()[selected],
+        "vesvoy": FB_keys["vesvoy"].to_numpy()[rows],
+    }).drop_duplicates()
+    list_JMH_FB["sumber"] = "FB"
+
+    JMH_gabungan = pd.concat([list_JMH_FL, list_JMH_FB], ignore_index=True)
+    JMH_gabungan = JMH_gabungan.take(jmh_order(JMH_gabungan)).reset_index(drop=True)
+    return JMH_gabungan[JMH_gabungan["Port Id"].isin(full_list)]
+
+
+def jmh_order(JMH_gabungan):
+    """Posisi baris List JMH setelah deduplikasi (No Dokumen, vesvoy) dan urut (Port Id, No Dokumen)."""
+    positions = pd.RangeIndex(len(JMH_gabungan))
+    kept = JMH_gabungan.set_axis(positions).drop_duplicates(subset=["No Dokumen", "vesvoy"])
+    return kept.sort_values(by=["Port Id", "No Dokumen"]).index.to_numpy()
+
+
+class StatusMasks(NamedTuple):
+    """
+    Mask baris (numpy bool, sepanjang sheet asal) untuk klasifikasi satu periode.
+    Status diterapkan oleh `process_period` dengan urutan yang sama seperti
+    sebelumnya (NO_DOC_PORT, NO_DOC_CY, lalu NEXT_MONTH_DOC menimpa).
+    """
+    in_fl: np.ndarray           # FL_clean: cabang terpilih
+    fl_no_doc_port: np.ndarray  # FL_clean: syarat NO_DOC_PORT
+    fl_no_doc_cy: np.ndarray    # FL_clean: syarat NO_DOC_CY
+    keep_fl1: np.ndarray        # FL1_clean: NEXT_MONTH_DOC & cabang terpilih
+    keep_fl2: np.ndarray        # FL2_clean: NEXT_MONTH_DOC & cabang terpilih
+    in_fb: np.ndarray           # FB_clean: cabang terpilih
+    fb_no_doc_port: np.ndarray  # FB_clean: syarat NO_DOC_PORT
+    fb_no_doc_cy: np.ndarray    # FB_clean: syarat NO_DOC_CY
+
+
+def status_masks(kbm, next_fl1, next_fl2, full_list, list_port, list_cy):
+    """Mask `StatusMasks` dengan operasi pandas per kolom."""
+    FL, FB = kbm.FL_clean, kbm.FB_clean
+    fl_no_doc = FL["Jenis Dokumen"] == "-"
+    fb_no_doc = (FB["Id Document"] == "-") | FB["Id Document"].isna()
+    type_size = FB["Type Size Name"].astype(str)
+    return StatusMasks(
+        in_fl=FL["Port Id"].isin(full_list).to_numpy(),
+        fl_no_doc_port=(
+            fl_no_doc & FL["Port Id"].isin(list_port) & FL["Status"].isin(["EMPTY", "-"])
+        ).to_numpy(),
+        fl_no_doc_cy=(
+            fl_no_doc & FL["Port Id"].isin(list_cy) & FL["Status"].isin(["EMPTY", "-", "FULL"])
+        ).to_numpy(),
+        keep_fl1=next_fl1 & kbm.FL1_clean["Port Id"].isin(full_list).to_numpy(),
+        keep_fl2=next_fl2 & kbm.FL2_clean["Port Id"].isin(full_list).to_numpy(),
+        in_fb=FB["Port Id"].isin(full_list).to_numpy(),
+        fb_no_doc_port=(
+            fb_no_doc & FB["Port Id"].isin(list_port) & type_size.str.contains("MT", na=False)
+        ).to_numpy(),
+        fb_no_doc_cy=(
+            fb_no_doc & FB["Port Id"].isin(list_cy) & type_size.str.contains("MT|FL|-", na=False)
+        ).to_numpy(),
+    )
+
+
+def _decategorize(df):
+    """Kolom category -> object (sekali, sebelum frame tampilan digabung per port)."""
+    cat_cols = [c for c, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    if not cat_cols:
+        return df
+    return df.astype({c: object for c in cat_cols})
+
+
+def partition_by_port(df, ports):
+    """
+    Membagi `df` per Port Id dengan satu kali groupby (urutan baris tetap).
+    Port tanpa baris mendapat frame kosong dengan kolom yang sama.
+    """
+    indices = df.groupby("Port Id", sort=False, observed=True).indices
+    empty = df.iloc[:0]
+    return {port: df.take(indices[port]) if port in indices else empty for port in ports}
+
+
+@profiled("detail_blocks")
+def build_detail_blocks(FL_clean, FB_clean, full_list):
+    """
+    Membentuk dfs_FL dan dfs_FB per port: judul NO DOCUMENT, baris NO_DOC,
+    spacer, judul JMH NEXT MONTH, baris NEXT_MONTH_DOC.
+
+    Pemisahan status dan seleksi kolom dilakukan sekali untuk semua port, lalu
+    hasilnya dipartisi per port dalam satu kali jalan.
+    """
+    # --- FORMAT LAMA (FL) ---
+    # SELEKSI KOLOM (PENTING: Agar kolom tidak melebar)
+    status_fl = FL_clean["Status_KBM"]
+    FL_view = _decategorize(FL_clean.reindex(columns=kolom_tampilan_fl))
+    no_doc_fl = partition_by_port(FL_view[status_fl.astype(str).str.contains("NO_DOC", na=False)], full_list)
+    next_month_fl = partition_by_port(FL_view[status_fl == "NEXT_MONTH_DOC"], full_list)
+
+    # --- FORMAT BARU (FB) ---
+    # SELEKSI KOLOM (PENTING: Agar kolom tidak melebar dan membuang sisa merge)
+    status_fb = FB_clean["Status_KBM"]
+    FB_view = _decategorize(FB_clean.reindex(columns=kolom_tampilan_fb))
+
+    FB_no_doc = FB_view[status_fb.astype(str).str.contains("NO_DOC", na=False)].copy()
+    # Set Status_dokumen jadi NaN untuk bagian NO_DOC (sesuai logika notebook)
+    FB_no_doc["Status_dokumen"] = np.nan
+
+    FB_next = FB_view[status_fb == "NEXT_MONTH_DOC"].copy()
+    # Kosongkan nilai biaya untuk bagian NEXT MONTH
+    FB_next["STVDR"] = np.nan
+    FB_next["HAULAGE"] = np.nan
+    FB_next["LOLO BM"] = np.nan
+
+    no_doc_fb = partition_by_port(FB_no_doc, full_list)
+    next_month_fb = partition_by_port(FB_next, full_list)
+
+    dfs_FL = {}
+    dfs_FB = {}
+    for port in full_list:
+        dfs_FL[port] = pd.concat(
+            [HEADER1_FL, no_doc_fl[port], SPACER_FL, HEADER2_FL, next_month_fl[port]],
+            ignore_index=True
+        )
+        dfs_FB[port] = pd.concat(
+            [HEADER1_FB, no_doc_fb[port], SPACER_FB, HEADER2_FB, next_month_fb[port]],
+            ignore_index=True
+        )
+    return dfs_FL, dfs_FB
+
+
+@profiled("document_status")
+def document_status(id_document, dokumen_index):
+    """
+    Status_dokumen FB: "hide" jika salah satu Id Document (dipisah koma) ada di
+    `dokumen_index`, "show" jika tidak ada, None jika kosong atau "-".
+
+    Token dipecah dan di-explode sekali, dicek dengan `isin`, lalu direduksi
+    kembali per baris dengan any().
+    """
+    status = pd.Series(np.full(len(id_document), None, dtype=object), index=id_document.index)
+    as_str = id_document.astype(str)
+    valid = id_document.notna() & (as_str.str.strip() != "-")
+    if not valid.any():
+        return status.astype(pd.CategoricalDtype(STATUS_DOKUMEN))
+
+    tokens = as_str[valid].str.split(",").explode().str.strip()
+    found = tokens.isin(dokumen_index).groupby(level=0, sort=False).any()
+    status[valid] = np.where(found.reindex(status.index[valid]), "hide", "show")
+    return status.astype(pd.CategoricalDtype(STATUS_DOKUMEN))
+
+
+def document_status_rows(FB_sheet, rows, dokumen_index):
+    """`document_status` untuk baris posisi `rows` sheet FB (index hasil 0..n-1)."""
+    return document_status(FB_sheet["Id Document"].take(rows).reset_index(drop=True), dokumen_index)
+
+
+def tarif_costs(FB_sheet, tarif):
+    """(biaya TARIF_COLS [n, 3], tarif ditemukan [n]) per baris FB dari matriks tarif."""
+    rates, found = tarif.lookup(FB_sheet["Port Id"], FB_sheet["Type Size Name"])
+    return FB_sheet["Qty Angkatan"].to_numpy(dtype=float)[:, None] * rates, found
+
+
+class Backend(NamedTuple):
+    """
+    Implementasi langkah per periode yang dapat diganti (lihat `get_backend`).
+    Semua backend menghasilkan nilai dan tipe yang identik; blok detail
+    (dfs_FL/dfs_FB) selalu disusun dari DataFrame pandas oleh `process_period`.
+    """
+    status_masks: object     # (kbm, next_fl1, next_fl2, full_list, list_port, list_cy) -> StatusMasks
+    tarif_costs: object      # (FB_sheet, tarif) -> (biaya [n, 3], tarif ditemukan [n])
+    list_jmh: object         # (kbm, doc_index, next_fl, next_fl1, next_fl2, kode_yymm, full_list) -> JMH_gabungan
+    document_status: object  # (FB_sheet, rows, dokumen_index) -> Status_dokumen
+    journal: object          # (kbm, no_doc, fb_costs, list_COA, bulan, tahun, tanggal_akhir) -> (FULL_NO_JMH, port)
+
+
+def get_backend(name=None):
+    """`Backend` untuk `name` ("pandas"/"polars"; None = KBM_BACKEND)."""
+    name = name or BACKEND
+    if name == "pandas":
+        return PANDAS_BACKEND
+    if name == "polars":
+        try:
+            import kbm_polars
+        except ImportError as e:
+            raise KBMInputError(f"Backend polars memerlukan paket polars dan pyarrow ({e}).") from e
+        return kbm_polars.POLARS_BACKEND
+    raise KBMInputError(f"Backend tidak dikenal: {name} (pilihan: {', '.join(BACKENDS)}).")
+
+
+class RowResults(NamedTuple):
+    """
+    Hasil klasifikasi per baris untuk satu periode, sebelum dipangkas cabang.
+
+    `status[field]` berisi kode Status_KBM (posisi di STATUS_KBM, -1 = kosong)
+    per baris sheet; FL1/FL2 hanya bisa NEXT_MONTH_DOC. `fb_costs` berisi biaya
+    TARIF_COLS per baris FB dan `tarif_found` apakah tarifnya ada di list_tarif.
+    """
+    status: dict
+    fb_costs: np.ndarray
+    tarif_found: np.ndarray
+
+
+NEXT_MONTH_CODE = STATUS_KBM.index("NEXT_MONTH_DOC")
+
+
+def _status_codes(next_month, no_doc_port=None, no_doc_cy=None):
+    """Kode Status_KBM dengan urutan timpa yang sama: NO_DOC_PORT, NO_DOC_CY, NEXT_MONTH_DOC."""
+    codes = np.full(len(next_month), -1, dtype=np.int8)
+    for code, mask in enumerate([no_doc_port, no_doc_cy, next_month]):
+        if mask is not None:
+            codes[mask] = code
+    return codes
+
+
+@profiled("classify_rows")
+def classify_rows(kbm, doc_index, kode_yymm, tarif, backend=None, rows=None):
+    """
+    `RowResults` untuk baris posisi `rows[field]` tiap sheet (None = semua).
+
+    Status tidak bergantung pada cabang terpilih: untuk baris yang cabangnya
+    dipilih, syarat Port Id pada list_port/list_cy sama dengan syarat pada
+    daftar lengkap, sehingga hasil ini berlaku untuk pilihan cabang apa pun
+    dan dapat dipakai ulang per baris (lihat kbm_incremental.py).
+    """
+    backend = backend or PANDAS_BACKEND
+    next_month = {
+        field: kbm.sheet_mask(field, doc_index.period_mask(field, kode_yymm).to_numpy()) for field in SHEET_FIELDS
+    }
+    if rows is None:
+        sheets = kbm[:4]
+    else:
+        sheets = [getattr(kbm, field).take(rows[field]) for field in SHEET_FIELDS]
+        next_month = {field: mask[rows[field]] for field, mask in next_month.items()}
+    sub = KBMData(*sheets)
+
+    masks = backend.status_masks(
+        sub, next_month["FL1_clean"], next_month["FL2_clean"], list(all_cabang_dict), list_port_full, list_cy_full
+    )
+    status = {
+        "FL_clean": _status_codes(next_month["FL_clean"], masks.fl_no_doc_port, masks.fl_no_doc_cy),
+        "FL1_clean": _status_codes(next_month["FL1_clean"]),
+        "FL2_clean": _status_codes(next_month["FL2_clean"]),
+        "FB_clean": _status_codes(next_month["FB_clean"], masks.fb_no_doc_port, masks.fb_no_doc_cy),
+    }
+
+    # Tarif per baris (Port Id, Type Size Name), lalu hitung biaya
+    with stage("tarif", len(sub.FB_clean)):
+        costs, tarif_found = backend.tarif_costs(sub.FB_clean, tarif)
+    return RowResults(status, costs, tarif_found)
+
+
+def _apply_status(df, codes):
+    """Mengisi Status_KBM `df` dari kode `_status_codes` (baris sejajar posisi)."""
+    for code, status in enumerate(STATUS_KBM):
+        df.loc[codes == code, "Status_KBM"] = status
+
+
+@profiled("missing_tarif")
+def missing_tarif_report(FB_clean, tarif_found):
+    """
+    Kombinasi (Port Id, Type Size Name) baris NO_DOC FB yang tidak ada di
+    list_tarif, beserta jumlah barisnya. Biaya baris tersebut kosong (NaN).
+    """
+    no_doc = FB_clean["Status_KBM"].astype(str).str.contains("NO_DOC", na=False).to_numpy()
+    missing = FB_clean.loc[no_doc & ~tarif_found, ["Port Id", "Type Size Name"]].astype(object)
+    return (
+        missing.groupby(["Port Id", "Type Size Name"], dropna=False)
+        .size()
+        .reset_index(name="Jumlah Baris")
+    )
+
+
+# COA biaya FB (STVDR tergantung Keperluan, lihat melt_fb_costs)
+COA_STVDR_MT = "7XX.03.01.02.04"
+COA_STVDR = "7XX.03.01.02.03"
+COA_FB = {"HAULAGE": "7XX.18.01", "LOLO BM": "7XX.04.02"}
+
+
+@profiled("melt_fb_costs")
+def melt_fb_costs(FB_no_JMH):
+    """
+    Baris jurnal FB: satu baris per (baris KBM, biaya) untuk STVDR, HAULAGE,
+    dan LOLO BM, berurutan per blok biaya seperti sebelumnya.
+    """
+    lines = FB_no_JMH.melt(
+        id_vars=["Port Id", "Keperluan", "vesvoy"],
+        value_vars=["STVDR", "HAULAGE", "LOLO BM"],
+        value_name="Debit",
+    )
+    is_mt = FB_no_JMH["Keperluan"].str.contains("MT", na=False).to_numpy()
+    lines["COA"] = np.concatenate([
+        np.where(is_mt, COA_STVDR_MT, COA_STVDR),
+        np.repeat([COA_FB["HAULAGE"], COA_FB["LOLO BM"]], len(FB_no_JMH)),
+    ]).astype(object)
+    return lines[["Port Id", "Keperluan", "vesvoy", "Debit", "COA"]]
+
+
+@profiled("build_journal")
+def build_journal(lines, keterangan, tanggal_akhir):
+    """
+    Jurnal NO JMH dari baris debit (Port Id, Keperluan, vesvoy, Debit, COA).
+
+    Per cabang: baris debit lalu satu baris ACCRUE (kredit = total debit).
+    Hanya baris pertama tiap cabang yang membawa Port Id, tanggal, nama jurnal,
+    A, dan kolom_1; baris dengan Debit + Kredit = 0 dibuang.
+
+    Mengembalikan (jurnal, port) dengan `port` = Port Id asal setiap baris
+    jurnal (dipakai untuk memotong hasil per cabang, lihat `slice_result`).
+    """
+    lines = lines.reset_index(drop=True)
+    lines["Kredit"] = 0
+    lines["COA-K"] = "-"
+    lines["KODE"] = np.int8(1)
+
+    accrue = lines.groupby("Port Id", observed=True)["Debit"].sum().reset_index(name="Kredit")
+    accrue["Keperluan"] = keterangan
+    accrue["vesvoy"] = "-"
+    accrue["Debit"] = 0
+    accrue["COA"] = "-"
+    accrue["COA-K"] = "3XX.01.12"
+    accrue["KODE"] = np.int8(3)
+
+    jurnal = pd.concat([lines, accrue[lines.columns]], ignore_index=True)
+    jurnal = jurnal.sort_values(["Port Id", "KODE"]).reset_index(drop=True)
+
+    # Baris pertama tiap cabang (ditentukan sebelum baris nol dibuang)
+    first = (~jurnal["Port Id"].duplicated() & jurnal["Port Id"].notna()).to_numpy()
+    blank = pd.Series("", index=jurnal.index, dtype=object)
+    jurnal["tanggal"] = blank.mask(first, tanggal_akhir)
+    jurnal["nama_jurnal"] = blank.mask(first, keterangan)
+    jurnal["A"] = blank.mask(first, "A")
+    jurnal["kolom_1"] = blank.mask(first, 1)
+    port = jurnal["Port Id"].astype(object)
+    jurnal["Port Id"] = port.where(first, "")
+
+    keep = ((jurnal["Debit"] + jurnal["Kredit"]) != 0).to_numpy()
+    return jurnal.loc[keep, ordered_cols], port.to_numpy()[keep]
+
+
+FL_FIELDS = SHEET_FIELDS[:3]
+
+# Kolom sheet yang dibaca jurnal NO JMH
+FL_JOURNAL_COLS = ["Port Id", "vesvoy", "Nama Kegiatan", "Ukuran", "Status", "Sub Total", "Kode ACC"]
+FB_JOURNAL_COLS = ["Port Id", "vesvoy", "Type Size Name"]
+
+
+def is_no_doc(codes):
+    """Mask kode `_status_codes` yang berstatus NO_DOC_PORT atau NO_DOC_CY."""
+    return (codes >= 0) & (codes < NEXT_MONTH_CODE)
+
+
+@profiled("no_jmh_journal")
+def no_jmh_journal(kbm, no_doc, fb_costs, list_COA, input_bulan, input_tahun, tanggal_akhir):
+    """
+    (FULL_NO_JMH, journal_port) dari baris NO_DOC cabang terpilih: `no_doc[field]`
+    mask baris tiap sheet, `fb_costs` biaya TARIF_COLS semua baris FB.
+    """
+    # E. PEMBENTUKAN JURNAL NO JMH (FL): baris FL, FL1, FL2 digabung seperti FL_clean
+    pieces = [getattr(kbm, field).loc[no_doc[field], FL_JOURNAL_COLS] for field in FL_FIELDS]
+    FL_NO_JMH = pd.concat([piece for piece in pieces if len(piece)] or pieces[:1], ignore_index=True)
+    FL_NO_JMH["Keperluan"] = FL_NO_JMH["vesvoy"].astype(object) + " " + FL_NO_JMH["Nama Kegiatan"] + " " + FL_NO_JMH["Ukuran"].astype(object) + " " + FL_NO_JMH["Status"].astype(str)
+    FL_NO_JMH = FL_NO_JMH[["Port Id", "Keperluan", "vesvoy", "Sub Total", "Kode ACC"]]
+
+    FL_NO_JMH = FL_NO_JMH.join(list_COA, on="Kode ACC", how="left")
+    FL_lines = FL_NO_JMH[["Port Id", "Keperluan", "vesvoy", "Sub Total", "COA"]].rename(columns={"Sub Total": "Debit"})
+    FL_NO_JMH_FINAL_FIX, fl_port = build_journal(FL_lines, f"ACCRUE {input_bulan} {input_tahun}", tanggal_akhir)
+
+    # F. PEMBENTUKAN JURNAL NO JMH (FB)
+    FB_no_JMH = kbm.FB_clean.loc[no_doc["FB_clean"], FB_JOURNAL_COLS].reset_index(drop=True)
+    costs = fb_costs[no_doc["FB_clean"]]
+    for i, col in enumerate(TARIF_COLS):
+        FB_no_JMH[col] = costs[:, i]
+    FB_no_JMH["Keperluan"] = FB_no_JMH["vesvoy"].astype(object) + " " + FB_no_JMH["Type Size Name"].astype(object)
+    FB_NO_JMH_FINAL_FIX, fb_port = build_journal(melt_fb_costs(FB_no_JMH), f"ACCRUE XYZ {input_bulan} {input_tahun}", tanggal_akhir)
+
+    # G. FINAL JURNAL
+    FULL_NO_JMH = pd.concat([FL_NO_JMH_FINAL_FIX, FB_NO_JMH_FINAL_FIX], ignore_index=True)
+    mask = (FULL_NO_JMH["Port Id"] == "SBY") & (FULL_NO_JMH["A"] == "A")
+    FULL_NO_JMH.loc[mask, "A"] = "B"
+    FULL_NO_JMH["Port Id"] = FULL_NO_JMH["Port Id"].map(all_cabang_dict)
+    return FULL_NO_JMH, np.concatenate([fl_port, fb_port])
+
+
+PANDAS_BACKEND = Backend(status_masks, tarif_costs, build_list_jmh, document_status_rows, no_jmh_journal)
+
+
+def run_processing(kbm, input_bulan, input_tahun, selected_cabang, reference=None):
+    """
+    Menjalankan seluruh algoritma accrual untuk satu periode dan satu set cabang.
+
+    `kbm` adalah hasil `prepare_kbm` (tidak diubah, sehingga dapat dipakai ulang
+    untuk job berikutnya). `reference` adalah `ReferenceData` (list_COA,
+    tarif); jika None diambil dari cache bersama `load_reference()`.
+    """
+    result, _ = process_period(kbm, input_bulan, input_tahun, selected_cabang, reference)
+    return result
+
+
+def check_cabang(selected_cabang):
+    """
+    Menolak pilihan cabang kosong atau tidak dikenal (KBMInputError), sebelum
+    load/hitung hasil semua cabang yang mahal.
+    """
+    if not selected_cabang:
+        raise KBMInputError("Tolong pilih setidaknya satu cabang.")
+    unknown = [c for c in selected_cabang if c not in all_cabang_dict]
+    if unknown:
+        raise KBMInputError(f"Cabang tidak dikenal: {', '.join(unknown)}")
+
+
+@profiled("slice_result")
+def slice_result(result, journal_port, selected_cabang):
+    """
+    Memotong hasil `process_period` (mis. untuk semua cabang) ke `selected_cabang`.
+
+    Setiap cabang diproses secara independen (blok detail, baris List JMH
+    setelah deduplikasi global, dan jurnal per cabang), sehingga hasilnya sama
+    dengan menjalankan ulang `run_processing` hanya untuk cabang tersebut.
+    """
+    if not selected_cabang:
+        raise KBMInputError("Tolong pilih setidaknya satu cabang.")
+    full_list = list(selected_cabang)
+    unknown = [c for c in full_list if c not in result.dfs_FL]
+    if unknown:
+        raise KBMInputError(f"Cabang tidak ada di hasil: {', '.join(unknown)}")
+
+    JMH_gabungan = result.JMH_gabungan[result.JMH_gabungan["Port Id"].isin(full_list)]
+    in_journal = pd.Series(journal_port, dtype=object).isin(full_list).to_numpy()
+    FULL_NO_JMH = result.FULL_NO_JMH[in_journal].reset_index(drop=True)
+
+    missing_tarif = result.missing_tarif
+    if missing_tarif is not None:
+        missing_tarif = missing_tarif[missing_tarif["Port Id"].isin(full_list)].reset_index(drop=True)
+
+    return AccrualResult(
+        {port: result.dfs_FL[port] for port in full_list},
+        {port: result.dfs_FB[port] for port in full_list},
+        JMH_gabungan, FULL_NO_JMH, full_list, missing_tarif,
+    )
+
+
+def split_by_branch(period_results, selected_cabang):
+    """
+    Hasil per cabang untuk ekspor terpisah. `period_results` berisi
+    (kode_periode, AccrualResult, journal_port) dari `process_period`;
+    mengembalikan [(port, [(kode_periode, AccrualResult cabang tersebut)])].
+    """
+    return [
+        (port, [(kode, slice_result(result, journal_port, [port])) for kode, result, journal_port in period_results])
+        for port in selected_cabang
+    ]
+
+
+def _no_progress(stage):
+    pass
+
+
+@profiled("process_period")
+def process_period(kbm, input_bulan, input_tahun, selected_cabang, reference=None, progress=None,
+                   blocks=True, backend=None, classify=None):
+    """
+    Seperti `run_processing`, tetapi mengembalikan (AccrualResult, journal_port)
+    dengan `journal_port` = Port Id asal setiap baris FULL_NO_JMH.
+
+    `progress(stage)` (opsional) dipanggil di awal tahap "classify", "blocks",
+    dan "journal". `blocks=False` melewati blok detail per port (dfs_FL/dfs_FB
+    kosong), untuk run yang hanya mengekspor jurnal (lihat kbm_export.py).
+    `backend` memilih implementasi klasifikasi, tarif, List JMH, dan jurnal
+    (lihat `get_backend`); hasilnya identik untuk semua backend. `classify`
+    menggantikan `classify_rows` dengan signature yang sama tanpa `rows` (mode
+    inkremental, lihat kbm_incremental.py).
+    """
+    progress = progress or _no_progress
+    backend = get_backend(backend)
+    if not selected_cabang:
+        raise KBMInputError("Tolong pilih setidaknya satu cabang.")
+    if kbm.cabang is not None:
+        unavailable = [c for c in selected_cabang if c not in kbm.cabang]
+        if unavailable:
+            raise KBMInputError(
+                f"DATA_KBM hanya dimuat lengkap untuk cabang {', '.join(kbm.cabang)}; "
+                f"cabang {', '.join(unavailable)} tidak tersedia."
+            )
+
+    tanggal_akhir, kode_yymm = hitung_periode(input_bulan, input_tahun)
+
+    # Penentuan cabang
+    full_list = list(selected_cabang)
+
+    # B. LOAD DATA STATIS (list_COA dan price_list)
+    if reference is None:
+        reference = load_reference()
+    list_COA, tarif = reference
+
+    # C. DATA KBM + PUSHDOWN CABANG
+    progress("classify")
+    # Kode bulan berikutnya dibaca dari index dokumen (di-parse sekali per load)
+    # untuk semua cabang. Hanya dua hal yang
+    # butuh cabang lain: dokumen_index (cek status FB) dan deduplikasi List JMH
+    # sebelum difilter per cabang; keduanya cukup memakai mask ini dan kolom
+    # kunci (`key_frame`). Sisanya langsung dipangkas ke cabang terpilih
+    # (`kbm` sendiri tidak diubah).
+    with stage("status_masks", len(kbm.FL_clean) + len(kbm.FB_clean)):
+        doc_index = kbm.doc_index
+        if doc_index is None:
+            doc_index = build_doc_index(*(kbm.key_frame(field) for field in SHEET_FIELDS))
+        next_fl = doc_index.period_mask("FL_clean", kode_yymm)
+        next_fl1 = doc_index.period_mask("FL1_clean", kode_yymm)
+        next_fl2 = doc_index.period_mask("FL2_clean", kode_yymm)
+
+        # Index dokumen untuk cek status FB: No Dokumen sheet 3 + FL1/FL2 yang
+        # berstatus NEXT_MONTH_DOC
+        dokumen_index = pd.Index(pd.concat([
+            kbm.key_frame("FL_clean")["No Dokumen"],
+            kbm.key_frame("FL1_clean").loc[next_fl1, "No Dokumen"],
+            kbm.key_frame("FL2_clean").loc[next_fl2, "No Dokumen"],
+        ]).astype(str).unique())
+
+        JMH_gabungan = backend.list_jmh(kbm, doc_index, next_fl, next_fl1, next_fl2, kode_yymm, full_list)
+
+        # Status dan biaya per baris untuk semua cabang (pandas atau rencana lazy
+        # polars; mode inkremental memakai ulang hasil baris yang tidak berubah)
+        rows = (classify or classify_rows)(kbm, doc_index, kode_yymm, tarif, backend)
+        status = rows.status
+        selected = {field: getattr(kbm, field)["Port Id"].isin(full_list).to_numpy() for field in SHEET_FIELDS}
+        in_fl, in_fb = selected["FL_clean"], selected["FB_clean"]
+
+        # FL_clean gabungan hanya dibutuhkan blok detail (jurnal membaca sheet langsung)
+        if blocks:
+            FL_clean = kbm.FL_clean[in_fl].copy()
+
+            # Filtering NEXT_MONTH_DOC untuk FL1 dan FL2 (hanya baris ini yang ikut digabung)
+            keep_fl1 = (status["FL1_clean"] == NEXT_MONTH_CODE) & selected["FL1_clean"]
+            FL1_clean = kbm.FL1_clean[keep_fl1].copy()
+            FL1_clean["Status_KBM"] = "NEXT_MONTH_DOC"
+
+            keep_fl2 = (status["FL2_clean"] == NEXT_MONTH_CODE) & selected["FL2_clean"]
+            FL2_clean = kbm.FL2_clean[keep_fl2].copy()
+            FL2_clean["Status_KBM"] = "NEXT_MONTH_DOC"
+
+            # Terapkan status NO_DOC dan NEXT_MONTH_DOC ke FL_clean (Sheet 2)
+            _apply_status(FL_clean, status["FL_clean"][in_fl])
+
+            # Gabungkan FL yang memiliki status
+            FL_clean = pd.concat([FL_clean, FL1_clean, FL2_clean], ignore_index=True)
+
+
+        # --- Data FB (Format Baru: Sheet 3) ---
+        FB_clean = kbm.FB_clean[in_fb].copy()
+
+        # Terapkan Status KBM ke FB_clean
+        _apply_status(FB_clean, status["FB_clean"][in_fb])
+
+    # Biaya dari tarif per baris (dihitung `classify_rows`)
+    FB_clean = FB_clean.reset_index(drop=True)
+    fb_costs = rows.fb_costs[in_fb]
+    for i, col in enumerate(TARIF_COLS):
+        FB_clean[col] = fb_costs[:, i]
+    missing_tarif = missing_tarif_report(FB_clean, rows.tarif_found[in_fb])
+
+    # Cek status dokumen
+    FB_clean["Status_dokumen"] = backend.document_status(kbm.FB_clean, np.flatnonzero(in_fb), dokumen_index)
+
+    # =========================================================================
+    # D. PEMBENTUKAN OUTPUT DETAIL (dfs_FL dan dfs_FB)
+    # =========================================================================
+    progress("blocks")
+    if blocks:
+        dfs_FL, dfs_FB = build_detail_blocks(FL_clean, FB_clean, full_list)
+    else:
+        dfs_FL, dfs_FB = {}, {}
+
+    # E-G. JURNAL NO JMH (FL + FB) dari baris NO_DOC cabang terpilih
+    progress("journal")
+    no_doc = {field: selected[field] & is_no_doc(status[field]) for field in SHEET_FIELDS}
+    with stage("journal", sum(int(mask.sum()) for mask in no_doc.values())):
+        FULL_NO_JMH, journal_port = backend.journal(
+            kbm, no_doc, rows.fb_costs, list_COA, input_bulan, input_tahun, tanggal_akhir
+        )
+
+    return AccrualResult(dfs_FL, dfs_FB, JMH_gabungan, FULL_NO_JMH, full_list, missing_tarif), journal_port
@@ -0,0 +1,94 @@
+"""
+Ekspor jurnal NO JMH dan List JMH sebagai file yang mudah dibaca mesin.
+
+`FULL_NO_JMH` dan `JMH_gabungan` ditulis sebagai CSV (di-stream per chunk)
+dan/atau Parquet, dengan urutan kolom tetap (`ordered_cols` untuk jurnal)
+dan Debit/Kredit bertipe angka, sehingga import ERP dan skrip audit tidak
+perlu mem-parse ulang workbook OUTPUT_KBM. Run yang hanya butuh jurnal
+(`kbm_cli.py --journal-only`) melewati blok detail dan penulisan Excel.
+
+Parquet memerlukan pyarrow (tercantum di requirements.txt).
+"""
+import importlib.util
+import os
+
+import pandas as pd
+
+from kbm_engine import KBMInputError, ordered_cols
+from kbm_profile import profiled
+
+JOURNAL_FORMATS = ("csv", "parquet")
+
+# Kolom List JMH (urutan tetap)
+LIST_JMH_COLS = ["Port Id", "No Dokumen", "vesvoy", "sumber"]
+
+# Baris per chunk CSV / row group Parquet
+CSV_CHUNK_ROWS = 50_000
+PARQUET_ROW_GROUP = 100_000
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _typed(df, columns, numeric=()):
+    """Urutan kolom tetap; kolom angka menjadi float64, sisanya teks (NA tetap kosong)."""
+    df = df.reindex(columns=columns).reset_index(drop=True)
+    for col in columns:
+        if col in numeric:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Kolom campuran (mis. angka & teks) disamakan ke teks agar skema stabil
+            df[col] = df[col].astype("string")
+    return df
+
+
+def journal_frame(results):
+    """
+    FULL_NO_JMH bertipe untuk ekspor. `results` berisi (kode_periode,
+    AccrualResult); lebih dari satu periode digabung dengan kolom "periode"
+    di depan.
+    """
+    return _combine(results, lambda r: _typed(r.FULL_NO_JMH, ordered_cols, numeric=("Debit", "Kredit")))
+
+
+def list_jmh_frame(results):
+    """JMH_gabungan dengan kolom LIST_JMH_COLS (lihat `journal_frame`)."""
+    return _combine(results, lambda r: _typed(r.JMH_gabungan, LIST_JMH_COLS))
+
+
+def _combine(results, frame_fn):
+    if len(results) == 1:
+        return frame_fn(results[0][1])
+    frames = [frame_fn(result).assign(periode=kode) for kode, result in results]
+    combined = pd.concat(frames, ignore_index=True)
+    return combined[["periode"] + [c for c in combined.columns if c != "periode"]]
+
+
+def write_csv(df, path):
+    df.to_csv(path, index=False, chunksize=CSV_CHUNK_ROWS, encoding="utf-8")
+
+
+def write_parquet(df, path):
+    if not parquet_available():
+        raise KBMInputError("Ekspor Parquet memerlukan paket pyarrow (pip install pyarrow).")
+    df.to_parquet(path, index=False, engine="pyarrow", row_group_size=PARQUET_ROW_GROUP)
+
+
+_WRITERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+@profiled("write_journal")
+def export_journal(results, directory, stem, formats=("csv",)):
+    """
+    Menulis `<stem>_JURNAL.<ext>` dan `<stem>_LIST_JMH.<ext>` untuk setiap
+    format di `formats`; mengembalikan daftar path yang ditulis.
+    """
+    frames = {"JURNAL": journal_frame(results), "LIST_JMH": list_jmh_frame(results)}
+    paths = []
+    for fmt in formats:
+        for label, df in frames.items():
+            path = os.path.join(directory, f"{stem}_{label}.{fmt}")
+            _WRITERS[fmt](df, path)
+            paths.append(path)
+    return paths
@@ -0,0 +1,332 @@
+"""
+Mode inkremental: membandingkan unggahan DATA_KBM dengan unggahan sebelumnya.
+
+Ekspor KBM bulan ke bulan sangat tumpang tindih (sheet 1 dan 2 adalah bulan -2
+dan -1 dari ekspor sebelumnya). Setelah setiap load disimpan:
+
+- sidik jari baris (hash `Id KBM` + kolom yang memengaruhi klasifikasi/biaya)
+  per grup FL dan FB, untuk laporan delta baru/berubah/sama/hilang;
+- hasil parse nomor dokumen per teks unik (`ParseMemo`), sehingga load
+  berikutnya hanya menjalankan regex '/yymm/' untuk dokumen yang baru;
+- Status_KBM dan biaya FB per baris (`classify_rows`), per (periode, digest
+  list_tarif, versi kode engine) dan diindeks sidik jari baris. Unggahan
+  berikutnya pada aliran yang sama hanya mengklasifikasi baris baru/berubah
+  untuk periode tersebut; sisanya diambil dari hasil tersimpan. Karena sheet bergeser antar ekspor, hasil grup FL dipakai
+  lintas sheet: baris FL1/FL2 cukup memakai status NEXT_MONTH_DOC-nya,
+  sedangkan baris sheet FL saat ini hanya memakai hasil yang berasal dari
+  sheet FL (lengkap dengan status NO_DOC).
+
+Index dokumen, List JMH, Status_dokumen, blok detail, dan jurnal tetap
+dihitung ulang: semuanya bergantung pada seluruh isi unggahan atau pada cabang
+yang dipilih, bukan hanya pada baris itu sendiri.
+
+State disimpan per aliran (`stream_key`): garis keturunan file (nama file
+unggahan) ditambah id sesi bila ada, sehingga setiap pengguna dibandingkan
+dengan unggahannya sendiri. Baca state, bandingkan, dan simpan berjalan di
+bawah lock per aliran agar job bersamaan tidak saling menimpa state.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from kbm_cache import RESULT_VERSION, load_kbm_cached
+from kbm_engine import NEXT_MONTH_CODE, SHEET_FIELDS, RowResults, classify_rows, parse_memo
+from kbm_reference import CACHE_DIR, TARIF_COLS, reference_digests
+
+STATE_DIR = os.path.join(CACHE_DIR, "incremental")
+
+# Jumlah (periode, list_tarif) hasil per baris yang disimpan per aliran
+ROW_RESULT_KEYS = int(os.environ.get("KBM_INCREMENTAL_PERIODS", "12"))
+
+# Kolom yang menentukan sidik jari baris (kolom yang tidak ada dilewati)
+FINGERPRINT_COLS_FL = [
+    "Id KBM", "Port Id", "Vessel Id To", "Voyage No To", "Nama Kegiatan", "Ukuran", "Status",
+    "Sub Total", "Jenis Dokumen", "No Dokumen", "Kode ACC",
+]
+FINGERPRINT_COLS_FB = [
+    "Id KBM", "Port Id", "Vessel Id", "Voyage No", "Type Size Name", "Qty Angkatan", "Id Document",
+]
+
+# Lock per aliran (state dibaca-dibandingkan-disimpan secara atomik dalam satu proses)
+_stream_locks = {}
+_stream_locks_guard = threading.Lock()
+
+# Grup perbandingan: ketiga sheet FL digabung karena bulan bergeser antar ekspor
+GROUPS = {
+    "FL": (("FL1_clean", "FL2_clean", "FL_clean"), FINGERPRINT_COLS_FL),
+    "FB": (("FB_clean",), FINGERPRINT_COLS_FB),
+}
+GROUP_OF = {field: group for group, (fields, _) in GROUPS.items() for field in fields}
+
+
+class IncrementalState(NamedTuple):
+    """Ringkasan unggahan terakhir untuk satu aliran (`stream`)."""
+    digest: str
+    saved_at: float
+    fingerprints: dict  # grup -> DataFrame(Id KBM, fp)
+    memo: object        # ParseMemo
+    delta: pd.DataFrame  # delta unggahan ini terhadap unggahan sebelumnya
+
+
+class IncrementalLoad(NamedTuple):
+    """Hasil `load_kbm_incremental`."""
+    kbm: object          # KBMData
+    digest: str
+    delta: pd.DataFrame
+    classify: object     # pengganti `classify_rows` untuk process_period (`row_classifier`)
+
+
+def row_fingerprints(df, columns):
+    """Hash uint64 per baris dari `columns` (nilai category di-hash sesuai isinya)."""
+    cols = [c for c in columns if c in df.columns]
+    return pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+
+
+def sheet_fingerprints(kbm):
+    """Sidik jari baris per sheet (field -> uint64), kolom menurut grupnya."""
+    return {
+        field: row_fingerprints(getattr(kbm, field), columns)
+        for fields, columns in GROUPS.values() for field in fields
+    }
+
+
+def _group_fingerprints(kbm, fingerprints):
+    groups = {}
+    for group, (fields, _) in GROUPS.items():
+        groups[group] = pd.DataFrame({
+            "Id KBM": np.concatenate([getattr(kbm, f)["Id KBM"].astype(str).to_numpy(dtype=object) for f in fields]),
+            "fp": np.concatenate([fingerprints[f] for f in fields]),
+        })
+    return groups
+
+
+def stream_key(file_name, session=None):
+    """
+    Nama aliran state untuk unggahan `file_name`, dipisah per `session`
+    (mis. id sesi Streamlit) bila diberikan.
+    """
+    stem = os.path.splitext(os.path.basename(str(file_name or "")))[0].lower()
+    key = re.sub(r"[^0-9a-z]+", "_", stem).strip("_")[:64] or "default"
+    if session:
+        key = f"{key}-{hashlib.sha1(str(session).encode()).hexdigest()[:12]}"
+    return key
+
+
+def _stream_lock(stream):
+    with _stream_locks_guard:
+        return _stream_locks.setdefault(stream, threading.Lock())
+
+
+def _state_path(stream):
+    return os.path.join(STATE_DIR, f"{stream}.pkl")
+
+
+def load_state(stream):
+    """State unggahan sebelumnya, atau None jika belum ada / tidak terbaca."""
+    path = _state_path(stream)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return None
+
+
+def save_state(state, stream):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = f"{_state_path(stream)}.{os.getpid()}.tmp"
+    pd.to_pickle(state, tmp)
+    os.replace(tmp, _state_path(stream))
+
+
+def compute_delta(current, previous):
+    """
+    Laporan delta per grup: jumlah baris, sama, berubah (Id KBM lama dengan isi
+    baru), baru (Id KBM belum pernah ada), dan Id KBM yang hilang.
+    """
+    rows = []
+    for group, cur in current.items():
+        prev = previous.fingerprints.get(group) if previous is not None else None
+        if prev is None:
+            prev = pd.DataFrame({"Id KBM": [], "fp": np.array([], dtype=np.uint64)})
+        same = np.isin(cur["fp"].to_numpy(), prev["fp"].to_numpy())
+        known_id = cur["Id KBM"].isin(prev["Id KBM"]).to_numpy()
+        rows.append({
+            "Grup": group,
+            "Baris": len(cur),
+            "Sama": int(same.sum()),
+            "Berubah": int((~same & known_id).sum()),
+            "Baru": int((~same & ~known_id).sum()),
+            "Id KBM Hilang": int((~pd.Index(prev["Id KBM"].unique()).isin(cur["Id KBM"])).sum()),
+        })
+    return pd.DataFrame(rows)
+
+
+def _rows_path(stream, kode_yymm, version):
+    return os.path.join(STATE_DIR, f"{stream}.rows-{kode_yymm}-{version[:16]}-{RESULT_VERSION[:16]}.pkl")
+
+
+def load_rows(stream, kode_yymm, version):
+    """Hasil per baris tersimpan (grup -> DataFrame berindeks sidik jari), atau {}."""
+    path = _rows_path(stream, kode_yymm, version)
+    if not os.path.exists(path):
+        return {}
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return {}
+
+
+def save_rows(tables, stream, kode_yymm, version):
+    """Menyimpan hasil per baris; hanya `ROW_RESULT_KEYS` (periode, tarif) terbaru yang disimpan."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _rows_path(stream, kode_yymm, version)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(tables, tmp)
+    os.replace(tmp, path)
+
+    prefix = f"{stream}.rows-"
+    paths = [os.path.join(STATE_DIR, name) for name in os.listdir(STATE_DIR)
+             if name.startswith(prefix) and name.endswith(".pkl")]
+    for old in sorted(paths, key=os.path.getmtime, reverse=True)[ROW_RESULT_KEYS:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def _take(values, pos, fresh):
+    """Nilai tersimpan untuk `pos` >= 0, nilai `fresh` (urut) untuk sisanya."""
+    out = np.empty((len(pos),) + values.shape[1:], dtype=values.dtype)
+    known = pos >= 0
+    out[known] = values[pos[known]]
+    out[~known] = fresh
+    return out
+
+
+def _unique_table(fp, columns, prefer=None):
+    """Tabel berindeks sidik jari unik; baris `prefer` didahulukan bila sidik jari sama."""
+    table = pd.DataFrame(columns, index=pd.Index(fp, name="fp"))
+    if prefer is not None:
+        table = table.iloc[np.argsort(~prefer, kind="stable")]
+    return table[~table.index.duplicated()]
+
+
+def reuse_rows(kbm, doc_index, kode_yymm, tarif, backend, fingerprints, stored):
+    """
+    `RowResults` semua baris: baris yang sidik jarinya ada di `stored` diambil
+    dari sana, sisanya dihitung `classify_rows`. Mengembalikan (hasil, tabel
+    baru untuk disimpan).
+    """
+    fl_table = stored.get("FL")
+    fb_table = stored.get("FB")
+    pos = {}
+    for field in SHEET_FIELDS:
+        table = stored.get(GROUP_OF[field])
+        found = np.full(len(fingerprints[field]), -1, dtype=np.intp)
+        if table is not None:
+            found = table.index.get_indexer(fingerprints[field])
+            if field == "FL_clean":
+                # Sheet saat ini butuh status NO_DOC: hanya hasil yang berasal dari sheet FL
+                known = found >= 0
+                found[known] = np.where(table["full"].to_numpy()[found[known]], found[known], -1)
+        pos[field] = found
+    missing = {field: np.flatnonzero(found < 0) for field, found in pos.items()}
+    fresh = classify_rows(kbm, doc_index, kode_yymm, tarif, backend, rows=missing)
+
+    # Grup FL: kode lengkap (sheet FL) atau NEXT_MONTH_DOC saja (FL1/FL2)
+    fl_fields = GROUPS["FL"][0]
+    status, fl_codes, fl_full = {}, [], []
+    for field in fl_fields:
+        if fl_table is None:
+            codes = fresh.status[field]
+            full = np.full(len(codes), field == "FL_clean")
+        else:
+            codes = _take(fl_table["status"].to_numpy(), pos[field], fresh.status[field])
+            full = _take(fl_table["full"].to_numpy(), pos[field], field == "FL_clean")
+        fl_codes.append(codes)
+        fl_full.append(full)
+        status[field] = codes if field == "FL_clean" else np.where(
+            codes == NEXT_MONTH_CODE, NEXT_MONTH_CODE, -1
+        ).astype(np.int8)
+
+    # Grup FB: status, biaya per kolom tarif, dan tarif ditemukan
+    fb_pos = pos["FB_clean"]
+    if fb_table is None:
+        status["FB_clean"] = fresh.status["FB_clean"]
+        fb_costs, tarif_found = fresh.fb_costs, fresh.tarif_found
+    else:
+        status["FB_clean"] = _take(fb_table["status"].to_numpy(), fb_pos, fresh.status["FB_clean"])
+        fb_costs = _take(fb_table[TARIF_COLS].to_numpy(dtype=float), fb_pos, fresh.fb_costs)
+        tarif_found = _take(fb_table["found"].to_numpy(), fb_pos, fresh.tarif_found)
+
+    fl_fp = np.concatenate([fingerprints[field] for field in fl_fields])
+    fl_full = np.concatenate(fl_full)
+    tables = {
+        "FL": _unique_table(fl_fp, {"status": np.concatenate(fl_codes), "full": fl_full}, prefer=fl_full),
+        "FB": _unique_table(fingerprints["FB_clean"], {
+            "status": status["FB_clean"],
+            **{col: fb_costs[:, i] for i, col in enumerate(TARIF_COLS)},
+            "found": tarif_found,
+        }),
+    }
+    return RowResults(status, fb_costs, tarif_found), tables
+
+
+def row_classifier(kbm, stream, fingerprints=None):
+    """
+    Pengganti `classify_rows` untuk `process_period(..., classify=...)` atas
+    `kbm`: hasil per baris disimpan di `stream` per (periode, digest
+    list_tarif), dan hanya baris yang belum ada di sana yang diklasifikasi.
+    `fingerprints` (lihat `sheet_fingerprints`) dihitung bila tidak diberikan.
+    """
+    memo = {"fingerprints": fingerprints}
+
+    def classify(kbm_period, doc_index, kode_yymm, tarif, backend):
+        version = reference_digests((tarif,))[0]
+        # Tarif di luar cache kbm_reference tidak punya versi; KBMData lain tidak punya sidik jari
+        if version is None or kbm_period is not kbm:
+            return classify_rows(kbm_period, doc_index, kode_yymm, tarif, backend)
+        if memo["fingerprints"] is None:
+            memo["fingerprints"] = sheet_fingerprints(kbm)
+        with _stream_lock(stream):
+            stored = load_rows(stream, kode_yymm, version)
+            rows, tables = reuse_rows(kbm, doc_index, kode_yymm, tarif, backend, memo["fingerprints"], stored)
+            save_rows(tables, stream, kode_yymm, version)
+        return rows
+
+    return classify
+
+
+def load_kbm_incremental(source, stream=None, parallel=None):
+    """
+    `load_kbm_cached` yang memakai state unggahan sebelumnya di `stream`
+    (default: `stream_key` dari nama file `source`).
+
+    Mengembalikan `IncrementalLoad` (KBMData, digest, delta, classify). Nomor
+    dokumen yang sudah pernah di-parse diambil dari state; state lalu diganti
+    dengan unggahan ini. `classify` diteruskan ke `process_period` agar hasil
+    per baris yang tidak berubah dipakai ulang (lihat `row_classifier`).
+    """
+    if stream is None:
+        stream = stream_key(source if isinstance(source, str) else getattr(source, "name", None))
+    with _stream_lock(stream):
+        previous = load_state(stream)
+        memo = previous.memo if previous is not None else None
+        kbm, digest = load_kbm_cached(source, parallel=parallel, memo=memo)
+
+        # File yang sama diunggah ulang: laporkan delta saat pertama kali diunggah
+        if previous is not None and previous.digest == digest:
+            return IncrementalLoad(kbm, digest, previous.delta, row_classifier(kbm, stream))
+
+        fingerprints = sheet_fingerprints(kbm)
+        current = _group_fingerprints(kbm, fingerprints)
+        delta = compute_delta(current, previous)
+        save_state(IncrementalState(digest, time.time(), current, parse_memo(kbm), delta), stream)
+    return IncrementalLoad(kbm, digest, delta, row_classifier(kbm, stream, fingerprints))
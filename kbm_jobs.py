@@ -0,0 +1,242 @@
+"""
+Eksekusi pemrosesan KBM sebagai job di worker pool bersama.
+
+Semua sesi Streamlit dalam satu proses server memakai satu `ThreadPoolExecutor`
+dengan jumlah worker terbatas (`KBM_JOB_WORKERS`). Job yang melebihi kapasitas
+menunggu di antrean FIFO, sehingga beberapa pengguna yang menjalankan akhir
+bulan bersamaan tidak saling berebut core tanpa batas. Setiap job mencatat
+tahap yang sedang berjalan (load, classify, blocks, journal, write) agar UI
+dapat menampilkan progres, lalu menyimpan workbook hasilnya. Job dengan
+`profile=True` (atau `KBM_PROFILE=1`) juga mencatat waktu/baris/memori per
+tahap dan menulis log run-nya (lihat kbm_profile.py); puncak memori hanya
+dicatat bila tidak ada job lain yang sedang berjalan, karena tracemalloc
+memperlambat seluruh proses. Job dengan
+`split_zip=True` menghasilkan ZIP berisi satu workbook per cabang; render
+per cabang memakai process pool bersama kbm_writer (KBM_EXPORT_WORKERS),
+sehingga beberapa job ZIP tidak menambah proses melebihi batas tersebut.
+"""
+import contextlib
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from kbm_cache import load_kbm_cached, period_result
+from kbm_engine import check_cabang, kode_periode, slice_result, split_by_branch
+from kbm_incremental import load_kbm_incremental, stream_key
+from kbm_profile import PROFILE_ENABLED, Profiler, release_tracing
+from kbm_writer import (
+    XLSX_MIME,
+    ZIP_MIME,
+    batch_file_name,
+    build_batch_output,
+    build_branch_zip,
+    build_output,
+    output_file_name,
+    zip_file_name,
+)
+
+JOB_WORKERS = int(os.environ.get("KBM_JOB_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+# Job selesai disimpan sebentar agar sesi yang rerun masih bisa mengambil hasilnya
+JOB_TTL_SECONDS = 30 * 60
+
+# Tahap job berurutan, beserta label untuk UI
+STAGES = {
+    "queued": "Menunggu antrean",
+    "load": "Memuat DATA_KBM",
+    "classify": "Klasifikasi status KBM",
+    "blocks": "Menyusun blok per port",
+    "journal": "Menyusun jurnal NO JMH",
+    "write": "Menulis file Excel",
+    "done": "Selesai",
+}
+_PERIOD_STAGES = ["classify", "blocks", "journal"]
+_FIXED_PROGRESS = {"queued": 0.0, "load": 0.0, "write": 0.9, "done": 1.0}
+
+
+class Job:
+    """
+    Satu permintaan pemrosesan: status, tahap, dan hasil (atau error).
+    `periods` berisi satu atau lebih (bulan, tahun); lebih dari satu periode
+    menghasilkan satu workbook gabungan (lihat `build_batch_output`).
+    """
+
+    def __init__(self, periods, selected_cabang, incremental=False, profile=False, split_zip=False, session=None):
+        self.id = uuid.uuid4().hex
+        self.session = session  # id sesi pengirim (aliran state mode inkremental)
+        self.periods = list(periods)
+        self.incremental = incremental
+        self.split_zip = split_zip
+        self.profile_enabled = profile or PROFILE_ENABLED
+        self.input_bulan, self.input_tahun = self.periods[0]
+        self.selected_cabang = list(selected_cabang)
+        self.stage = "queued"
+        self.period_index = 0
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result = None       # AccrualResult (periode terakhir)
+        self.results = []        # (kode_periode, AccrualResult) untuk semua periode
+        self.output = None       # bytes workbook (atau ZIP bila split_zip)
+        self.delta = None        # laporan delta (mode inkremental)
+        self.profile = None      # tabel tahap (Profiler.to_frame) bila profiling aktif
+        self.profile_log = None  # path log JSON run ini
+        if len(self.periods) > 1:
+            self.workbook_name = batch_file_name(self.periods)
+        else:
+            self.workbook_name = output_file_name(self.input_bulan, self.input_tahun)
+        # Nama file unduhan; di mode ZIP nama workbook per cabang diturunkan dari workbook_name
+        self.file_name = zip_file_name(self.workbook_name) if split_zip else self.workbook_name
+        self.mime = ZIP_MIME if split_zip else XLSX_MIME
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage):
+        with self._lock:
+            self.stage = stage
+
+    @property
+    def keterangan(self):
+        (bulan_awal, tahun_awal), (bulan_akhir, tahun_akhir) = self.periods[0], self.periods[-1]
+        if len(self.periods) == 1:
+            return f"{bulan_awal} {tahun_awal}"
+        return f"{bulan_awal} {tahun_awal} - {bulan_akhir} {tahun_akhir} ({len(self.periods)} periode)"
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def progress(self):
+        """Perkiraan progres 0..1: load 10%, tahap per periode 80%, tulis Excel 10%."""
+        if self.stage in _FIXED_PROGRESS:
+            return _FIXED_PROGRESS[self.stage]
+        step = _PERIOD_STAGES.index(self.stage) / len(_PERIOD_STAGES)
+        return 0.1 + 0.8 * (self.period_index + step) / len(self.periods)
+
+    @property
+    def label(self):
+        if self.stage == "queued":
+            return f"{STAGES['queued']} (posisi {queue_position(self)})"
+        if len(self.periods) > 1 and self.stage in _PERIOD_STAGES:
+            bulan, tahun = self.periods[self.period_index]
+            return f"{STAGES[self.stage]} - {bulan} {tahun} ({self.period_index + 1}/{len(self.periods)})"
+        return STAGES[self.stage]
+
+
+_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="kbm-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+_running = 0  # job yang sedang dieksekusi worker (dilindungi _jobs_lock)
+
+
+def _new_profiler(job, memory):
+    return Profiler(memory=memory, meta={
+        "job_id": job.id,
+        "periods": [f"{bulan} {tahun}" for bulan, tahun in job.periods],
+        "cabang": job.selected_cabang,
+        "incremental": job.incremental,
+        "split_zip": job.split_zip,
+    })
+
+
+def _run_job(job, source):
+    global _running
+    with _jobs_lock:
+        _running += 1
+        # tracemalloc global per proses: hanya bila job ini satu-satunya yang berjalan
+        alone = _running == 1
+    if not alone:
+        release_tracing()
+    profiler = _new_profiler(job, memory=alone) if job.profile_enabled else None
+    try:
+        with profiler or contextlib.nullcontext():
+            _execute(job, source)
+    except Exception as e:
+        job.error = e
+    finally:
+        if profiler is not None:
+            profiler.meta["error"] = None if job.error is None else repr(job.error)
+            job.profile = profiler.to_frame()
+            try:
+                job.profile_log = profiler.write_run_log()
+            except OSError:
+                # Log run bersifat tambahan; kegagalan menulisnya tidak menggagalkan job
+                pass
+        with _jobs_lock:
+            _running -= 1
+        job.finished_at = time.time()
+
+
+def _execute(job, source):
+    # Pilihan cabang dicek sebelum load dan hasil semua cabang dihitung
+    check_cabang(job.selected_cabang)
+    job.set_stage("load")
+    classify = None
+    if job.incremental:
+        # Dibandingkan dengan unggahan sebelumnya dari sesi yang sama untuk file yang sama;
+        # hasil per baris yang tidak berubah dipakai ulang saat klasifikasi
+        kbm, digest, job.delta, classify = load_kbm_incremental(source, stream_key(source.name, job.session))
+    else:
+        kbm, digest = load_kbm_cached(source)
+    # Satu load untuk semua periode; tiap periode hanya memfilter index dokumen
+    period_results = []
+    for i, (input_bulan, input_tahun) in enumerate(job.periods):
+        job.period_index = i
+        job.set_stage("classify")
+        entry = period_result(kbm, digest, input_bulan, input_tahun, progress=job.set_stage, classify=classify)
+        kode = kode_periode(input_bulan, input_tahun)
+        job.result = slice_result(entry.result, entry.journal_port, job.selected_cabang)
+        job.results.append((kode, job.result))
+        period_results.append((kode, entry.result, entry.journal_port))
+    job.set_stage("write")
+    if job.split_zip:
+        branches = split_by_branch(period_results, job.selected_cabang)
+        job.output = build_branch_zip(branches, job.workbook_name).getvalue()
+    elif len(job.periods) > 1:
+        job.output = build_batch_output(job.results).getvalue()
+    else:
+        job.output = build_output(job.result).getvalue()
+    job.set_stage("done")
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id, job in list(_jobs.items()):
+        if job.done and job.finished_at < cutoff:
+            del _jobs[job_id]
+
+
+def submit_job(data, name, periods, selected_cabang, incremental=False, profile=False, split_zip=False,
+               session=None):
+    """
+    Mendaftarkan job untuk isi file `data` (bytes) bernama `name` dan daftar
+    `periods` (bulan, tahun), lalu mengembalikan `Job`-nya. Pemrosesan
+    berjalan di worker pool; `incremental` memakai kbm_incremental (state per
+    nama file dan `session`), `profile` mencatat profil per tahap (lihat
+    kbm_profile.py), dan `split_zip` menulis ZIP satu workbook per cabang.
+    """
+    source = io.BytesIO(data)
+    source.name = name
+    job = Job(periods, selected_cabang, incremental, profile, split_zip, session)
+    with _jobs_lock:
+        _prune()
+        _jobs[job.id] = job
+    _pool.submit(_run_job, job, source)
+    return job
+
+
+def get_job(job_id):
+    """Job dengan id tersebut, atau None jika tidak ada / sudah kedaluwarsa."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def queue_position(job):
+    """Jumlah job yang masih menunggu di depan `job` (1 = berikutnya)."""
+    with _jobs_lock:
+        waiting = [j for j in _jobs.values() if j.stage == "queued" and not j.done]
+    waiting.sort(key=lambda j: j.submitted_at)
+    return waiting.index(job) + 1 if job in waiting else 0
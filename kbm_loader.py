@@ -0,0 +1,541 @@
+"""
+Pemuatan workbook DATA_KBM menjadi `KBMData`.
+
+Empat sheet yang dipakai (FL bulan-2, FL bulan-1, FL saat ini, FB) tidak saling
+bergantung sampai tahap penggabungan, sehingga masing-masing dapat di-parse dan
+dibersihkan (`clean_df`) di proses worker terpisah. Parsing xlrd/openpyxl
+berjalan di Python murni dan terikat CPU, jadi mode paralel membuat waktu muat
+mengikuti jumlah core, bukan jumlah sheet. Semua load paralel (juga dari job
+yang berjalan bersamaan) memakai satu process pool bersama per proses dengan
+KBM_LOAD_WORKERS proses, sehingga jumlah proses tidak berlipat per job.
+
+Sheet FL dan FB dikenali dari kolom header-nya, lalu hanya sheet tersebut dan
+kolom yang dipakai (`kolom_tampilan_fl`/`kolom_tampilan_fb`) yang disimpan.
+Aturan baris jarang baseline (`dropna(thresh=5)`) tetap dihitung atas SELURUH
+kolom baris sheet, bukan hanya kolom yang dipakai, sehingga baris yang sama
+dibuang/dipertahankan seperti `read_kbm_workbook` -> `prepare_kbm`.
+
+Untuk ekspor yang sangat besar, mode streaming (`load_kbm_streaming`) membaca
+baris sheet per chunk, tanpa membentuk frame mentah satu sheet penuh beserta
+salinan `dropna`/header/`reset_index`-nya. Setiap chunk langsung
+diklasifikasi (kode bulan nomor dokumen untuk `DocIndex`) dan dipangkas ke
+cabang yang diminta; baris cabang lain hanya meninggalkan kolom kuncinya.
+Puncak memori mengikuti ukuran chunk ditambah frame hasil akhir cabang
+tersebut, bukan ukuran file.
+"""
+import atexit
+import datetime
+import io
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import xlrd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas._libs.parsers import STR_NA_VALUES
+from pandas.api.types import union_categoricals
+
+from kbm_engine import (
+    MAX_CATEGORY_RATIO,
+    SHEET_FIELDS,
+    SCHEMA_FB,
+    SCHEMA_FL,
+    DocIndex,
+    KBMData,
+    KBMInputError,
+    assemble_kbm,
+    clean_df,
+    derive_columns,
+    document_tokens,
+    kolom_tampilan_fb,
+    kolom_tampilan_fl,
+    periode_pairs,
+    schema_column,
+)
+from kbm_profile import profiled, stage
+
+# Mode paralel dapat diaktifkan untuk seluruh server lewat environment
+PARALLEL_LOAD = os.environ.get("KBM_PARALLEL_LOAD", "0") == "1"
+
+# Jumlah proses pool load paralel, dipakai bersama semua job (0 = jumlah core, maks. 4 sheet)
+LOAD_WORKERS = int(os.environ.get("KBM_LOAD_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+_load_pool = None
+_load_pool_lock = threading.Lock()
+
+# Mode streaming (lihat load_kbm_streaming) dan jumlah baris data per chunk
+STREAM_LOAD = os.environ.get("KBM_STREAM_LOAD", "0") == "1"
+CHUNK_ROWS = int(os.environ.get("KBM_CHUNK_ROWS", "50000"))
+
+# Baris dengan nilai terisi kurang dari ini dibuang (sama dengan dropna(thresh=5))
+MIN_FILLED = 5
+
+# Jumlah baris awal tiap sheet yang diperiksa untuk mencari baris header
+PEEK_ROWS = 50
+
+# Kolom penanda header: Format Lama vs Format Baru
+SIGNATURE_FL = {"Sub Total", "No Dokumen"}
+SIGNATURE_FB = {"Qty Angkatan", "Id Document"}
+
+# Urutan sheet FL dalam workbook: bulan - 2, bulan - 1, periode saat ini
+FL_FIELDS = ("FL1_clean", "FL2_clean", "FL_clean")
+
+# Kolom hasil turunan (tidak dibaca dari file)
+_DERIVED_COLS = {"vesvoy", "Status_KBM", "STVDR", "HAULAGE", "LOLO BM", "Status_dokumen"}
+
+# Kolom sumber yang dibaca: kolom tampilan + kolom yang dipakai perhitungan
+SOURCE_COLS_FL = [c for c in kolom_tampilan_fl if c not in _DERIVED_COLS]
+SOURCE_COLS_FB = [c for c in kolom_tampilan_fb if c not in _DERIVED_COLS]
+
+
+class SheetPlan(NamedTuple):
+    """Lokasi satu sheet KBM: nama sheet, baris header, dan kolom yang dibaca."""
+    sheet_name: str
+    header_row: int
+    usecols: list
+    is_fb: bool
+
+
+def _excel_kwargs(name):
+    # xlrd memuat semua sheet .xls kecuali on_demand=True
+    if name.endswith(".xls"):
+        return {"engine_kwargs": {"on_demand": True}}
+    return {}
+
+
+def _find_header(peek, signature):
+    """Indeks baris pertama yang memuat semua kolom penanda, atau None."""
+    for idx, row in enumerate(peek.itertuples(index=False, name=None)):
+        labels = {str(v).strip() for v in row if isinstance(v, str)}
+        if signature <= labels:
+            return idx
+    return None
+
+
+def _plan_sheet(sheet_name, peek, header_row, is_fb):
+    header = [str(v).strip() if isinstance(v, str) else v for v in peek.iloc[header_row]]
+    wanted = set(SOURCE_COLS_FB if is_fb else SOURCE_COLS_FL)
+    usecols = [i for i, label in enumerate(header) if label in wanted]
+    return SheetPlan(sheet_name, header_row, usecols, is_fb)
+
+
+@profiled("detect_layout")
+def detect_layout(xl):
+    """
+    Mengenali sheet FL dan FB dari tanda header-nya (bukan dari urutan sheet).
+
+    Sheet diperiksa berurutan dan berhenti setelah 3 sheet FL dan 1 sheet FB
+    ditemukan, sehingga sheet lain (mis. "File ABM") tidak pernah di-parse.
+    """
+    plans = {}
+    fl_found = 0
+    for sheet_name in xl.sheet_names:
+        if fl_found == len(FL_FIELDS) and "FB_clean" in plans:
+            break
+        peek = xl.parse(sheet_name, header=None, nrows=PEEK_ROWS)
+
+        row = _find_header(peek, SIGNATURE_FB)
+        if row is not None:
+            plans.setdefault("FB_clean", _plan_sheet(sheet_name, peek, row, is_fb=True))
+            continue
+
+        row = _find_header(peek, SIGNATURE_FL)
+        if row is not None and fl_found < len(FL_FIELDS):
+            plans[FL_FIELDS[fl_found]] = _plan_sheet(sheet_name, peek, row, is_fb=False)
+            fl_found += 1
+
+    missing = []
+    if fl_found < len(FL_FIELDS):
+        missing.append(f"{len(FL_FIELDS)} sheet Format Lama (ditemukan {fl_found})")
+    if "FB_clean" not in plans:
+        missing.append("1 sheet Format Baru")
+    if missing:
+        raise KBMInputError(
+            "Struktur DATA_KBM tidak dikenali: dibutuhkan " + " dan ".join(missing)
+            + ". Pastikan header memuat kolom 'Sub Total'/'No Dokumen' (FL) "
+            "dan 'Qty Angkatan'/'Id Document' (FB)."
+        )
+    return plans
+
+
+def _read_planned(xl, plan):
+    """Membaca satu sheet mulai dari baris header, lalu menyimpan kolom yang dibutuhkan saja."""
+    with stage(f"parse_excel {plan.sheet_name}") as parse:
+        raw = xl.parse(plan.sheet_name, header=None, skiprows=plan.header_row)
+        parse.rows = len(raw)
+    # Baris jarang dihitung atas seluruh kolom sheet (seperti dropna(thresh=5) baseline)
+    filled = raw.notna().sum(axis=1).to_numpy() >= MIN_FILLED
+    raw = raw.iloc[filled, [i for i in plan.usecols if i < raw.shape[1]]]
+    raw.columns = range(raw.shape[1])
+    return clean_df(raw, is_fb=plan.is_fb, drop_sparse=False)
+
+
+def _parse_sheet(data, name, plan):
+    """Worker: parse satu sheet dari isi file lalu jalankan `clean_df`."""
+    with pd.ExcelFile(io.BytesIO(data), **_excel_kwargs(name)) as xl:
+        return _read_planned(xl, plan)
+
+
+def _get_load_pool():
+    """Process pool bersama untuk `load_kbm_parallel` (dibuat saat pertama dipakai)."""
+    global _load_pool
+    with _load_pool_lock:
+        if _load_pool is None:
+            _load_pool = ProcessPoolExecutor(max_workers=LOAD_WORKERS)
+        return _load_pool
+
+
+def _reset_load_pool(pool):
+    """Membuang pool yang rusak (mis. proses worker mati) agar panggilan berikutnya membuat baru."""
+    global _load_pool
+    with _load_pool_lock:
+        if _load_pool is pool:
+            _load_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _shutdown_load_pool():
+    with _load_pool_lock:
+        if _load_pool is not None:
+            _load_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_kbm_parallel(data, name, plans, max_workers=None, memo=None):
+    """
+    Parse & bersihkan keempat sheet di process pool bersama (satu sheet per
+    tugas, KBM_LOAD_WORKERS proses untuk semua job). `max_workers=1` mem-parse
+    di proses ini.
+    """
+    if (max_workers or LOAD_WORKERS) <= 1:
+        with pd.ExcelFile(io.BytesIO(data), **_excel_kwargs(name)) as xl:
+            sheets = {field: _read_planned(xl, plans[field]) for field in SHEET_FIELDS}
+        return assemble_kbm(**sheets, memo=memo)
+    pool = _get_load_pool()
+    try:
+        futures = {
+            field: pool.submit(_parse_sheet, data, name, plan)
+            for field, plan in plans.items()
+        }
+        sheets = {field: futures[field].result() for field in SHEET_FIELDS}
+    except BrokenProcessPool:
+        _reset_load_pool(pool)
+        raise
+    return assemble_kbm(**sheets, memo=memo)
+
+
+@profiled("load_kbm")
+def load_kbm(data, name, parallel=None, max_workers=None, memo=None, streaming=None):
+    """
+    Memuat DATA_KBM dari isi file (`bytes`) menjadi `KBMData`.
+
+    Hanya sheet FL/FB (dikenali dari header) dan kolom yang dipakai yang
+    di-parse. `parallel=None` mengikuti `KBM_PARALLEL_LOAD` dan
+    `streaming=None` mengikuti `KBM_STREAM_LOAD` (streaming didahulukan);
+    `name` dipakai untuk pemeriksaan ekstensi dan pemilihan engine Excel.
+    `memo` (ParseMemo) berisi nomor dokumen yang sudah di-parse pada
+    unggahan sebelumnya.
+    """
+    _check_extension(name)
+
+    if parallel is None:
+        parallel = PARALLEL_LOAD
+    if streaming is None:
+        streaming = STREAM_LOAD
+
+    with pd.ExcelFile(io.BytesIO(data), **_excel_kwargs(name)) as xl:
+        plans = detect_layout(xl)
+        if not parallel and not streaming:
+            return assemble_kbm(**{field: _read_planned(xl, plans[field]) for field in SHEET_FIELDS}, memo=memo)
+
+    if streaming:
+        return _load_streaming(data, name, plans, CHUNK_ROWS, None, memo)
+    return load_kbm_parallel(data, name, plans, max_workers=max_workers, memo=memo)
+
+
+def _check_extension(name):
+    if not (name.endswith('.xls') or name.endswith('.xlsx')):
+        raise KBMInputError("Tolong unggah file berformat .xls atau .xlsx.")
+
+
+# --- Mode streaming ---------------------------------------------------------
+# Nilai sel dikonversi persis seperti pd.read_excel (engine openpyxl/xlrd) dan
+# teks kosong/NA default pandas menjadi NaN, sehingga hasilnya sama dengan
+# `_read_planned` (semua kolom object karena baris header ikut dibaca).
+
+# Kolom kunci yang disimpan untuk SEMUA baris bila load dibatasi `cabang`: index
+# dokumen, cek status dokumen FB, dan deduplikasi List JMH tetap lintas cabang
+SCOPE_KEY_COLS_FL = ["Port Id", "No Dokumen", "vesvoy"]
+SCOPE_KEY_COLS_FB = ["Port Id", "Id Document", "vesvoy"]
+
+
+def _openpyxl_value(cell):
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+
+class _XlsxRows:
+    """Sumber baris .xlsx: workbook openpyxl read-only dibuka sekali untuk semua sheet."""
+
+    def __init__(self, data):
+        self.wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+
+    def rows(self, sheet_name):
+        ws = self.wb[sheet_name]
+        ws.reset_dimensions()
+        for row in ws.rows:
+            yield [_openpyxl_value(cell) for cell in row]
+
+    def close(self):
+        self.wb.close()
+
+
+class _XlsRows:
+    """Sumber baris .xls: xlrd on_demand, sheet dilepas setelah dibaca."""
+
+    def __init__(self, data):
+        self.book = xlrd.open_workbook(file_contents=data, on_demand=True)
+
+    def rows(self, sheet_name):
+        sheet = self.book.sheet_by_name(sheet_name)
+        epoch1904 = self.book.datemode
+        for i in range(sheet.nrows):
+            row = []
+            for value, typ in zip(sheet.row_values(i), sheet.row_types(i)):
+                if typ == xlrd.XL_CELL_DATE:
+                    try:
+                        value = xlrd.xldate.xldate_as_datetime(value, epoch1904)
+                    except OverflowError:
+                        pass
+                    else:
+                        # Tanggal di epoch Excel dianggap jam saja
+                        if value.timetuple()[0:3] == ((1904, 1, 1) if epoch1904 else (1899, 12, 31)):
+                            value = datetime.time(value.hour, value.minute, value.second, value.microsecond)
+                elif typ == xlrd.XL_CELL_ERROR:
+                    value = np.nan
+                elif typ == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(value)
+                elif typ == xlrd.XL_CELL_NUMBER and math.isfinite(value) and int(value) == value:
+                    value = int(value)
+                row.append(value)
+            yield row
+        self.book.unload_sheet(sheet_name)
+
+    def close(self):
+        self.book.release_resources()
+
+
+def _is_filled(value):
+    # NaN != NaN; teks NA default pandas (termasuk "") dihitung kosong
+    return value == value and not (isinstance(value, str) and value in STR_NA_VALUES)
+
+
+def _iter_planned_rows(source, plan):
+    """
+    (jumlah sel terisi di seluruh baris, nilai kolom `plan.usecols` dengan NA -> NaN)
+    untuk setiap baris sheet mulai dari baris header.
+    """
+    for row in islice(source.rows(plan.sheet_name), plan.header_row, None):
+        width = len(row)
+        values = [row[i] if i < width else "" for i in plan.usecols]
+        filled = sum(map(_is_filled, row))
+        yield filled, [np.nan if isinstance(v, str) and v in STR_NA_VALUES else v for v in values]
+
+
+def _clean_chunk(rows, header, is_fb, cabang):
+    """
+    Satu chunk baris data -> (baris dalam cakupan `cabang` dengan kolom
+    turunan, kolom kunci semua baris + `in_scope`). Tanpa `cabang` semua baris
+    masuk dan kolom kunci tidak dipisah (None).
+    """
+    df = derive_columns(pd.DataFrame(rows, columns=header, dtype=object), is_fb)
+    if cabang is None:
+        return df, None
+    in_scope = df["Port Id"].isin(cabang).to_numpy()
+    keys = df[SCOPE_KEY_COLS_FB if is_fb else SCOPE_KEY_COLS_FL].assign(in_scope=in_scope)
+    return df[in_scope], keys
+
+
+def _combine_column(pieces, kind, n_rows):
+    """Potongan satu kolom -> kolom akhir, dengan skema seperti `clean_df` atas seluruh baris."""
+    if kind == "category" and all(isinstance(piece, pd.Categorical) for piece in pieces):
+        try:
+            # Kategori terurut = astype("category") atas seluruh kolom
+            values = union_categoricals(pieces, sort_categories=True)
+        except TypeError:
+            # Kategori campuran (mis. angka dan teks) tidak dapat digabung terurut
+            pass
+        else:
+            if len(values.categories) <= n_rows * MAX_CATEGORY_RATIO:
+                return pd.Series(values)
+            return pd.Series(np.asarray(values, dtype=object))
+    values = pd.concat([pd.Series(piece) for piece in pieces], ignore_index=True)
+    if kind == "category":
+        values = values.astype(object)
+    return schema_column(values, kind, n_rows)
+
+
+class _ColumnChunks:
+    """
+    Kolom frame streaming yang tumbuh per chunk: kolom kode (category di
+    skema) disimpan sebagai Categorical per chunk, kolom lain sebagai array,
+    lalu digabung sekali (`frame`). DataFrame chunk sendiri tidak disimpan.
+    """
+
+    def __init__(self, is_fb):
+        schema = SCHEMA_FB if is_fb else SCHEMA_FL
+        self.kinds = {col: kind for kind, cols in schema.items() for col in cols}
+        self.columns = {}
+        self.n_rows = 0
+
+    def append(self, df):
+        for col in df.columns:
+            values = df[col]
+            if self.kinds.get(col) == "category" and values.dtype == object:
+                piece = pd.Categorical(values)
+            elif isinstance(values.dtype, pd.CategoricalDtype):
+                piece = values.array
+            else:
+                piece = values.to_numpy(copy=True)
+            self.columns.setdefault(col, []).append(piece)
+        self.n_rows += len(df)
+
+    def frame(self):
+        n_rows = max(self.n_rows, 1)
+        columns = {}
+        for col in list(self.columns):
+            columns[col] = _combine_column(self.columns.pop(col), self.kinds.get(col), n_rows)
+        frame = pd.DataFrame(columns)
+        # clean_df mempromosikan baris berlabel 0 sebagai header
+        frame.columns.name = 0
+        return frame
+
+
+class StreamedSheet(NamedTuple):
+    """Satu sheet hasil `stream_sheet`."""
+    frame: pd.DataFrame          # baris dalam cakupan `cabang` (semua baris bila tanpa cakupan)
+    keys: pd.DataFrame           # kolom kunci + in_scope semua baris; None bila tanpa cakupan
+    periode: pd.DataFrame        # (row, periode) nomor dokumen, posisi atas semua baris
+    n_rows: int                  # jumlah semua baris data
+    fb_tokens: pd.DataFrame      # FB: token Id Document (row, token, is_jmh); FL: None
+    token_periode: pd.DataFrame  # FB: (row token, periode); FL: None
+
+
+class _SheetChunks:
+    """Hasil streaming satu sheet yang tumbuh per chunk (lihat `stream_sheet`)."""
+
+    def __init__(self, header, is_fb, cabang, memo):
+        self.header, self.is_fb, self.cabang, self.memo = header, is_fb, cabang, memo
+        self.frame = _ColumnChunks(is_fb)
+        self.keys = _ColumnChunks(is_fb) if cabang is not None else None
+        self.periode, self.fb_tokens, self.token_periode = [], [], []
+        self.n_rows = self.n_tokens = 0
+
+    def add(self, rows):
+        df, keys = _clean_chunk(rows, self.header, self.is_fb, self.cabang)
+        self.frame.append(df)
+        if keys is not None:
+            self.keys.append(keys)
+
+        # Klasifikasi dokumen per chunk: kode bulan '/yymm/' per baris (dan per token FB)
+        doc = (df if keys is None else keys)["Id Document" if self.is_fb else "No Dokumen"]
+        pairs = periode_pairs(doc, self.memo)
+        pairs["row"] += self.n_rows
+        self.periode.append(pairs)
+        if self.is_fb:
+            tokens = document_tokens(doc)
+            token_pairs = periode_pairs(tokens["token"], self.memo)
+            tokens["row"] += self.n_rows
+            token_pairs["row"] += self.n_tokens
+            self.fb_tokens.append(tokens)
+            self.token_periode.append(token_pairs)
+            self.n_tokens += len(tokens)
+        self.n_rows += len(doc)
+
+    def result(self):
+        return StreamedSheet(
+            frame=self.frame.frame(),
+            keys=self.keys.frame() if self.keys is not None else None,
+            periode=pd.concat(self.periode, ignore_index=True),
+            n_rows=self.n_rows,
+            fb_tokens=pd.concat(self.fb_tokens, ignore_index=True) if self.is_fb else None,
+            token_periode=pd.concat(self.token_periode, ignore_index=True) if self.is_fb else None,
+        )
+
+
+def stream_sheet(source, plan, chunk_rows=CHUNK_ROWS, cabang=None, memo=None):
+    """
+    Membaca satu sheet per chunk `chunk_rows` baris: baris yang terisi kurang
+    dari MIN_FILLED dilewati dan header dipromosikan sekali. Setiap chunk
+    langsung diproses: kolom turunan, klasifikasi nomor dokumen ke kode bulan
+    (bagian `DocIndex`, teks di `memo` tidak di-parse ulang), dan pemangkasan
+    cabang (baris di luar `cabang` dibuang, hanya kolom kuncinya disimpan).
+    Mengembalikan `StreamedSheet`.
+    """
+    header, buffer, sheet = None, [], None
+    with stage(f"stream_sheet {plan.sheet_name}") as record:
+        for filled, row in _iter_planned_rows(source, plan):
+            if filled < MIN_FILLED:
+                continue
+            if header is None:
+                header = row
+                sheet = _SheetChunks(header, plan.is_fb, cabang, memo)
+                continue
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                sheet.add(buffer)
+                buffer = []
+        if header is None:
+            raise KBMInputError(f"Sheet '{plan.sheet_name}' tidak memiliki baris header.")
+        if buffer or not sheet.n_rows:
+            sheet.add(buffer)
+        record.rows = sheet.n_rows
+        return sheet.result()
+
+
+def _load_streaming(data, name, plans, chunk_rows, cabang, memo):
+    source = _XlsRows(data) if name.endswith(".xls") else _XlsxRows(data)
+    try:
+        sheets = {field: stream_sheet(source, plans[field], chunk_rows, cabang, memo) for field in SHEET_FIELDS}
+    finally:
+        source.close()
+    fb = sheets["FB_clean"]
+    doc_index = DocIndex(
+        periode={field: sheet.periode for field, sheet in sheets.items()},
+        n_rows={field: sheet.n_rows for field, sheet in sheets.items()},
+        fb_tokens=fb.fb_tokens,
+        token_periode=fb.token_periode,
+    )
+    kbm = KBMData(*(sheets[field].frame for field in SHEET_FIELDS), doc_index=doc_index)
+    if cabang is None:
+        return kbm
+    return kbm._replace(cabang=tuple(cabang), keys={field: sheet.keys for field, sheet in sheets.items()})
+
+
+def load_kbm_streaming(data, name, chunk_rows=CHUNK_ROWS, cabang=None, memo=None):
+    """
+    Memuat DATA_KBM per chunk (lihat `stream_sheet`).
+
+    Tanpa `cabang` hasilnya sama dengan `load_kbm`. Dengan `cabang`, sheet
+    hanya berisi baris cabang tersebut; kolom kunci lintas cabang
+    (SCOPE_KEY_COLS_*) semua baris disimpan di `KBMData.keys`, dan
+    `KBMData.cabang` mencatat cakupannya sehingga `process_period` menolak
+    cabang di luarnya. Hasil bercakupan tidak boleh disimpan di cache unggahan.
+    """
+    _check_extension(name)
+    with pd.ExcelFile(io.BytesIO(data), **_excel_kwargs(name)) as xl:
+        plans = detect_layout(xl)
+    return _load_streaming(data, name, plans, chunk_rows, cabang, memo)
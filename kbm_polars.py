@@ -0,0 +1,362 @@
+"""
+Backend Polars: langkah per periode sebagai rencana lazy (`pl.LazyFrame`).
+
+`process_period(..., backend="polars")` (atau KBM_BACKEND=polars) menjalankan
+langkah berikut sebagai rencana lazy yang dieksekusi multi-thread di atas
+kolom Arrow, tanpa frame antara pandas:
+
+- syarat status semua sheet (`status_masks`, empat rencana lewat `collect_all`);
+- tarif FB (`tarif_costs`): left join ke tabel list_tarif, biaya = Qty x tarif;
+- List JMH (`list_jmh`): gabungan FL/FL1/FL2 dan token FB bulan berikutnya,
+  drop_duplicates, deduplikasi (No Dokumen, vesvoy), dan sort;
+- Status_dokumen FB (`document_status`): token Id Document (split, explode,
+  strip) dibuat sekali per sheet, lalu per periode hanya dicek `is_in`;
+- jurnal NO JMH (`journal`): gabungan baris NO_DOC FL/FL1/FL2, join
+  list_COA, unpivot biaya FB, jumlah ACCRUE per cabang (group_by), urut, dan
+  pembuangan baris nol; jurnal FL dan FB dijalankan dalam satu `collect`.
+
+Hasil dikonversi ke pandas (`to_pandas`) hanya di akhir, lalu tipenya
+disamakan dengan backend pandas (kosong = NaN, kolom_1 campuran angka/teks),
+sehingga JMH_gabungan dan FULL_NO_JMH identik (termasuk dtype). dfs_FL dan
+dfs_FB tetap disusun dari baris DataFrame pandas oleh `process_period`: blok
+detail memuat semua kolom sheet, yang bisa bertipe campuran dan tidak selalu
+utuh bila bolak-balik lewat Arrow. Workbook juga tetap dimuat ke pandas; untuk
+file yang terlalu besar gunakan load streaming (kbm_loader).
+
+Kolom sheet, tabel token, list_COA, dan list_tarif dikonversi sekali per
+objek dan dipakai ulang oleh semua periode (mode batch / cache hasil); per
+periode hanya mask dan kode status (numpy) yang ditambahkan ke rencana.
+"""
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from kbm_engine import (
+    COA_FB, COA_STVDR, COA_STVDR_MT, FB_JOURNAL_COLS, FL_FIELDS, FL_JOURNAL_COLS, STATUS_DOKUMEN,
+    Backend, StatusMasks, all_cabang_dict, ordered_cols,
+)
+from kbm_profile import profiled
+from kbm_reference import TARIF_COLS
+
+# Konversi per (id objek, nama); entri dihapus saat objeknya dibebaskan
+_memo = {}
+_lock = threading.Lock()
+
+
+def _to_polars(values):
+    """Kolom pandas -> Series Polars teks; NaN/None menjadi null."""
+    try:
+        series = pl.from_pandas(values)
+    except (TypeError, ValueError):
+        # Kolom campuran (angka & teks): teks seperti astype(str), NaN tetap null
+        as_text = values.astype(str).where(values.notna(), None)
+        series = pl.Series(as_text.to_numpy(dtype=object), dtype=pl.Utf8)
+    return series if series.dtype == pl.Utf8 else series.cast(pl.Utf8)
+
+
+def _memoized(obj, name, build):
+    """`build()` untuk `obj` (sheet, tabel referensi), dihitung sekali per objek."""
+    key = (id(obj), name)
+    with _lock:
+        value = _memo.get(key)
+    if value is None:
+        value = build()
+        with _lock:
+            if key not in _memo:
+                _memo[key] = value
+                weakref.finalize(obj, _memo.pop, key, None)
+    return value
+
+
+def _column(df, col):
+    """Kolom `col` dari sheet `df` sebagai Arrow (dikonversi sekali per DataFrame)."""
+    return _memoized(df, col, lambda: _to_polars(df[col]).alias(col))
+
+
+def _number(df, col):
+    """Kolom angka `col` sebagai Float64; NaN menjadi null (dilewati sum, seperti pandas)."""
+    return _memoized(df, ("number", col), lambda: pl.Series(col, df[col].to_numpy(dtype=float), nan_to_null=True))
+
+
+def _frame(df, columns, numbers=(), **extra):
+    return pl.DataFrame(
+        [_column(df, col) for col in columns]
+        + [_number(df, col) for col in numbers]
+        + [pl.Series(k, v) for k, v in extra.items()]
+    )
+
+
+def _rows(df, columns, mask, numbers=()):
+    """Rencana lazy baris `mask` (numpy bool) dari sheet `df`."""
+    return _frame(df, columns, numbers, keep=np.asarray(mask, dtype=bool)).lazy().filter("keep").drop("keep")
+
+
+def _isin(expr, values):
+    return expr.is_in(pl.Series(list(values), dtype=pl.Utf8).implode())
+
+
+def _to_pandas(frame):
+    """Hasil akhir -> pandas; kosong pada kolom teks menjadi NaN seperti backend pandas."""
+    df = frame.to_pandas()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+def status_masks(kbm, next_fl1, next_fl2, full_list, list_port, list_cy):
+    """`StatusMasks` dari empat rencana lazy yang dijalankan bersamaan (`collect_all`)."""
+    port = pl.col("Port Id")
+
+    fl_no_doc = pl.col("Jenis Dokumen") == "-"
+    fl = _frame(kbm.FL_clean, ["Port Id", "Jenis Dokumen", "Status"]).lazy().select(
+        in_fl=_isin(port, full_list),
+        fl_no_doc_port=fl_no_doc & _isin(port, list_port) & _isin(pl.col("Status"), ["EMPTY", "-"]),
+        fl_no_doc_cy=fl_no_doc & _isin(port, list_cy) & _isin(pl.col("Status"), ["EMPTY", "-", "FULL"]),
+    )
+    fl1 = _frame(kbm.FL1_clean, ["Port Id"], next=next_fl1).lazy().select(
+        keep_fl1=pl.col("next") & _isin(port, full_list),
+    )
+    fl2 = _frame(kbm.FL2_clean, ["Port Id"], next=next_fl2).lazy().select(
+        keep_fl2=pl.col("next") & _isin(port, full_list),
+    )
+
+    fb_no_doc = (pl.col("Id Document") == "-") | pl.col("Id Document").is_null()
+    type_size = pl.col("Type Size Name")
+    fb = _frame(kbm.FB_clean, ["Port Id", "Id Document", "Type Size Name"]).lazy().select(
+        in_fb=_isin(port, full_list),
+        fb_no_doc_port=fb_no_doc & _isin(port, list_port) & type_size.str.contains("MT"),
+        fb_no_doc_cy=fb_no_doc & _isin(port, list_cy) & type_size.str.contains("MT|FL|-"),
+    )
+
+    # null (NaN di pandas) tidak pernah memenuhi syarat, sama seperti perbandingan pandas
+    masks = {}
+    for frame in pl.collect_all([fl, fl1, fl2, fb]):
+        for name in frame.columns:
+            masks[name] = frame[name].fill_null(False).to_numpy()
+    return StatusMasks(**masks)
+
+
+def _tarif_table(tarif):
+    """TarifMatrix -> tabel (Port Id, Type Size Name, TARIF_COLS) kombinasi yang ada."""
+    p, s = np.nonzero(tarif.known)
+    return pl.DataFrame(
+        [
+            pl.Series("Port Id", tarif.ports.to_numpy(dtype=object)[p], dtype=pl.Utf8),
+            pl.Series("Type Size Name", tarif.sizes.to_numpy(dtype=object)[s], dtype=pl.Utf8),
+        ]
+        + [pl.Series(col, tarif.rates[p, s, i]) for i, col in enumerate(TARIF_COLS)]
+        + [pl.Series("found", np.ones(len(p), dtype=bool))]
+    )
+
+
+def tarif_costs(FB_sheet, tarif):
+    """Seperti `kbm_engine.tarif_costs`: left join ke list_tarif lalu Qty x tarif."""
+    table = _memoized(tarif.rates, "tarif", lambda: _tarif_table(tarif))
+    qty = pl.col("Qty Angkatan")
+    frame = (
+        _frame(FB_sheet, ["Port Id", "Type Size Name"], numbers=["Qty Angkatan"]).lazy()
+        .join(table.lazy(), on=["Port Id", "Type Size Name"], how="left", maintain_order="left")
+        .select([(qty * pl.col(col)).alias(col) for col in TARIF_COLS] + [pl.col("found").fill_null(False)])
+        .collect()
+    )
+    # null (tarif tidak ada / Qty kosong) menjadi NaN seperti perkalian numpy
+    return frame.select(TARIF_COLS).to_numpy().astype(float, order="C"), frame["found"].to_numpy()
+
+
+@profiled("list_jmh")
+def list_jmh(kbm, doc_index, next_fl, next_fl1, next_fl2, kode_yymm, full_list):
+    """Seperti `kbm_engine.build_list_jmh`, sebagai satu rencana lazy."""
+    cols = ["Port Id", "No Dokumen", "vesvoy"]
+    list_fl = pl.concat([
+        _rows(kbm.key_frame(field), cols, mask)
+        for field, mask in zip(FL_FIELDS, (next_fl, next_fl1, next_fl2))
+    ]).unique(keep="first", maintain_order=True).with_columns(sumber=pl.lit("FL"))
+
+    # Token Id Document FB yang bertipe JMH dan ber-kode bulan berikutnya
+    tokens = doc_index.fb_tokens
+    selected = tokens["is_jmh"].to_numpy() & doc_index.token_mask(kode_yymm)
+    FB_keys = kbm.key_frame("FB_clean")
+    keys = _frame(FB_keys, ["Port Id", "vesvoy"], row=np.arange(len(FB_keys), dtype=np.int32))
+    list_fb = (
+        _frame(tokens, ["token"], row=tokens["row"].to_numpy(dtype=np.int32), keep=selected).lazy()
+        .filter("keep")
+        .join(keys.lazy(), on="row", how="left", maintain_order="left")
+        .select("Port Id", pl.col("token").alias("No Dokumen"), "vesvoy")
+        .unique(keep="first", maintain_order=True)
+        .with_columns(sumber=pl.lit("FB"))
+    )
+
+    JMH_gabungan = _to_pandas(
+        pl.concat([list_fl, list_fb])
+        .unique(subset=["No Dokumen", "vesvoy"], keep="first", maintain_order=True)
+        .sort(["Port Id", "No Dokumen"], nulls_last=True, maintain_order=True)
+        .with_columns(keep=_isin(pl.col("Port Id"), full_list).fill_null(False))
+        .collect()
+    )
+    return JMH_gabungan[JMH_gabungan.pop("keep").to_numpy()]
+
+
+def _document_tokens(FB_sheet):
+    """(valid per baris, tabel row/token) untuk Id Document sheet FB."""
+    docs = pl.DataFrame([_column(FB_sheet, "Id Document").alias("doc")]).with_row_index("row")
+    valid = pl.col("doc").is_not_null() & (pl.col("doc").str.strip_chars() != "-")
+    is_valid = docs.select(valid.fill_null(False))["doc"].to_numpy()
+    tokens = (
+        docs.lazy()
+        .filter(valid)
+        .select("row", token=pl.col("doc").str.split(","))
+        .explode("token")
+        .select("row", pl.col("token").str.strip_chars())
+        .collect()
+    )
+    return is_valid, tokens
+
+
+@profiled("document_status")
+def document_status(FB_sheet, rows, dokumen_index):
+    """Seperti `kbm_engine.document_status_rows`; token per sheet dipakai ulang antar periode."""
+    is_valid, tokens = _memoized(FB_sheet, "document_tokens", lambda: _document_tokens(FB_sheet))
+    dokumen = pl.Series(dokumen_index.to_numpy(dtype=object), dtype=pl.Utf8)
+    hit_rows = (
+        tokens.lazy()
+        .filter(pl.col("token").is_in(dokumen.implode()))
+        .select(pl.col("row").unique())
+        .collect()["row"]
+        .to_numpy()
+    )
+    found = np.zeros(len(is_valid), dtype=bool)
+    found[hit_rows] = True
+    status = np.where(is_valid[rows], np.where(found[rows], "hide", "show"), None)
+    return pd.Series(status, dtype=object).astype(pd.CategoricalDtype(STATUS_DOKUMEN))
+
+
+def _coa_table(list_COA):
+    return pl.DataFrame([
+        _to_polars(list_COA.index.to_series()).alias("Kode ACC"),
+        _to_polars(list_COA["COA"]).alias("COA"),
+    ])
+
+
+def _compensated_sum(values):
+    """
+    Jumlah berurutan dengan kompensasi Kahan, langkah demi langkah sama dengan
+    groupby().sum() pandas. sum Polars menjumlah dengan urutan lain sehingga
+    total ACCRUE bisa berbeda di digit terakhir.
+    """
+    total = compensation = 0.0
+    for value in values:
+        y = value - compensation
+        t = total + y
+        compensation = t - total - y
+        if compensation != compensation:
+            # Nilai tak hingga: kompensasi NaN diabaikan seperti pandas
+            compensation = 0.0
+        total = t
+    return total
+
+
+def _group_sum(debit):
+    return pl.Series([_compensated_sum(debit.drop_nulls().to_list())], dtype=pl.Float64)
+
+
+def _journal(lines, keterangan, tanggal_akhir):
+    """
+    Rencana `kbm_engine.build_journal`: baris debit + ACCRUE per cabang, urut
+    (Port Id, KODE), baris nol dibuang. Kolom "port" berisi Port Id asal dan
+    "first" menandai baris pertama tiap cabang (sebelum baris nol dibuang).
+    """
+    columns = ["Port Id", "Keperluan", "vesvoy", "Debit", "COA", "Kredit", "COA-K", "KODE"]
+    lines = lines.with_columns(Kredit=pl.lit(0.0), KODE=pl.lit(1, dtype=pl.Int8), **{"COA-K": pl.lit("-")})
+    accrue = (
+        lines.filter(pl.col("Port Id").is_not_null())
+        .group_by("Port Id")
+        .agg(Kredit=pl.col("Debit").map_batches(_group_sum, return_dtype=pl.Float64, returns_scalar=True))
+        .with_columns(
+            Keperluan=pl.lit(keterangan), vesvoy=pl.lit("-"), Debit=pl.lit(0.0), COA=pl.lit("-"),
+            KODE=pl.lit(3, dtype=pl.Int8), **{"COA-K": pl.lit("3XX.01.12")},
+        )
+    )
+
+    port = pl.col("Port Id")
+    first = pl.col("first")
+    blank = pl.lit("")
+    return (
+        pl.concat([lines.select(columns), accrue.select(columns)])
+        .sort(["Port Id", "KODE"], nulls_last=True, maintain_order=True)
+        .with_columns(first=port.is_first_distinct() & port.is_not_null())
+        # Debit kosong (NaN) tetap ditulis, sama seperti NaN != 0 di pandas
+        .filter((pl.col("Debit") + pl.col("Kredit") != 0).fill_null(True))
+        .select(
+            tanggal=pl.when(first).then(pl.lit(tanggal_akhir)).otherwise(blank),
+            **{"Port Id": pl.when(first).then(port.replace_strict(all_cabang_dict, default=None, return_dtype=pl.Utf8))},
+            nama_jurnal=pl.when(first).then(pl.lit(keterangan)).otherwise(blank),
+            A=pl.when(first).then(pl.when(port == "SBY").then(pl.lit("B")).otherwise(pl.lit("A"))).otherwise(blank),
+            first=first,
+            Keperluan="Keperluan", KODE="KODE", vesvoy="vesvoy", Debit="Debit", Kredit="Kredit",
+            COA="COA", **{"COA-K": "COA-K"}, port=port,
+        )
+    )
+
+
+@profiled("no_jmh_journal")
+def journal(kbm, no_doc, fb_costs, list_COA, input_bulan, input_tahun, tanggal_akhir):
+    """Seperti `kbm_engine.no_jmh_journal`: jurnal FL dan FB dalam satu rencana lazy."""
+    # FL: baris NO_DOC FL, FL1, FL2 digabung, lalu join list_COA (kunci ganda = baris ganda)
+    text_cols = [col for col in FL_JOURNAL_COLS if col != "Sub Total"]
+    fl_lines = (
+        pl.concat([
+            _rows(getattr(kbm, field), text_cols, no_doc[field], numbers=["Sub Total"])
+            for field in FL_FIELDS if field == "FL_clean" or no_doc[field].any()
+        ])
+        .select(
+            "Port Id",
+            pl.concat_str(
+                ["vesvoy", "Nama Kegiatan", "Ukuran", pl.col("Status").fill_null("nan")], separator=" "
+            ).alias("Keperluan"),
+            "vesvoy",
+            pl.col("Sub Total").alias("Debit"),
+            "Kode ACC",
+        )
+        .join(_memoized(list_COA, "coa", lambda: _coa_table(list_COA)).lazy(),
+              on="Kode ACC", how="left", maintain_order="left")
+        .drop("Kode ACC")
+    )
+
+    # FB: biaya per baris (tarif dari `fb_costs`) di-unpivot menjadi baris jurnal
+    costs = {col: fb_costs[:, i] for i, col in enumerate(TARIF_COLS)}
+    fb = (
+        _frame(kbm.FB_clean, FB_JOURNAL_COLS, keep=no_doc["FB_clean"], **costs).lazy()
+        .filter("keep")
+        .with_columns(pl.col(TARIF_COLS).fill_nan(None))
+        .select(
+            "Port Id",
+            pl.concat_str(["vesvoy", "Type Size Name"], separator=" ").alias("Keperluan"),
+            "vesvoy",
+            *TARIF_COLS,
+        )
+        .unpivot(index=["Port Id", "Keperluan", "vesvoy"], on=TARIF_COLS, variable_name="biaya", value_name="Debit")
+    )
+    biaya = pl.col("biaya")
+    is_mt = pl.col("Keperluan").str.contains("MT", literal=True).fill_null(False)
+    fb_lines = fb.select(
+        "Port Id", "Keperluan", "vesvoy", "Debit",
+        COA=pl.when(biaya == "STVDR").then(pl.when(is_mt).then(pl.lit(COA_STVDR_MT)).otherwise(pl.lit(COA_STVDR)))
+        .when(biaya == "HAULAGE").then(pl.lit(COA_FB["HAULAGE"]))
+        .otherwise(pl.lit(COA_FB["LOLO BM"])),
+    )
+
+    jurnal = _to_pandas(pl.concat([
+        _journal(fl_lines, f"ACCRUE {input_bulan} {input_tahun}", tanggal_akhir),
+        _journal(fb_lines, f"ACCRUE XYZ {input_bulan} {input_tahun}", tanggal_akhir),
+    ]).collect())
+    first = jurnal.pop("first").to_numpy(dtype=bool)
+    port = jurnal.pop("port").to_numpy()
+    jurnal["kolom_1"] = pd.Series("", index=jurnal.index, dtype=object).mask(first, 1)
+    return jurnal[ordered_cols], port
+
+
+POLARS_BACKEND = Backend(status_masks, tarif_costs, list_jmh, document_status, journal)
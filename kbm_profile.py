@@ -0,0 +1,229 @@
+"""
+Instrumentasi per tahap (waktu, jumlah baris, puncak memori) untuk satu run.
+
+Tahap dicatat lewat `stage("nama")` (context manager) atau dekorator
+`profiled("nama")`. Profiler aktif per thread/konteks lewat `contextvars`,
+sehingga job paralel tidak tercampur. Bila tidak ada profiler aktif, `stage`
+hanya mengembalikan objek kosong yang sama (satu lookup contextvar), jadi
+tidak ada overhead berarti saat profiling dimatikan.
+
+Puncak memori memakai tracemalloc, yang berlaku global untuk seluruh proses:
+selama aktif, setiap alokasi di semua thread ikut melambat dan puncaknya
+tercampur. Karena itu hanya satu profiler yang boleh menelusuri memori pada
+satu waktu; profiler lain berjalan tanpa memori (peak_mb kosong, meta
+"memory" = False). Di server, kbm_jobs hanya meminta memori bila tidak ada
+job lain yang sedang berjalan, dan menghentikannya (`release_tracing`) begitu
+job lain mulai, sehingga job pengguna lain tidak ikut melambat; tahap yang
+selesai sesudahnya tercatat tanpa peak_mb.
+
+Hasil dapat ditampilkan di UI (`Profiler.to_frame`) dan ditulis sebagai log
+JSON + CSV (`write_run_log`) untuk memantau regresi dan kapasitas.
+"""
+import contextvars
+import csv
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+from kbm_reference import CACHE_DIR
+
+# Profiling untuk semua run (UI dan CLI) dapat dinyalakan lewat environment
+PROFILE_ENABLED = os.environ.get("KBM_PROFILE", "0") == "1"
+RUN_LOG_DIR = os.environ.get("KBM_RUN_LOG_DIR", os.path.join(CACHE_DIR, "runs"))
+
+_current = contextvars.ContextVar("kbm_profiler", default=None)
+
+# tracemalloc bersifat global per proses: dipakai eksklusif oleh satu profiler
+# (reset_peak profiler lain akan merusak puncak memorinya)
+_tracing_lock = threading.Lock()
+_tracing_owner = None
+
+
+def _start_tracing(profiler):
+    """True bila `profiler` mendapat tracemalloc; False bila sudah dipakai pihak lain."""
+    global _tracing_owner
+    with _tracing_lock:
+        if _tracing_owner is not None or tracemalloc.is_tracing():
+            return False
+        tracemalloc.start()
+        _tracing_owner = profiler
+        return True
+
+
+def _stop_tracing(profiler):
+    global _tracing_owner
+    with _tracing_lock:
+        if _tracing_owner is profiler:
+            tracemalloc.stop()
+            _tracing_owner = None
+
+
+def release_tracing():
+    """Menghentikan tracemalloc milik profiler mana pun; tahap berikutnya tanpa memori."""
+    global _tracing_owner
+    with _tracing_lock:
+        if _tracing_owner is not None:
+            tracemalloc.stop()
+            _tracing_owner.memory = False
+            _tracing_owner.meta["memory"] = False
+            _tracing_owner = None
+
+
+class _NullStage:
+    """Pengganti stage saat profiling mati: tidak mencatat apa pun."""
+    __slots__ = ()
+    # `stage.rows = n` tetap boleh ditulis, tetapi diabaikan
+    rows = property(lambda self: None, lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+        self.peak = 0
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.profiler._exit(self, seconds)
+        return False
+
+
+class Profiler:
+    """
+    Pencatat tahap untuk satu run; dipakai sebagai context manager
+    (`with Profiler() as prof: ...`). `memory=True` memakai tracemalloc untuk
+    puncak memori per tahap (lebih lambat; matikan untuk timing murni) bila
+    tidak sedang dipakai profiler lain.
+
+    Setiap record: stage, depth (0 = tahap terluar), seconds, rows (baris
+    masukan bila diketahui), dan peak_mb (termasuk tahap anaknya).
+    """
+
+    def __init__(self, memory=True, meta=None):
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.memory = memory
+        self.meta = dict(meta or {})
+        self.records = []
+        self._stack = []
+
+    def stage(self, name, rows=None):
+        return _Stage(self, name, rows)
+
+    def _enter(self, stage):
+        if self.memory:
+            # Puncak tahap induk disimpan dulu sebelum di-reset untuk tahap anak
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(stage)
+
+    def _exit(self, stage, seconds):
+        self._stack.pop()
+        if self.memory:
+            stage.peak = max(stage.peak, tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, stage.peak)
+        self.records.append({
+            "stage": stage.name,
+            "depth": len(self._stack),
+            "seconds": round(seconds, 6),
+            "rows": stage.rows,
+            "peak_mb": round(stage.peak / 2**20, 3) if self.memory else None,
+        })
+
+    def __enter__(self):
+        if self.memory and not _start_tracing(self):
+            self.memory = False
+        self.meta["memory"] = self.memory
+        self._token = _current.set(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.total_seconds = time.perf_counter() - self._t0
+        _current.reset(self._token)
+        if self.memory:
+            _stop_tracing(self)
+        return False
+
+    def to_frame(self):
+        """Tabel tahap (urut selesai) untuk ditampilkan di UI."""
+        frame = pd.DataFrame(self.records, columns=["stage", "depth", "seconds", "rows", "peak_mb"])
+        return frame.astype({"rows": "Int64"})
+
+    def write_run_log(self, directory=RUN_LOG_DIR):
+        """
+        Menulis `<run_id>.json` (meta + semua tahap) dan menambah baris ke
+        `runs.csv` (satu baris per tahap). Mengembalikan path file JSON.
+        """
+        os.makedirs(directory, exist_ok=True)
+        payload = {
+            "run_id": self.run_id,
+            "meta": self.meta,
+            "total_seconds": round(getattr(self, "total_seconds", 0.0), 6),
+            "stages": self.records,
+        }
+        json_path = os.path.join(directory, f"{self.run_id}.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2, default=str)
+
+        csv_path = os.path.join(directory, "runs.csv")
+        fields = ["run_id", "stage", "depth", "seconds", "rows", "peak_mb"]
+        new_file = not os.path.exists(csv_path)
+        with open(csv_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if new_file:
+                writer.writeheader()
+            for record in self.records:
+                writer.writerow({"run_id": self.run_id, **record})
+        return json_path
+
+
+def stage(name, rows=None):
+    """Context manager tahap pada profiler aktif (atau tanpa efek bila tidak ada)."""
+    profiler = _current.get()
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name, rows)
+
+
+def _row_count(args):
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            return len(arg)
+    return None
+
+
+def profiled(name):
+    """Dekorator: seluruh pemanggilan fungsi dicatat sebagai tahap `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = _current.get()
+            if profiler is None:
+                return fn(*args, **kwargs)
+            with profiler.stage(name, _row_count(args)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,193 @@
+"""
+Lapisan data referensi (list_COA.xlsx dan list_tarif.xlsx).
+
+Setiap file hanya di-parse sekali: hasil kompilasinya (list_COA ber-index
+`Nama Kegiatan` dan matriks tarif per (Port Id, Type Size Name)) disimpan di memori proses
+dan sebagai snapshot biner di `CACHE_DIR`. Cache hanya dianggap basi jika
+mtime/ukuran file berubah DAN isi file (sha256) ikut berubah, sehingga semua
+run dan semua sesi Streamlit dalam satu proses berbagi objek yang sama, dan
+proses baru cukup membaca snapshot tanpa openpyxl.
+"""
+import hashlib
+import os
+import threading
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COA_PATH = os.path.join(BASE_DIR, "list_COA.xlsx")
+TARIF_PATH = os.path.join(BASE_DIR, "list_tarif.xlsx")
+CACHE_DIR = os.environ.get("KBM_CACHE_DIR", os.path.join(BASE_DIR, ".kbm_cache"))
+
+_REF_DIR = os.path.join(CACHE_DIR, "reference")
+
+
+# Kolom biaya pada list_tarif (urutan sumbu terakhir TarifMatrix.rates)
+TARIF_COLS = ["STVDR", "HAULAGE", "LOLO BM"]
+
+
+def _codes(index, values):
+    """Posisi tiap nilai di `index` (-1 jika tidak ada); category cukup dicari per kategori."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        per_category = index.get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, per_category[codes], -1)
+    return index.get_indexer(values)
+
+
+class TarifMatrix(NamedTuple):
+    """
+    list_tarif sebagai array ber-kode integer: `rates[port, size]` berisi
+    tarif STVDR/HAULAGE/LOLO BM, `known[port, size]` menandai kombinasi yang
+    ada di list_tarif. Kunci CABANG dipecah menjadi Port Id dan Type Size Name
+    pada spasi pertama (pasangan dari `Port Id + " " + Type Size Name`).
+    """
+    ports: pd.Index
+    sizes: pd.Index
+    rates: np.ndarray
+    known: np.ndarray
+
+    def lookup(self, port_id, type_size):
+        """(tarif [n, 3], ditemukan [n]) untuk setiap baris, dalam satu gather."""
+        p = _codes(self.ports, port_id)
+        s = _codes(self.sizes, type_size)
+        found = (p >= 0) & (s >= 0)
+        found[found] = self.known[p[found], s[found]]
+        rates = np.full((len(p), len(TARIF_COLS)), np.nan)
+        rates[found] = self.rates[p[found], s[found]]
+        return rates, found
+
+
+class ReferenceData(NamedTuple):
+    """Tabel referensi siap pakai; dapat di-unpack sebagai (list_COA, tarif)."""
+    list_COA: pd.DataFrame  # index: Nama Kegiatan, kolom: COA
+    tarif: TarifMatrix      # tarif per (Port Id, Type Size Name)
+
+
+class _Entry(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+    table: object
+
+
+_memo = {}
+_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 isi file (dibaca per blok)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def compile_coa(df):
+    list_COA = df.set_index("Nama Kegiatan")
+    return list_COA[["COA"]]
+
+
+def compile_tarif_matrix(df):
+    # Kunci ganda (mis. MRN) memakai baris pertama
+    df = df.dropna(subset=["CABANG"]).drop_duplicates(subset=["CABANG"])
+    parts = df["CABANG"].astype(str).str.split(" ", n=1)
+    df = df.assign(port=parts.str[0], size=parts.str[1]).dropna(subset=["size"])
+
+    ports = pd.Index(df["port"].unique())
+    sizes = pd.Index(df["size"].unique())
+    p = ports.get_indexer(df["port"])
+    s = sizes.get_indexer(df["size"])
+
+    rates = np.full((len(ports), len(sizes), len(TARIF_COLS)), np.nan)
+    rates[p, s] = df[TARIF_COLS].to_numpy(dtype=float)
+    known = np.zeros((len(ports), len(sizes)), dtype=bool)
+    known[p, s] = True
+    return TarifMatrix(ports, sizes, rates, known)
+
+
+def _read_snapshot(path):
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        # Snapshot rusak/tidak kompatibel: abaikan dan bangun ulang
+        return None
+
+
+def _write_snapshot(path, table):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(table, tmp)
+    os.replace(tmp, path)
+
+
+def load_table(path, compile_fn):
+    """Mengembalikan tabel terkompilasi untuk `path`, memakai cache bila masih valid."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"File penting tidak ditemukan: {path}. Pastikan file ini ada di direktori yang sama."
+        )
+
+    with _lock:
+        entry = _memo.get(path)
+        if entry and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+            return entry.table
+
+        digest = file_digest(path)
+        if entry and entry.digest == digest:
+            # File hanya di-touch, isinya sama
+            _memo[path] = entry._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            return entry.table
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        snapshot = os.path.join(_REF_DIR, f"{name}-{compile_fn.__name__}-{digest[:16]}.pkl")
+        table = _read_snapshot(snapshot) if os.path.exists(snapshot) else None
+        if table is None:
+            table = compile_fn(pd.read_excel(path))
+            _write_snapshot(snapshot, table)
+
+        _memo[path] = _Entry(stat.st_mtime_ns, stat.st_size, digest, table)
+        return table
+
+
+def load_reference(coa_path=COA_PATH, tarif_path=TARIF_PATH):
+    """Memuat list_COA dan matriks tarif dari cache bersama."""
+    return ReferenceData(
+        list_COA=load_table(coa_path, compile_coa),
+        tarif=load_table(tarif_path, compile_tarif_matrix),
+    )
+
+
+def reference_digests(reference):
+    """
+    sha256 file sumber untuk tiap tabel di `reference` (None bila tabel tidak
+    berasal dari cache ini). Dipakai untuk cek basi hasil yang disimpan lintas
+    proses, karena identitas objek tidak bertahan setelah dibaca ulang dari disk.
+    """
+    with _lock:
+        by_table = {id(entry.table): entry.digest for entry in _memo.values()}
+    return tuple(by_table.get(id(table)) for table in reference)
+
+
+def reference_cache_info():
+    """(jumlah tabel, perkiraan byte) di cache memori referensi."""
+    with _lock:
+        tables = [entry.table for entry in _memo.values()]
+    size = 0
+    for table in tables:
+        if isinstance(table, pd.DataFrame):
+            size += int(table.memory_usage(index=True, deep=True).sum())
+        else:
+            size += sum(getattr(part, "nbytes", 0) for part in table)
+    return len(tables), size
+
+
+def clear_reference_cache():
+    """Mengosongkan cache memori (snapshot di disk tetap dipakai ulang)."""
+    with _lock:
+        _memo.clear()
@@ -0,0 +1,317 @@
+"""
+Generator workbook DATA_KBM sintetis untuk pengujian kinerja tanpa data asli.
+
+Tata letak sama dengan file yang diharapkan `run_processing`/`load_kbm`:
+
+1. Sheet 1-3: Format Lama (bulan - 2, bulan - 1, periode saat ini)
+2. Sheet 4: Format Baru
+3. Sheet 5: File ABM (tidak dipakai)
+
+Setiap sheet diawali baris judul dan diakhiri baris total yang harus dibuang
+oleh `dropna(thresh=5)`, dengan baris kosong di tengah data. Dengan
+`sparse_ratio`, sheet mendapat kolom "Keterangan" yang tidak dipakai pipeline
+dan baris jarang yang hanya terisi 5 sel (4 kolom terpakai + Keterangan,
+dipertahankan) atau 4 sel (dibuang), untuk menguji bahwa ambang baris jarang
+dihitung atas seluruh kolom sheet. No Dokumen dan
+Id Document (dipisah koma) memuat kode '/yymm/' bulan sebelumnya, bulan ini,
+dan bulan berikutnya (JMH), sehingga semua status KBM ikut terbentuk.
+Nilai Kode ACC dan Type Size Name diambil dari file referensi agar join COA
+dan lookup tarif berjalan seperti data asli.
+
+Contoh:
+    python kbm_synth.py DATA_KBM_SINTETIS.xlsx --rows 100000 --cabang AMB,BPN,KDR
+"""
+import argparse
+import datetime
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from kbm_engine import (
+    all_cabang_dict,
+    hitung_periode,
+    kode_periode,
+)
+from kbm_loader import SOURCE_COLS_FB, SOURCE_COLS_FL
+from kbm_reference import load_reference
+
+# Urutan sheet di workbook dan bagian dari total baris untuk tiap sheet
+SHEET_NAMES = ("KBM BULAN-2", "KBM BULAN-1", "KBM", "KBM FB", "File ABM")
+ROW_SHARES = {"KBM BULAN-2": 0.15, "KBM BULAN-1": 0.15, "KBM": 0.3, "KBM FB": 0.4}
+
+NAMA_KEGIATAN = ["BIAYA BONGKAR MUAT", "BIAYA LOLO", "BIAYA HAULAGE", "BIAYA STEVEDORING", "BIAYA TRUCKING"]
+JENIS_DOKUMEN = ["JMH", "BS", "BKK"]
+
+# Baris jarang: kolom terpakai yang diisi (kolom terakhir dikosongkan untuk varian yang dibuang)
+SPARSE_COLS_FL = {"Id KBM": None, "Port Id": None, "Jenis Dokumen": "-", "Status": "EMPTY"}
+SPARSE_COLS_FB = {"Id KBM": None, "Port Id": None, "Id Document": "-", "Type Size Name": None}
+
+# Type Size Name yang tidak ada di list_tarif (memicu laporan tarif kosong)
+UNKNOWN_SIZES = ["DISC UC", "-"]
+
+
+def _shift_kode(kode, months):
+    """Kode yymm digeser `months` bulan."""
+    tahun, bulan = divmod(int(kode[:2]) * 12 + int(kode[2:]) - 1 + months, 12)
+    return f"{tahun:02d}{bulan + 1:02d}"
+
+
+def _doc_numbers(rng, jenis, ports, kode_choices, kode_weights):
+    kode = rng.choice(kode_choices, len(ports), p=kode_weights)
+    nomor = rng.integers(1, 100_000, len(ports))
+    return [f"{j}/{p}/{k}/{n:05d}" for j, p, k, n in zip(jenis, ports, kode, nomor)]
+
+
+def _dates(rng, year, month, n):
+    last = pd.Period(f"{year}-{month:02d}").days_in_month
+    days = rng.integers(1, last + 1, n)
+    return [datetime.datetime(year, month, int(d)) for d in days]
+
+
+def _with_junk(rng, frame, blank_ratio):
+    """Header + data dengan baris kosong acak, diapit baris judul dan total."""
+    width = frame.shape[1]
+    rows = frame.to_numpy(dtype=object)
+    rows[pd.isna(rows)] = None
+
+    n_blank = int(len(rows) * blank_ratio)
+    if n_blank:
+        at = np.sort(rng.integers(0, len(rows), n_blank))
+        rows = np.insert(rows, at, np.full(width, None, dtype=object), axis=0)
+
+    def padded(*values):
+        return list(values) + [None] * (width - len(values))
+
+    head = [padded("LAPORAN KBM"), padded(), padded("Periode", "-"), list(frame.columns)]
+    tail = [padded(), padded("Total", None, None, len(frame))]
+    return pd.DataFrame(head + rows.tolist() + tail)
+
+
+def _with_sparse(rng, frame, ratio, used):
+    """Kolom Keterangan (tidak dipakai) dan baris jarang yang disisipkan acak."""
+    frame = frame.assign(Keterangan=None)
+    n = int(len(frame) * ratio)
+    if not n:
+        return frame
+    source = rng.integers(0, len(frame), n)
+    sparse = pd.DataFrame(None, index=range(n), columns=frame.columns, dtype=object)
+    for col, value in used.items():
+        sparse[col] = frame[col].to_numpy(dtype=object)[source] if value is None else value
+    sparse["Id KBM"] = sparse["Id KBM"] + "S"
+    sparse["Keterangan"] = "BARIS JARANG"
+    # Separuh hanya 4 sel terisi: dibuang dropna(thresh=5)
+    sparse.loc[rng.random(n) < 0.5, list(used)[-1]] = None
+
+    position = np.concatenate([np.arange(len(frame)), np.sort(rng.integers(0, len(frame), n)) - 0.5])
+    combined = pd.concat([frame, sparse], ignore_index=True)
+    return combined.iloc[np.argsort(position, kind="stable")].reset_index(drop=True)
+
+
+def _fl_sheet(rng, n, tag, ports, kegiatan, kode_choices, kode_weights, no_doc_ratio, year, month):
+    port = rng.choice(ports, n)
+    no_doc = rng.random(n) < no_doc_ratio
+    jenis = np.where(no_doc, "-", rng.choice(JENIS_DOKUMEN, n))
+    dokumen = np.where(no_doc, "-", _doc_numbers(rng, jenis, port, kode_choices, kode_weights))
+    sub_total = (rng.integers(1, 50, n) * 100_000).astype(float)
+    sub_total[rng.random(n) < 0.02] = np.nan
+    vessel = rng.integers(1, max(2, n // 200), n)
+    frame = pd.DataFrame({
+        "Id KBM": [f"KBM{tag}{i:07d}" for i in range(n)],
+        "Tgl KBM": _dates(rng, year, month, n),
+        "Port Id": port,
+        "TD Month": f"{year}-{month:02d}",
+        "Vessel Id To": [f"KM NUSA {v:03d}" for v in vessel],
+        "Voyage No To": [f"V{v:03d}" for v in rng.integers(1, 60, n)],
+        "Nama Kegiatan": rng.choice(NAMA_KEGIATAN, n),
+        "Jenis": rng.choice(["DRY", "REEFER"], n),
+        "Ukuran": rng.choice(["20", "40"], n),
+        "Status": rng.choice(["EMPTY", "FULL", "-"], n),
+        "Jumlah Container": rng.integers(1, 6, n),
+        "Biaya": (rng.integers(1, 10, n) * 100_000).astype(float),
+        "Sub Total": sub_total,
+        "Jenis Dokumen": jenis,
+        "No Dokumen": dokumen,
+        "Tgl Create Documen": _dates(rng, year, month, n),
+        "Tgl Kasir Documen": _dates(rng, year, month, n),
+        "Created By": rng.choice(["admin", "kasir1", "kasir2"], n),
+        "Port Id From": rng.choice(ports, n),
+        "Port Id To": rng.choice(ports, n),
+        "Kode ACC": rng.choice(kegiatan, n),
+        "Supplier": rng.choice(["PT SUPPLIER A", "PT SUPPLIER B", "CV SUPPLIER C"], n),
+        "Id BS Penyelesaian": "-",
+        "Tgl Kasir Id BS Penyelesaian": "-",
+        "Id BKM": "-",
+    })
+    return frame[SOURCE_COLS_FL], pd.Series(dokumen[~no_doc])
+
+
+def _fb_sheet(rng, n, ports, sizes, fl_documents, kode_choices, kode_weights, no_doc_ratio, year, month):
+    port = rng.choice(ports, n)
+    kind = rng.random(n)
+    tokens_per_row = rng.integers(1, 4, n)
+    n_tokens = int(tokens_per_row.sum())
+    # Sebagian token merujuk dokumen FL (status "hide"), sisanya dokumen baru
+    from_fl = rng.random(n_tokens) < 0.5 if len(fl_documents) else np.zeros(n_tokens, dtype=bool)
+    new_jenis = rng.choice(JENIS_DOKUMEN, n_tokens)
+    tokens = np.array(
+        _doc_numbers(rng, new_jenis, np.repeat(port, tokens_per_row), kode_choices, kode_weights),
+        dtype=object,
+    )
+    if from_fl.any():
+        tokens[from_fl] = rng.choice(fl_documents.to_numpy(dtype=object), int(from_fl.sum()))
+    joined = [", ".join(chunk) for chunk in np.split(tokens, np.cumsum(tokens_per_row)[:-1])]
+    id_document = np.where(kind < no_doc_ratio, "-", np.array(joined, dtype=object))
+    id_document[(kind >= no_doc_ratio) & (kind < no_doc_ratio + 0.05)] = None
+
+    qty = rng.integers(0, 7, n).astype(object)
+    qty[rng.random(n) < 0.01] = "-"
+    vessel = rng.integers(1, max(2, n // 200), n)
+    frame = pd.DataFrame({
+        "No.": np.arange(1, n + 1),
+        "Vessel Id": [f"KM NUSA {v:03d}" for v in vessel],
+        "Voyage No": [f"V{v:03d}" for v in rng.integers(1, 60, n)],
+        "TD": _dates(rng, year, month, n),
+        "Port Id": port,
+        "Load Port": rng.choice(ports, n),
+        "Disc Port": rng.choice(ports, n),
+        "Id Session": [f"S{i:08d}" for i in range(n)],
+        "Vessel Id From": [f"KM NUSA {v:03d}" for v in rng.integers(1, 50, n)],
+        "Voyage No From": [f"V{v:03d}" for v in rng.integers(1, 60, n)],
+        "Vessel Id To": [f"KM NUSA {v:03d}" for v in rng.integers(1, 50, n)],
+        "Voyage No To": [f"V{v:03d}" for v in rng.integers(1, 60, n)],
+        "Port Id From": rng.choice(ports, n),
+        "Port Id To": rng.choice(ports, n),
+        "Type Size Name": rng.choice(sizes, n),
+        "Qty Angkatan": qty,
+        "Nama Vendor": rng.choice(["PT VENDOR A", "PT VENDOR B"], n),
+        "ETS Status": rng.choice(["OK", "PENDING"], n),
+        "Activity System Name": rng.choice(["DISCHARGE", "LOADING"], n),
+        "Id KBM": [f"KBMFB{i:07d}" for i in range(n)],
+        "Tanggal": _dates(rng, year, month, n),
+        "Id Document": id_document,
+    })
+    return frame[SOURCE_COLS_FB]
+
+
+def generate_sheets(n_rows=10_000, cabang=None, bulan="SEPTEMBER", tahun="2025", seed=0,
+                    no_doc_ratio=0.35, next_month_ratio=0.2, blank_ratio=0.01, reference=None,
+                    sparse_ratio=0.0):
+    """
+    Sheet DATA_KBM sintetis sebagai dict nama sheet -> DataFrame mentah
+    (seperti `pd.read_excel(header=None)`), berurutan seperti workbook asli.
+
+    `n_rows` dibagi ke keempat sheet KBM (lihat ROW_SHARES). `cabang` adalah
+    daftar Port Id (default semua `all_cabang_dict`), atau dict Port Id ->
+    bobot untuk campuran cabang yang tidak merata. `next_month_ratio` adalah
+    bagian dokumen yang ber-kode bulan berikutnya (NEXT_MONTH_DOC/JMH).
+    `sparse_ratio` menambah kolom Keterangan dan baris jarang (lihat docstring modul).
+    """
+    rng = np.random.default_rng(seed)
+    if reference is None:
+        reference = load_reference()
+    if cabang is None:
+        cabang = list(all_cabang_dict)
+    if isinstance(cabang, dict):
+        weights = np.asarray(list(cabang.values()), dtype=float)
+        ports = rng.choice(list(cabang), max(len(cabang), 1000), p=weights / weights.sum())
+    else:
+        ports = np.asarray(list(cabang), dtype=object)
+
+    _, kode_next = hitung_periode(bulan, tahun)
+    kode_now = kode_periode(bulan, tahun)
+    kode_choices = [_shift_kode(kode_now, -2), _shift_kode(kode_now, -1), kode_now, kode_next]
+    rest = (1 - next_month_ratio) / 3
+    kode_weights = [rest, rest, rest, next_month_ratio]
+
+    year, month = 2000 + int(kode_now[:2]), int(kode_now[2:])
+    kegiatan = reference.list_COA.index.dropna().unique().to_numpy(dtype=object)
+    sizes = np.concatenate([reference.tarif.sizes.to_numpy(dtype=object), UNKNOWN_SIZES])
+
+    sheets = {}
+    fl_documents = []
+    for offset, name in zip((-2, -1, 0), SHEET_NAMES[:3]):
+        kode = _shift_kode(kode_now, offset)
+        frame, documents = _fl_sheet(
+            rng, int(n_rows * ROW_SHARES[name]), offset + 2, ports, kegiatan, kode_choices, kode_weights,
+            no_doc_ratio, 2000 + int(kode[:2]), int(kode[2:]),
+        )
+        if sparse_ratio:
+            frame = _with_sparse(rng, frame, sparse_ratio, SPARSE_COLS_FL)
+        sheets[name] = _with_junk(rng, frame, blank_ratio)
+        fl_documents.append(documents)
+
+    fb = _fb_sheet(
+        rng, int(n_rows * ROW_SHARES["KBM FB"]), ports, sizes, pd.concat(fl_documents, ignore_index=True),
+        kode_choices, kode_weights, no_doc_ratio, year, month,
+    )
+    if sparse_ratio:
+        fb = _with_sparse(rng, fb, sparse_ratio, SPARSE_COLS_FB)
+    sheets["KBM FB"] = _with_junk(rng, fb, blank_ratio)
+    sheets["File ABM"] = pd.DataFrame([["FILE ABM", None], ["No", "Keterangan"], [1, "tidak dipakai"]])
+    return sheets
+
+
+def write_workbook(sheets, target=None):
+    """
+    Menulis sheet mentah ke .xlsx (openpyxl write-only). `target` berupa path
+    atau objek file; bila None, isi workbook dikembalikan sebagai bytes.
+    """
+    wb = Workbook(write_only=True)
+    for name, frame in sheets.items():
+        ws = wb.create_sheet(title=name)
+        values = frame.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        for row in values.tolist():
+            ws.append(row)
+    if target is not None:
+        wb.save(target)
+        return None
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def generate_workbook(n_rows=10_000, target=None, **kwargs):
+    """`generate_sheets` + `write_workbook` (argumen lain diteruskan ke generate_sheets)."""
+    return write_workbook(generate_sheets(n_rows, **kwargs), target)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Membuat workbook DATA_KBM sintetis.")
+    parser.add_argument("output", help="Path file .xlsx hasil")
+    parser.add_argument("--rows", type=int, default=10_000, help="Total baris KBM keempat sheet (default 10000)")
+    parser.add_argument(
+        "--cabang", default="ALL",
+        help="Port Id dipisah koma, ALL, atau PORT=BOBOT (mis. AMB=5,BPN=1)"
+    )
+    parser.add_argument("--bulan", default="SEPTEMBER")
+    parser.add_argument("--tahun", default="2025")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def parse_cabang(spec):
+    """'ALL', 'AMB,BPN', atau 'AMB=5,BPN=1' -> daftar / dict bobot Port Id."""
+    if spec.strip().upper() == "ALL":
+        return list(all_cabang_dict)
+    items = [c.strip().upper() for c in spec.split(",") if c.strip()]
+    if all("=" in c for c in items):
+        return {port: float(weight) for port, weight in (c.split("=", 1) for c in items)}
+    return items
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    generate_workbook(
+        args.rows, args.output, cabang=parse_cabang(args.cabang),
+        bulan=args.bulan.upper(), tahun=args.tahun, seed=args.seed,
+    )
+    print(f"{args.rows} baris -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
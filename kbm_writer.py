@@ -0,0 +1,218 @@
+"""
+Penulisan hasil `run_processing` ke file Excel OUTPUT_KBM.
+
+Workbook ditulis dalam satu kali jalan memakai mode write-only openpyxl:
+baris blok FL, garis pembatas hitam, blok FB, "List JMH" dan "JURNAL NO JMH"
+di-stream langsung ke file dengan styling yang sudah terpasang, tanpa
+menulis -> load_workbook -> simpan ulang. Dipakai bersama oleh halaman
+Streamlit dan CLI batch.
+
+Selain satu workbook gabungan, hasil dapat diekspor sebagai ZIP berisi satu
+workbook per cabang (`build_branch_zip`): sheet port, List JMH, dan jurnal
+cabang tersebut. Workbook per cabang dirender di satu process pool bersama
+(dibuat sekali per proses server, KBM_EXPORT_WORKERS proses), sehingga waktu
+ekspor mengikuti jumlah core tanpa melebihinya saat beberapa job ZIP berjalan
+bersamaan, dan tiap file jauh lebih ringan dibuka di Excel.
+"""
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+from kbm_profile import profiled
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ZIP_MIME = "application/zip"
+
+# Jumlah proses pool render workbook per cabang, dipakai bersama semua job (0 = jumlah core)
+EXPORT_WORKERS = int(os.environ.get("KBM_EXPORT_WORKERS", "0")) or os.cpu_count() or 1
+
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+# Styling header mengikuti gaya default pandas.DataFrame.to_excel
+_THIN = Side(style="thin")
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+BLACK_FILL = PatternFill(start_color="000000", end_color="000000", fill_type="solid")
+
+
+def output_file_name(input_bulan, input_tahun):
+    return f"OUTPUT_KBM_{input_bulan}_{input_tahun}.xlsx"
+
+
+def _header_cells(ws, columns):
+    cells = []
+    for name in columns:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+
+def _separator_cells(ws, width):
+    cells = []
+    for _ in range(width):
+        cell = WriteOnlyCell(ws)
+        cell.fill = BLACK_FILL
+        cells.append(cell)
+    return cells
+
+
+def _data_rows(df):
+    """Baris DataFrame sebagai list Python; NaN/None/NaT menjadi sel kosong."""
+    if df.empty:
+        return []
+    return df.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def write_frame(ws, df, header=True):
+    """Menambahkan DataFrame (opsional dengan header) ke worksheet write-only."""
+    if header and len(df.columns):
+        ws.append(_header_cells(ws, df.columns))
+    for row in _data_rows(df):
+        ws.append(row)
+
+
+def write_port_sheet(wb, port, df_fl, df_fb):
+    """
+    Menulis satu sheet port: blok FL, 1 baris kosong, garis pembatas hitam,
+    1 baris kosong, lalu blok FB (tata letak sama seperti versi lama).
+    """
+    ws = wb.create_sheet(title=port)
+    write_frame(ws, df_fl)
+
+    width = max(len(df_fl.columns), len(df_fb.columns))
+    ws.append([])
+    ws.append(_separator_cells(ws, width))
+    ws.append([])
+
+    write_frame(ws, df_fb)
+    return ws
+
+
+def write_result(wb, result, prefix=""):
+    """Menulis sheet per port, "List JMH", dan "JURNAL NO JMH" (nama sheet diawali `prefix`)."""
+    dfs_FL, dfs_FB, JMH_gabungan, FULL_NO_JMH, full_list = result[:5]
+
+    # --- Tulis tiap port ---
+    for port in full_list:
+        df_fl = dfs_FL.get(port, pd.DataFrame())
+        df_fb = dfs_FB.get(port, pd.DataFrame())
+        write_port_sheet(wb, f"{prefix}{port}", df_fl, df_fb)
+
+    # --- Tambah sheet List JMH ---
+    write_frame(wb.create_sheet(title=f"{prefix}List JMH"), JMH_gabungan)
+
+    # --- Tambah sheet JURNAL NO JMH ---
+    write_frame(wb.create_sheet(title=f"{prefix}JURNAL NO JMH"), FULL_NO_JMH, header=False)
+
+
+@profiled("save_xlsx")
+def _save(wb):
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+@profiled("write_excel")
+def build_output(result):
+    """Membangun workbook OUTPUT_KBM (sudah distyling) dan mengembalikan buffer-nya."""
+    wb = Workbook(write_only=True)
+    write_result(wb, result)
+    return _save(wb)
+
+
+def batch_file_name(periods):
+    """Nama file gabungan untuk daftar (bulan, tahun) berurutan."""
+    (bulan_awal, tahun_awal), (bulan_akhir, tahun_akhir) = periods[0], periods[-1]
+    return f"OUTPUT_KBM_{bulan_awal}_{tahun_awal}-{bulan_akhir}_{tahun_akhir}.xlsx"
+
+
+@profiled("write_excel")
+def build_batch_output(results):
+    """
+    Satu workbook untuk banyak periode: `results` berisi (kode, AccrualResult)
+    dan setiap sheet diawali kode periodenya (mis. "2509 AMB").
+    """
+    wb = Workbook(write_only=True)
+    for kode, result in results:
+        write_result(wb, result, prefix=f"{kode} ")
+    return _save(wb)
+
+
+def zip_file_name(file_name):
+    """Nama ZIP per cabang untuk nama workbook gabungan `file_name`."""
+    return file_name.replace(".xlsx", ".zip")
+
+
+def branch_file_name(file_name, port):
+    return file_name.replace(".xlsx", f"_{port}.xlsx")
+
+
+def _get_export_pool():
+    """Process pool bersama untuk `build_branch_zip` (dibuat saat pertama dipakai)."""
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is None:
+            _export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+        return _export_pool
+
+
+def _reset_export_pool(pool):
+    """Membuang pool yang rusak (mis. proses worker mati) agar panggilan berikutnya membuat baru."""
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is pool:
+            _export_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_branch(results):
+    """Workbook satu cabang; beberapa periode ditulis seperti `build_batch_output`."""
+    if len(results) == 1:
+        return build_output(results[0][1]).getvalue()
+    return build_batch_output(results).getvalue()
+
+
+@profiled("write_zip")
+def build_branch_zip(branches, file_name, max_workers=None):
+    """
+    ZIP berisi satu workbook per cabang. `branches` berisi
+    (port, [(kode_periode, AccrualResult)]) seperti hasil `split_by_branch`;
+    nama tiap file diturunkan dari `file_name` (mis. OUTPUT_KBM_..._AMB.xlsx).
+
+    Workbook dirender paralel di process pool bersama (KBM_EXPORT_WORKERS
+    proses untuk semua job sekaligus) dan ditulis ke ZIP sesuai urutan
+    `branches` begitu selesai. `max_workers=1` merender di proses ini.
+    """
+    max_workers = min(max_workers or EXPORT_WORKERS, len(branches) or 1)
+    output = io.BytesIO()
+    # xlsx sudah terkompresi: disimpan apa adanya di ZIP
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as zf:
+        jobs = [results for _, results in branches]
+        if max_workers > 1:
+            pool = _get_export_pool()
+            try:
+                rendered = pool.map(_render_branch, jobs)
+                for (port, _), data in zip(branches, rendered):
+                    zf.writestr(branch_file_name(file_name, port), data)
+            except BrokenProcessPool:
+                _reset_export_pool(pool)
+                raise
+        else:
+            for (port, _), data in zip(branches, map(_render_branch, jobs)):
+                zf.writestr(branch_file_name(file_name, port), data)
+    output.seek(0)
+    return output